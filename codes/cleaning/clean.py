@@ -1,25 +1,42 @@
+import os
 import pandas as pd
 from hampel import hampel
-from datetime import datetime
-from src.preprocessing.cleaner import (drop_spaces_data, replace_empty_nans,
-                                       values_treatement)
+from src.preprocessing.cleaner import (values_treatement,
+                                       stream_values_treatement,
+                                       fit_cleaning_state,
+                                       save_cleaning_state,
+                                       load_cleaning_state,
+                                       incremental_values_treatement)
+from src.preprocessing.loader import load_banco_central
 
 # paths
 path_bc = "data/raw/banco_central.csv"
 path_pr = "data/raw/precipitaciones.csv"
 
-# cargar los datos
-df_bank = pd.read_csv(path_bc)
+# cargar los datos, el loader saca espacios, identifica los vacios "a",
+# parsea las fechas y bota las inválidas en una sola lectura
+df_bank = load_banco_central(path_bc)
 df_pr = pd.read_csv(path_pr)
 
-df_bank = drop_spaces_data(df_bank)
-df_bank = replace_empty_nans(df_bank)
-
-date_format = "%Y-%m-%d"
-df_bank = df_bank[df_bank["Periodo"] != "2020-13-01 00:00:00 UTC"]
-df_bank["Periodo"] = df_bank["Periodo"].apply(
-    lambda x: datetime.strptime(str(x[0:10]), date_format))
-
 df = df_bank.copy()
 # limpieza de los datos
 df_bank = values_treatement(df_bank)
+
+# para extracciones grandes que no caben en memoria, limpiar por chunks y
+# escribir directo a disco
+streaming = False
+if streaming:
+    stats = stream_values_treatement(path_bc, "data/clean/banco_central.csv",
+                                     chunksize=100000)
+
+# ingesta mensual: guardar el estado de normalización de la historia y
+# limpiar solo las filas nuevas contra ese estado
+incremental = False
+path_state = "data/clean/cleaning_state.json"
+if incremental:
+    if os.path.exists(path_state):
+        state = load_cleaning_state(path_state)
+        df_new, state = incremental_values_treatement(df, state)
+    else:
+        state = fit_cleaning_state(df)
+    save_cleaning_state(state, path_state)
@@ -1,17 +1,27 @@
-from src.preprocessing.stationarity import stationary_adf_test
+from src.preprocessing.stationarity import (STATIONARITY_CACHE_PATH,
+                                            apply_differencing_plan,
+                                            differencing_search,
+                                            stationary_adf_test,
+                                            stationarity_cache_info)
+import os
 import warnings
-import numpy as np
-import pandas as pd
 from datetime import datetime
+from src.preprocessing.cache import read_csv_cached
 from src.preprocessing.cleaner import actual_nans_df
-from sklearn.impute import KNNImputer
-from sklearn.preprocessing import MinMaxScaler
+from src.preprocessing.feature_engineering import (
+    add_lags, add_column_lags, add_rolling_moments, log_features,
+    compact_dtypes)
+from src.preprocessing.feature_frame import FeatureFrame
+from src.preprocessing.imputation import impute_knn, impute_time_series
+from src.preprocessing.lag_discovery import discover_lags
+from src.preprocessing.missingness import (missingness_index, nan_runs,
+                                           valid_rows)
 warnings.filterwarnings("ignore")
 
 date_format = "%Y-%m-%d"
 path = "data/clean/to_be_featured.csv"
-db = pd.read_csv(path, index_col=0)
-db["date"] = db["date"].apply(lambda x: datetime.strptime(x, date_format))
+# lectura desde el cache columnar mientras el .csv no cambie
+db = read_csv_cached(path, index_col=0, parse_dates=["date"])
 
 # columnas que corresponde a features
 features = list(db.columns)
@@ -38,145 +48,32 @@ features = list(db.columns)
 features.remove("precio_leche")
 features.remove("date")
 
-# solo procesar los features [debo normalizar antes de hacer la imputación]
-x = db[features]
-# Normalizar datos X
-sc = MinMaxScaler(feature_range=(0, 1))
-# training
-x = sc.fit_transform(x)
-
 # hacer imputacion de nans
-# podria imputar con interpolaciones lineales en la serie de tiempo, pero
-# hay periodos que tienen muchos vacios, por tanto voy a hacer alguna técnica
-# fancy de imputación de nans
-imputer = KNNImputer(n_neighbors=5, weights='uniform', metric='nan_euclidean')
-imputer.fit(x)
-x_features = imputer.transform(x)
-x_features = sc.inverse_transform(x_features)
-x_features = pd.DataFrame(x_features, columns=features)
-others = db[["date", "precio_leche"]]
-
-# datos imputados
-db_imputed = pd.concat([others, x_features], axis=1)
+# "knn": MinMaxScaler + KNNImputer sobre los features
+# "seasonal": interpolación en el tiempo de cada serie mensual, siguiendo su
+# forma estacional, y los periodos con muchos vacios (rachas de más de 6
+# meses) se llenan con el promedio de cada mes de la serie. Escala lineal con
+# las filas y columnas, en vez de las distancias entre todas las filas de
+# KNNImputer, pero cambia los valores imputados y con eso los features
+imputer = "knn"
+if imputer == "knn":
+    # mismo resultado que MinMaxScaler + KNNImputer, por bloques con memoria
+    # acotada y en paralelo
+    db_imputed = impute_knn(db, features, n_neighbors=5,
+                            n_jobs=os.cpu_count())
+elif imputer == "seasonal":
+    db_imputed = impute_time_series(db, features, method="seasonal",
+                                    max_gap=6)
+else:
+    raise ValueError(f"Imputador no soportado: {imputer}")
 
 db = db_imputed.copy()
 
-
-def add_lagged_variables(df, columns, nr_of_lags=1):
-    """
-    Agregar variables pasadas del dataframe con el que se esta trabajando
-
-    Parameters
-    ----------
-    df_input : pandas.dataframe
-        Dataframe a operar.
-    nr_of_lags : int
-        Número de steps que quirees ir hacia atrás.
-    columns : list
-        Lista de columas a las cuales agregar variables lagged.
-
-    Returns
-    -------
-    df : pandas.dataframe
-        Dataframe con las variables lag agregadas.
-    """
-
-    for col in columns:
-        lagged_column = col + f'_lagged_{str(nr_of_lags)}'
-        df[lagged_column] = df[col].shift(nr_of_lags)
-    return df
-
-
-def cumulative_simple_stats(df, cols, window=3):
-    """
-    En una ventana temporal de tamaño window, se hace el cálculo de las medias
-    mobiles en el tiempo y desviaciones estandar mobiles, solo para tener en
-    cuenta el tamaño de la ventana debe ser mayor a 2
-
-    Parameters
-    ----------
-    df : pandas.dataframe
-        Dataframe a tratar.
-    cols : list
-        Lista de las columnas en las cuales aplicar stats.
-    window : int, optional
-        Tamaño de la ventana temporal. The default is 3.
-
-    Returns
-    -------
-    df : pandas.dataframe
-        Dataframe con las stats calculadas.
-
-    """
-    df.sort_values(by=['date'], inplace=True)
-    # como se ven estacionalidades, nos centraremos en stats cercanas, al mes
-    # que estamos analizando
-    for columna in cols:
-        # promedio 3 meses
-        name1 = columna + f'_mean_{str(window)}'
-        df[name1] = df[columna].rolling(window=window).mean()
-        # desviacion standar ultimo año
-        name2 = columna + f'_std_{str(window)}'
-        df[name2] = df[columna].rolling(window=window).std()
-    df.reset_index(drop=True, inplace=True)
-    return df
-
-
-def cumulative_distribution_stats(df, cols, window=12):
-    """
-    En una ventana temporal de tamaño window, se hace el cálculo de stats
-    acumulativas como la como promedio y stad
-
-    Parameters
-    ----------
-    df : pandas.dataframe
-        Dataframe a tratar.
-    cols : list
-        Lista de las columnas en las cuales aplicar stats.
-    window : int, optional
-        Tamaño de la ventana temporal. The default is 3.
-
-    Returns
-    -------
-    df : pandas.dataframe
-        Dataframe con las stats calculadas.
-
-    """
-    df.sort_values(by=['date'], inplace=True)
-    # como se ven estacionalidades, nos centraremos en stats cercanas, al mes
-    # que estamos analizando
-    for columna in cols:
-        # promedio 3 meses
-        name1 = columna + f'_kurt_{str(window)}'
-        df[name1] = df[columna].rolling(window=window).kurt()
-        # desviacion standar ultimo año
-        name2 = columna + f'_skew_{str(window)}'
-        df[name2] = df[columna].rolling(window=window).skew()
-    df.reset_index(drop=True, inplace=True)
-    return df
-
-
-def log_features(df, columns):
-    """
-    Agregar logaritmo de las variables
-
-    Parameters
-    ----------
-    df : pandas.dataframe
-        Dataframe a operar.
-    columns : list
-        lista de columas a las cuales agregar variables aplicar log.
-
-    Returns
-    -------
-    df : df
-        Dataframe con las variables agregadas con logaritmo.
-
-    """
-    for col in columns:
-        log_column = 'log_' + col
-        df[log_column] = df[col].apply(lambda x: np.log(x) + 1)
-    return df
+# precisión de todo el pipeline de features, con "float32" los features
+# quedan en float32 y usan cerca de la mitad de memoria
+precision = "float64"
+db = compact_dtypes(db, float_dtype=precision,
+                    downcast_calendar=precision != "float64")
 
 
 db.sort_values(by=["date"], inplace=True, ascending=True)
@@ -185,49 +82,74 @@ db.reset_index(drop=True, inplace=True)
 
 cols = list(db.columns)
 cols.remove("date")
-# lag de 1 mes hacía atrás
-db = add_lagged_variables(db, cols, nr_of_lags=1)
-# lag de un trimestre hacía atrás
-db = add_lagged_variables(db, cols, nr_of_lags=4)
-# lag de 1 año
-db = add_lagged_variables(db, cols, nr_of_lags=12)
-# lag de dos años
-db = add_lagged_variables(db, cols, nr_of_lags=24)
-
-cols_nans = actual_nans_df(db, threshold=50)
+# contenedor columnar con espacio para todos los features: 4 lags, 12
+# estadísticas móviles y el log de cada columna
+db = FeatureFrame(db, capacity=18 * len(cols))
+# índice de nans que se va actualizando solo con las columnas nuevas
+nans_index = missingness_index(db)
+# "fixed": lags de 1 mes, un trimestre, 1 año y dos años hacía atrás para
+# todas las columnas, todos en un solo bloque
+# "discovered": solo los 3 lags más correlacionados con precio_leche de cada
+# columna, hasta 24 meses
+lag_strategy = "fixed"
+if lag_strategy == "fixed":
+    db = add_lags(db, cols, lags=[1, 4, 12, 24])
+elif lag_strategy == "discovered":
+    lag_table, column_lags = discover_lags(db.to_frame(), k=3, max_lag=24)
+    db = add_column_lags(db, column_lags)
+else:
+    raise ValueError(f"Estrategia de lags no soportada: {lag_strategy}")
+
+cols_nans = actual_nans_df(db, threshold=50, index=nans_index)
 print(len(cols_nans))
 print(db.shape)
 
-# estadisticas acumuladas de 3 meses
-db = cumulative_simple_stats(db, cols, window=3)
-# estadisticas acumuladas de 4 meses
-db = cumulative_simple_stats(db, cols, window=4)
-# estadisticas acumuladas de 12 meses
-db = cumulative_simple_stats(db, cols, window=12)
-# estadisticas acumuladas de 24 meses
-db = cumulative_simple_stats(db, cols, window=24)
-
+# estadisticas acumuladas de 3, 4, 12 y 24 meses (promedio y std) y de 12 y
+# 24 meses (kurtosis y skewness), todas en una sola pasada
+db = add_rolling_moments(db, cols, [(3, ("mean", "std")),
+                                    (4, ("mean", "std")),
+                                    (12, ("mean", "std")),
+                                    (24, ("mean", "std")),
+                                    (12, ("kurt", "skew")),
+                                    (24, ("kurt", "skew"))])
 
-cols_nans = actual_nans_df(db, threshold=50)
+cols_nans = actual_nans_df(db, threshold=50, index=nans_index)
 print(len(cols_nans))
 print(db.shape)
 
-# # estadisticas acumuladas de 12 mes
-db = cumulative_distribution_stats(db, cols, window=12)
-# estadisticas acumuladas de 24 mes
-db = cumulative_distribution_stats(db, cols, window=24)
-
 db = log_features(db, cols)
 
-cols_nans = actual_nans_df(db, threshold=50)
+cols_nans = actual_nans_df(db, threshold=50, index=nans_index)
 print(len(cols_nans))
 print(db.shape)
 
-alpha = db.isna().sum()
-db.dropna(inplace=True)
+db = db.to_frame()
+alpha = nan_runs(nans_index)
+db = db[valid_rows(nans_index)]
 print(db.shape)
 
-stationary_test = stationary_adf_test(db, list(db.columns))
+# tests ADF en paralelo, sin imprimir cada columna
+stationary_test = stationary_adf_test(db, list(db.columns),
+                                      n_jobs=os.cpu_count(), verbose=False,
+                                      cache_path=STATIONARITY_CACHE_PATH)
+cache_info = stationarity_cache_info()
+print(f"Tests de estacionaridad desde el cache: {cache_info['hits']} de "
+      f"{cache_info['hits'] + cache_info['misses']} columnas")
 cols_stationaries = list(
     stationary_test[stationary_test["valor_p"] <= 0.05]["columna"])
 cols_stationaries = ["date", "precio_leche"] + cols_stationaries
+
+# "drop": quedarse solo con las columnas estacionarias según ADF
+# "difference": diferenciar cada columna con el menor orden que la hace
+# estacionaria según ADF, KPSS y PP
+stationarity_mode = "drop"
+if stationarity_mode == "drop":
+    db_stationary = db[cols_stationaries]
+elif stationarity_mode == "difference":
+    cols_series = [col for col in db.columns if col != "date"]
+    plan = differencing_search(db, cols_series, n_jobs=os.cpu_count())
+    db_stationary = apply_differencing_plan(db, plan)
+else:
+    raise ValueError(f"Modo de estacionaridad no soportado: "
+                     f"{stationarity_mode}")
+print(db_stationary.shape)
@@ -1,16 +1,10 @@
-import numpy as np
-import pandas as pd
-from datetime import datetime
 from sklearn.linear_model import LinearRegression
-from sklearn.model_selection import TimeSeriesSplit
-from sklearn.metrics import mean_absolute_error
-from sklearn.metrics import mean_squared_error
+from src.modeling.backtesting import backtest, summarize_backtest
+from src.preprocessing.cache import read_csv_cached
 
 path = "data/clean/train.csv"
-db = pd.read_csv(path)
-
-date_format = "%Y-%m-%d"
-db["date"] = db["date"].apply(lambda x: datetime.strptime(x, date_format))
+# lectura desde el cache columnar mientras el .csv no cambie
+db = read_csv_cached(path, parse_dates=["date"])
 db.sort_values(by=["date"], ascending=True, inplace=True)
 
 features = list(db.columns)
@@ -26,18 +20,7 @@ for col in features:
 x = x.to_numpy()
 y = y.to_numpy()
 
-# time series kFold
-tscv = TimeSeriesSplit(n_splits=10)
-
-errors = []
-iteration = 1
-for train_index, test_index in tscv.split(x):
-    print("TRAIN:", train_index, "TEST:", test_index)
-    x_train, x_test = x[train_index], x[test_index]
-    y_train, y_test = y[train_index], y[test_index]
-    lr = LinearRegression().fit(x_train, y_train)
-    y_pred = lr.predict(x_test)
-    mae = mean_absolute_error(y_pred, y_test)
-    mse = mean_squared_error(y_pred, y_test)
-    errors.append([iteration, mae, mse])
-    iteration += 1
+# time series kFold, sin imprimir los índices de cada fold
+results = backtest(x, y, {"regresion_lineal": LinearRegression()},
+                   n_splits=10)
+print(summarize_backtest(results))
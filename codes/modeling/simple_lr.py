@@ -1,17 +1,18 @@
+import os
 import warnings
 import numpy as np
-import pandas as pd
 from datetime import datetime
-from sklearn.linear_model import LinearRegression
-from sklearn.model_selection import TimeSeriesSplit
-from sklearn.metrics import mean_absolute_error
-from sklearn.metrics import mean_squared_error
+from sklearn.linear_model import LinearRegression, Ridge
 from sklearn.preprocessing import MinMaxScaler
+from xgboost import XGBRegressor
+from src.modeling.backtesting import backtest, summarize_backtest
+from src.preprocessing.cache import read_pickle_cached
 warnings.filterwarnings('ignore')
 
 
 path = "data/modeling/data.pkl"
-db = pd.read_pickle(path)
+# lectura desde el cache columnar mientras el .pkl no cambie
+db = read_pickle_cached(path)
 
 columns = list(db.columns)
 
@@ -81,7 +82,10 @@ x.drop(columns=["precio_leche"], inplace=True)
 
 y = db[["target"]]
 
-x = x.to_numpy()
+# precisión de los features, con "float32" se usa la mitad de memoria y al
+# final se verifica que el error se mantiene contra float64
+precision = "float64"
+x = x.to_numpy(dtype=precision)
 y = y.to_numpy()
 
 # normalizar los features
@@ -90,30 +94,30 @@ sc = MinMaxScaler()
 # training
 x = sc.fit_transform(x)
 
-# time series kFold
-tscv = TimeSeriesSplit(n_splits=5)
-
-results = []
-iteration = 1
-for train_index, test_index in tscv.split(x):
-    print("TRAIN:", train_index, "TEST:", test_index)
-    x_train, x_test = x[train_index], x[test_index]
-    y_train, y_test = y[train_index], y[test_index]
-    lr = LinearRegression().fit(x_train, y_train)
-    y_pred = lr.predict(x_test)
-    mae = mean_absolute_error(y_pred, y_test)
-    mse = mean_squared_error(y_pred, y_test)
-    rmse = np.sqrt(mean_squared_error(y_pred, y_test))
-    std = np.abs(y_pred-y_test).std()
-
-    results.append([iteration, mae, mse, rmse, std])
-    iteration += 1
-
-results = pd.DataFrame(
-    results, columns=["iteracion", "MAE", "MSE", "RMSE", "VARIANCE"])
-results["algoritmo"] = "regresion_lineal"
-
-print("Mean absolute error:", results["MAE"].mean())
-print("Mean squared error:", results["MSE"].mean())
-print("Root mean squared error:", results["RMSE"].mean())
-print("Root mean squared error:", results["VARIANCE"].mean())
+
+# comparar modelos con backtesting walk-forward, cada (modelo, fold) en un
+# proceso
+models = {"regresion_lineal": LinearRegression(),
+          "ridge": Ridge(alpha=1.0),
+          "xgboost": XGBRegressor(n_estimators=300, max_depth=3,
+                                  learning_rate=0.05, n_jobs=1)}
+results = backtest(x, y, models, n_splits=5, window="expanding",
+                   n_jobs=os.cpu_count())
+summary = summarize_backtest(results)
+print(summary[["modelo", "MAE_mean", "MSE_mean", "RMSE_mean",
+               "ERROR_STD_mean"]])
+
+# verificar que la precisión reducida no cambia el error del modelo
+if precision != "float64":
+    # la línea base en float64 aunque los features del dataframe vengan en
+    # otra precisión
+    x_64 = db[features].drop(columns=["precio_leche"]).to_numpy(
+        dtype="float64")
+    x_64 = MinMaxScaler().fit_transform(x_64)
+    # basta con la regresión lineal, sin volver a entrenar XGBRegressor
+    results_64 = backtest(x_64, y, {"regresion_lineal": LinearRegression()},
+                          n_splits=5, window="expanding",
+                          n_jobs=os.cpu_count())
+    mae = results[results["modelo"] == "regresion_lineal"]["MAE"]
+    diff = np.abs(mae.to_numpy() - results_64["MAE"].to_numpy()).max()
+    print(f"Máxima diferencia de MAE {precision} vs float64:", diff)
@@ -0,0 +1,317 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.model_selection import TimeSeriesSplit
+
+# arreglos de los folds en memoria compartida, cada proceso los abre una vez
+# con attach_arrays y los usa sin copiarlos
+SHARED_ARRAYS = {}
+
+
+def walk_forward_folds(n_rows, n_splits=5, window="expanding",
+                       train_size=None, horizon=None, gap=0):
+    """
+    Folds walk-forward sobre filas ordenadas en el tiempo, con
+    TimeSeriesSplit: cada fold entrena con las filas anteriores al test y
+    evalúa las horizon filas siguientes, dejando gap filas entre medio.
+
+    Parameters
+    ----------
+    n_rows : int
+        Cantidad de filas.
+    n_splits : int, optional
+        Cantidad de folds. The default is 5.
+    window : string, optional
+        "expanding" entrena con todas las filas anteriores, "sliding" solo
+        con las últimas train_size. The default is "expanding".
+    train_size : int, optional
+        Filas de entrenamiento con "sliding". The default is None.
+    horizon : int, optional
+        Filas de test de cada fold. The default is None,
+        n_rows // (n_splits + 1) como TimeSeriesSplit.
+    gap : int, optional
+        Filas entre el final del entrenamiento y el test, para no evaluar
+        con datos que se solapan con el target. The default is 0.
+
+    Returns
+    -------
+    folds : list
+        (train_inicio, train_fin, test_inicio, test_fin) de cada fold, con
+        los fines excluidos.
+
+    """
+    if window not in ("expanding", "sliding"):
+        raise ValueError(f"Ventana no soportada: {window}")
+    if window == "sliding" and train_size is None:
+        raise ValueError("La ventana sliding necesita train_size")
+    splitter = TimeSeriesSplit(
+        n_splits=n_splits,
+        max_train_size=train_size if window == "sliding" else None,
+        test_size=horizon, gap=gap)
+    # los índices de TimeSeriesSplit son rangos contiguos, basta con los
+    # extremos
+    folds = [(int(train[0]), int(train[-1]) + 1, int(test[0]),
+              int(test[-1]) + 1)
+             for train, test in splitter.split(np.empty((n_rows, 1)))]
+    return folds
+
+
+def regression_metrics(y_true, y_pred):
+    """
+    Errores de un fold.
+
+    Parameters
+    ----------
+    y_true : numpy.array
+        Target real.
+    y_pred : numpy.array
+        Predicción.
+
+    Returns
+    -------
+    metrics : dict
+        MAE, MSE, RMSE y desviación estándar del error absoluto.
+
+    """
+    error = np.ravel(y_pred) - np.ravel(y_true)
+    mse = float(np.mean(error ** 2))
+    metrics = {"MAE": float(np.mean(np.abs(error))),
+               "MSE": mse,
+               "RMSE": float(np.sqrt(mse)),
+               "ERROR_STD": float(np.abs(error).std())}
+    return metrics
+
+
+def share_array(values):
+    """
+    Copia un arreglo a un bloque de memoria compartida.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Arreglo a compartir.
+
+    Returns
+    -------
+    block : multiprocessing.shared_memory.SharedMemory
+        Bloque de memoria, hay que cerrarlo y liberarlo con unlink.
+    spec : tuple
+        Nombre del bloque, forma y tipo, para attach_arrays.
+
+    """
+    values = np.ascontiguousarray(values)
+    block = shared_memory.SharedMemory(create=True,
+                                       size=max(values.nbytes, 1))
+    shared = np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)
+    shared[:] = values
+    spec = (block.name, values.shape, values.dtype.str)
+    return block, spec
+
+
+def attach_arrays(specs, models):
+    """
+    Abre en un proceso los arreglos en memoria compartida y guarda los
+    modelos a evaluar.
+
+    Parameters
+    ----------
+    specs : dict
+        Spec de share_array de cada arreglo.
+    models : dict
+        Modelos sin entrenar por nombre.
+
+    Returns
+    -------
+    None.
+
+    """
+    for key, (name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=name)
+        SHARED_ARRAYS[key] = np.ndarray(shape, dtype=np.dtype(dtype),
+                                        buffer=block.buf)
+        # hay que mantener la referencia al bloque mientras se use la vista
+        SHARED_ARRAYS[f"{key}_block"] = block
+    SHARED_ARRAYS["models"] = models
+
+
+def fit_fold(x, y, model, fold):
+    """
+    Entrena una copia del modelo con el train de un fold y lo evalúa en el
+    test.
+
+    Parameters
+    ----------
+    x : numpy.array
+        Features de (filas, columnas).
+    y : numpy.array
+        Target de (filas,).
+    model : estimator
+        Modelo de sklearn sin entrenar, se clona.
+    fold : tuple
+        (train_inicio, train_fin, test_inicio, test_fin).
+
+    Returns
+    -------
+    record : dict
+        Errores del fold y segundos de entrenamiento.
+
+    """
+    train_start, train_stop, test_start, test_stop = fold
+    start = time.perf_counter()
+    fitted = clone(model).fit(x[train_start:train_stop],
+                              y[train_start:train_stop])
+    seconds = time.perf_counter() - start
+    y_pred = fitted.predict(x[test_start:test_stop])
+    record = regression_metrics(y[test_start:test_stop], y_pred)
+    record["segundos"] = seconds
+    return record
+
+
+def backtest_task(name, fold):
+    """
+    Corre un par (modelo, fold) con los arreglos de attach_arrays.
+
+    Parameters
+    ----------
+    name : string
+        Nombre del modelo.
+    fold : tuple
+        (train_inicio, train_fin, test_inicio, test_fin).
+
+    Returns
+    -------
+    record : dict
+        Errores del fold, ver fit_fold.
+
+    """
+    return fit_fold(SHARED_ARRAYS["x"], SHARED_ARRAYS["y"],
+                    SHARED_ARRAYS["models"][name], fold)
+
+
+def model_names(models):
+    """
+    Nombres de los modelos: las llaves si es un dict, si no el nombre de la
+    clase, numerado si se repite.
+
+    Parameters
+    ----------
+    models : dict or list
+        Modelos por nombre o lista de modelos.
+
+    Returns
+    -------
+    models : dict
+        Modelos por nombre.
+
+    """
+    if isinstance(models, dict):
+        return dict(models)
+    classes = [type(model).__name__ for model in models]
+    names = [f"{name}_{classes[:i].count(name) + 1}"
+             if classes.count(name) > 1 else name
+             for i, name in enumerate(classes)]
+    return dict(zip(names, models))
+
+
+def backtest(x, y, models, n_splits=5, window="expanding", train_size=None,
+             horizon=None, gap=0, n_jobs=1):
+    """
+    Backtesting walk-forward de varios modelos a la vez: cada par
+    (modelo, fold) es una tarea independiente y se reparten en un pool de
+    procesos. x e y se copian una sola vez a memoria compartida y cada
+    tarea recibe solo los extremos de su fold, en vez de enviar los
+    arreglos con cada tarea.
+
+    Parameters
+    ----------
+    x : numpy.array
+        Features ordenados en el tiempo, de (filas, columnas).
+    y : numpy.array
+        Target de (filas,) o (filas, 1).
+    models : dict or list
+        Modelos de sklearn (LinearRegression, Ridge, XGBRegressor, ...) por
+        nombre, o una lista de modelos.
+    n_splits : int, optional
+        Cantidad de folds. The default is 5.
+    window : string, optional
+        "expanding" o "sliding", ver walk_forward_folds.
+        The default is "expanding".
+    train_size : int, optional
+        Filas de entrenamiento con "sliding". The default is None.
+    horizon : int, optional
+        Filas de test de cada fold. The default is None.
+    gap : int, optional
+        Filas entre el entrenamiento y el test. The default is 0.
+    n_jobs : int, optional
+        Cantidad de procesos, con 1 se corre todo en este proceso.
+        The default is 1.
+
+    Returns
+    -------
+    results : pandas.dataframe
+        Una fila por (modelo, fold) con los extremos del fold, los errores
+        MAE, MSE, RMSE, ERROR_STD y los segundos de entrenamiento.
+
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if y.ndim == 2 and y.shape[1] == 1:
+        y = y[:, 0]
+    models = model_names(models)
+    folds = walk_forward_folds(len(x), n_splits=n_splits, window=window,
+                               train_size=train_size, horizon=horizon,
+                               gap=gap)
+    tasks = [(name, i, fold) for name in models
+             for i, fold in enumerate(folds, start=1)]
+    if n_jobs == 1:
+        records = [fit_fold(x, y, models[name], fold)
+                   for name, _, fold in tasks]
+    else:
+        blocks = []
+        try:
+            specs = {}
+            for key, values in (("x", x), ("y", y)):
+                block, specs[key] = share_array(values)
+                blocks.append(block)
+            with ProcessPoolExecutor(max_workers=n_jobs,
+                                     initializer=attach_arrays,
+                                     initargs=(specs, models)) as executor:
+                futures = [executor.submit(backtest_task, name, fold)
+                           for name, _, fold in tasks]
+                records = [future.result() for future in futures]
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+    results = pd.DataFrame(
+        [{"modelo": name, "iteracion": i, "train_inicio": fold[0],
+          "train_fin": fold[1], "test_inicio": fold[2], "test_fin": fold[3],
+          **record}
+         for (name, i, fold), record in zip(tasks, records)])
+    return results
+
+
+def summarize_backtest(results):
+    """
+    Promedio y desviación estándar de los errores de cada modelo sobre los
+    folds, ordenado por MAE promedio.
+
+    Parameters
+    ----------
+    results : pandas.dataframe
+        Resultado de backtest.
+
+    Returns
+    -------
+    summary : pandas.dataframe
+        Una fila por modelo.
+
+    """
+    metrics = ["MAE", "MSE", "RMSE", "ERROR_STD", "segundos"]
+    summary = results.groupby("modelo")[metrics].agg(["mean", "std"])
+    summary.columns = [f"{metric}_{stat}" for metric, stat in summary.columns]
+    summary = summary.sort_values(by="MAE_mean").reset_index()
+    return summary
@@ -0,0 +1,221 @@
+import os
+import glob
+import json
+import hashlib
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+CACHE_DIR = "data/cache"
+
+
+def content_hash(inputs=(), params=None):
+    """
+    Hash del contenido de las entradas de una etapa y de sus parámetros, si
+    cambia algún archivo, dataframe o parámetro cambia el hash.
+
+    Parameters
+    ----------
+    inputs : list, optional
+        Paths a archivos o dataframes de entrada. The default is ().
+    params : dict, optional
+        Parámetros de la etapa, deben poder pasarse a json.
+        The default is None.
+
+    Returns
+    -------
+    key : string
+        Hash hexadecimal.
+
+    """
+    digest = hashlib.sha256()
+    for item in inputs:
+        if isinstance(item, pd.DataFrame):
+            digest.update(json.dumps(list(map(str, item.columns))).encode())
+            digest.update(
+                pd.util.hash_pandas_object(item, index=True).values.tobytes())
+        else:
+            with open(item, "rb") as file:
+                for block in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(block)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    key = digest.hexdigest()[0:16]
+    return key
+
+
+def save_frame(df, path):
+    """
+    Guardar un dataframe en formato columnar Arrow IPC (feather) sin
+    compresión, para poder leerlo después con memory map.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Dataframe a guardar.
+    path : string
+        Path del archivo .arrow.
+
+    Returns
+    -------
+    None.
+
+    """
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    feather.write_feather(table, path, compression="uncompressed")
+
+
+def load_frame(path, memory_map=True):
+    """
+    Cargar un dataframe guardado con save_frame, con los tipos de cada
+    columna (fechas incluidas) tal como se guardaron.
+
+    Parameters
+    ----------
+    path : string
+        Path del archivo .arrow.
+    memory_map : bool, optional
+        Leer el archivo con memory map. The default is True.
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Dataframe guardado.
+
+    """
+    table = feather.read_table(path, memory_map=memory_map)
+    df = table.to_pandas()
+    return df
+
+
+def cached_frame(name, builder, inputs=(), params=None, cache_dir=CACHE_DIR):
+    """
+    Devuelve el dataframe de una etapa desde el cache si las entradas y los
+    parámetros no cambiaron, si no lo calcula con builder y lo guarda. Las
+    entradas anteriores de la misma etapa se borran al guardar una nueva.
+
+    Parameters
+    ----------
+    name : string
+        Nombre de la etapa.
+    builder : function
+        Función sin argumentos que calcula el dataframe.
+    inputs : list, optional
+        Paths o dataframes de los que depende la etapa. The default is ().
+    params : dict, optional
+        Parámetros de la etapa. The default is None.
+    cache_dir : string, optional
+        Carpeta del cache. The default is CACHE_DIR.
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Dataframe de la etapa.
+
+    """
+    key = content_hash(inputs=inputs, params=params)
+    path = os.path.join(cache_dir, f"{name}-{key}.arrow")
+    if os.path.exists(path):
+        return load_frame(path)
+    df = builder()
+    invalidate_cache(name=name, cache_dir=cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    save_frame(df, path)
+    return df
+
+
+def read_csv_cached(path, cache_dir=CACHE_DIR, **kwargs):
+    """
+    pd.read_csv con cache: la primera vez lee el .csv (parseando fechas con
+    parse_dates) y lo guarda tipado, las siguientes lo lee del cache
+    mientras el .csv y los argumentos no cambien.
+
+    Parameters
+    ----------
+    path : string
+        Path al .csv.
+    cache_dir : string, optional
+        Carpeta del cache. The default is CACHE_DIR.
+    **kwargs : dict
+        Argumentos de pd.read_csv.
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Datos del .csv.
+
+    """
+    df = cached_frame(path_stage_name(path),
+                      lambda: pd.read_csv(path, **kwargs),
+                      inputs=[path], params=kwargs, cache_dir=cache_dir)
+    return df
+
+
+def read_pickle_cached(path, cache_dir=CACHE_DIR):
+    """
+    pd.read_pickle con cache: la primera vez lee el .pkl y lo guarda en
+    formato columnar, las siguientes lo lee del cache con memory map
+    mientras el .pkl no cambie.
+
+    Parameters
+    ----------
+    path : string
+        Path al .pkl con un dataframe.
+    cache_dir : string, optional
+        Carpeta del cache. The default is CACHE_DIR.
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Datos del .pkl.
+
+    """
+    df = cached_frame(path_stage_name(path), lambda: pd.read_pickle(path),
+                      inputs=[path], cache_dir=cache_dir)
+    return df
+
+
+def path_stage_name(path):
+    """
+    Nombre de etapa del cache para un archivo: el nombre del archivo más un
+    hash de su path completo normalizado, así dos archivos con el mismo
+    nombre en carpetas distintas no comparten entrada.
+
+    Parameters
+    ----------
+    path : string
+        Path al archivo.
+
+    Returns
+    -------
+    name : string
+        Nombre de la etapa.
+
+    """
+    full_path = os.path.normcase(os.path.abspath(path))
+    digest = hashlib.sha256(full_path.encode()).hexdigest()[0:8]
+    name = f"{os.path.splitext(os.path.basename(path))[0]}_{digest}"
+    return name
+
+
+def invalidate_cache(name=None, cache_dir=CACHE_DIR):
+    """
+    Borrar entradas del cache.
+
+    Parameters
+    ----------
+    name : string, optional
+        Nombre de la etapa a borrar. The default is None, todas las etapas.
+    cache_dir : string, optional
+        Carpeta del cache. The default is CACHE_DIR.
+
+    Returns
+    -------
+    removed : list
+        Archivos borrados.
+
+    """
+    pattern = f"{name}-*.arrow" if name is not None else "*.arrow"
+    removed = glob.glob(os.path.join(cache_dir, pattern))
+    for path in removed:
+        os.remove(path)
+    return removed
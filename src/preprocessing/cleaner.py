@@ -1,8 +1,25 @@
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
 import pandas as pd
-
-
-def actual_nans_df(df, threshold=50):
+from src.preprocessing.missingness import (update_missingness_index,
+                                           columns_under_threshold)
+
+# correcciones de rango particulares de algunas columnas del PIB, de la forma
+# columna: (operacion, umbral). "multiply" multiplica por 10 los valores
+# <= umbral y "divide" divide por 10 los valores >= umbral
+PIB_RANGE_FIXES = {
+    "PIB_Pesca": ("multiply", 150),
+    "PIB_Refinacion_de_petroleo": ("divide", 150),
+    "PIB_Minerales_no_metalicos_y_metalica_basica": ("multiply", 150),
+    "PIB_Construccion": ("multiply", 150),
+    "PIB_Servicios_de_vivienda": ("multiply", 150),
+    "PIB_Servicios_personales": ("divide", 200),
+}
+
+
+def actual_nans_df(df, threshold=50, index=None):
     """
     Dado un threshold de nans, devuelve las columnas que cumplen con el
     criterio porcentaje de nans < threshold.
@@ -13,6 +30,12 @@ def actual_nans_df(df, threshold=50):
         Dataframe en el cual ver la cantidad de nans.
     threshold : float, optional
         Threshold de nans. The default is 50.
+    index : dict, optional
+        Índice de nans de missingness.missingness_index, si se entrega se
+        agregan solo las columnas nuevas de df y se responde desde el índice
+        sin recorrer los datos. Con índice df solo puede ganar columnas: si
+        cambian las filas o se reemplaza una columna ya indexada se levanta
+        un ValueError. The default is None.
 
     Returns
     -------
@@ -21,6 +44,11 @@ def actual_nans_df(df, threshold=50):
         que el threhold establecido.
 
     """
+    if index is not None:
+        index = update_missingness_index(index, df, list(df.columns))
+        cols = columns_under_threshold(index, threshold=threshold,
+                                       columns=list(df.columns))
+        return cols
     nans = pd.DataFrame(df.isna().sum(), columns=["missing"])
     nans.reset_index(drop=False, inplace=True)
     nans.rename(columns={"index": "columna"}, inplace=True)
@@ -29,7 +57,8 @@ def actual_nans_df(df, threshold=50):
     return cols
 
 
-def values_treatement(df):
+def values_treatement(df, lengths=None, sort_by_date=True, n_jobs=1,
+                      backend="process", verbose=True):
     """
     Hacer el tratamiento de valores sobre el dataset del banco central
 
@@ -37,6 +66,20 @@ def values_treatement(df):
     ----------
     df : pandas.dataframe
         Data banco central.
+    lengths : dict, optional
+        Largo máximo (sin puntos) de cada columna. Si no se entrega se
+        calcula sobre el mismo df. The default is None.
+    sort_by_date : bool, optional
+        Ordenar los datos por fecha descendente. The default is True.
+    n_jobs : int, optional
+        Cantidad de workers para limpiar columnas en paralelo, con 1 se
+        limpian una tras otra y con None o -1 se usan todos los núcleos.
+        The default is 1.
+    backend : string, optional
+        "process" o "thread", tipo de pool a usar cuando n_jobs > 1.
+        The default is "process".
+    verbose : bool, optional
+        Imprimir la columna que se está procesando. The default is True.
 
     Returns
     -------
@@ -44,38 +87,157 @@ def values_treatement(df):
         Data banco central con las columnas tratadas.
 
     """
+    if n_jobs is None or n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    if not isinstance(n_jobs, (int, np.integer)) or n_jobs < 1:
+        raise ValueError("n_jobs debe ser un entero >= 1, None o -1: "
+                         f"{n_jobs}")
+    if lengths is None:
+        lengths = {}
     # ordenar datos por fecha
-    df.sort_values(by=["Periodo"], inplace=True, ascending=False)
-    df.reset_index(drop=True, inplace=True)
+    if sort_by_date:
+        df.sort_values(by=["Periodo"], inplace=True, ascending=False)
+        df.reset_index(drop=True, inplace=True)
     columns = list(df.columns)
     columns.remove("Periodo")
-    for col in columns:
+    if verbose:
+        for col in columns:
+            print(column_message(col), col)
+    if n_jobs == 1:
         # cada columna tiene un tratamiento distinto, dependiendo de lo que
         # corresponde
-        if "Imacec" in col:
-            print("Procesando columna IMACEC:", col)
-            df = imacec_values_cleaning(df, col, thresh_imacec=20)
-        elif "PIB" in col:
-            print("Procesando una columna de PIB:", col)
-            df = pib_values_cleaning(df, col)
-        elif "Precio" in col:
-            print("Procesando una columna de Precio:", col)
-            # hacer el parsing de la columna como string
-            df = string_parser(df, col)
-            df[col] = df[col].apply(float) / 10 ** 5
-            # aplicar factor de amplificacion
-            df[col] = df[col].apply(lambda x: reduction_factor(x))
-        else:
-            print("Procesando una columna:", col)
-            # hacer el parsing de la columna como string
-            df = string_parser(df, col)
-            df[col] = df[col].apply(float) / 10 ** 5
-            # aplicar factor de amplificacion
-            df[col] = df[col].apply(lambda x: reduction_factor(x))
+        for col in columns:
+            df = clean_column(df, col, length=lengths.get(col))
+        return df
+    # las columnas son independientes, se mandan a los workers solo los
+    # arreglos de valores y vuelven arreglos de float
+    if backend == "process":
+        executor = ProcessPoolExecutor(max_workers=n_jobs)
+    elif backend == "thread":
+        executor = ThreadPoolExecutor(max_workers=n_jobs)
+    else:
+        raise ValueError(f"backend no soportado: {backend}")
+    arrays = [df[col].to_numpy() for col in columns]
+    column_lengths = [lengths.get(col) for col in columns]
+    chunksize = max(1, len(columns) // (4 * n_jobs))
+    with executor:
+        results = list(executor.map(clean_column_values, columns, arrays,
+                                    column_lengths, chunksize=chunksize))
+    # rearmar en el orden original de las columnas
+    cleaned = dict(zip(columns, results))
+    df = pd.DataFrame({col: df[col] if col == "Periodo" else cleaned[col]
+                       for col in df.columns}, index=df.index)
+    return df
+
+
+def column_message(col):
+    """
+    Mensaje de progreso según el tipo de columna del banco central
+
+    Parameters
+    ----------
+    col : string
+        Nombre de la columna.
+
+    Returns
+    -------
+    message : string
+        Mensaje a imprimir.
+
+    """
+    if "Imacec" in col:
+        message = "Procesando columna IMACEC:"
+    elif "PIB" in col:
+        message = "Procesando una columna de PIB:"
+    elif "Precio" in col:
+        message = "Procesando una columna de Precio:"
+    else:
+        message = "Procesando una columna:"
+    return message
+
+
+def clean_column_values(col, values, length=None):
+    """
+    Limpia los valores de una columna sin pasar por el dataframe completo,
+    pensado para correr en los workers de values_treatement
+
+    Parameters
+    ----------
+    col : string
+        Nombre de la columna.
+    values : numpy.array
+        Valores de la columna sin limpiar.
+    length : int, optional
+        Largo máximo de la columna sin los puntos. The default is None.
+
+    Returns
+    -------
+    values : numpy.array
+        Valores de la columna limpios.
+
+    """
+    df = pd.DataFrame({col: values})
+    df = clean_column(df, col, length=length)
+    return df[col].to_numpy()
+
+
+def clean_column(df, col, length=None, thresh_imacec=20):
+    """
+    Aplica sobre una columna del banco central el tratamiento que le
+    corresponde según su nombre (Imacec, PIB, Precio u otra)
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Dataset del banco central.
+    col : string
+        Columna a tratar.
+    length : int, optional
+        Largo máximo de la columna sin los puntos. The default is None.
+    thresh_imacec : float, optional
+        Umbral de filtro en las columnas del imacec. The default is 20.
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Dataset del banco central con la columna tratada.
+
+    """
+    if "Imacec" in col:
+        df = imacec_values_cleaning(df, col, thresh_imacec=thresh_imacec,
+                                    length=length)
+    elif "PIB" in col:
+        df = pib_values_cleaning(df, col, length=length)
+    else:
+        # hacer el parsing de la columna como string
+        df = string_parser(df, col, length=length)
+        df[col] = df[col].astype(float) / 10 ** 5
+        # aplicar factor de amplificacion
+        df[col] = vectorized_reduction_factor(df[col].to_numpy())
     return df
 
 
-def string_parser(df, col):
+def column_strings(series):
+    """
+    Representación como string y sin puntos de los valores de una columna,
+    que es la que se usa para medir el largo y rellenar con ceros
+
+    Parameters
+    ----------
+    series : pandas.series
+        Columna del dataset del banco central.
+
+    Returns
+    -------
+    strings : pandas.series
+        Valores como string sin puntos, los vacios quedan como "nan".
+
+    """
+    strings = series.astype(str).str.replace(".", "", regex=False)
+    return strings
+
+
+def string_parser(df, col, length=None):
     """
     Para una columna en particular hace el parseo del valor entregado en la
     columna
@@ -86,6 +248,9 @@ def string_parser(df, col):
         Dataset del banco central.
     col : string
         Columna a tratar.
+    length : int, optional
+        Largo al cual rellenar los strings, si no se entrega se usa el máximo
+        largo de la columna. The default is None.
 
     Returns
     -------
@@ -93,16 +258,20 @@ def string_parser(df, col):
         Dataset del banco central con la columna parseada.
 
     """
-    # ajusto y parseo los strings para que queden del mismo largo
-    df[col] = df[col].apply(str)
-    df[col] = df[col].apply(lambda x: x.replace(".", ""))
-    length = df[col].apply(lambda x: len(x)).max()
-    df[col] = df[col].apply(
-        lambda x: string_replacement(x, length))
+    # ajusto y parseo los strings para que queden del mismo largo, todo
+    # con operaciones .str sobre la columna completa
+    strings = column_strings(df[col])
+    if length is None:
+        length = strings.str.len().max()
+    if pd.isna(length):
+        length = 0
+    # rellenar con ceros a la derecha, salvo los vacios ("nan")
+    df[col] = strings.where(strings == "nan",
+                            strings.str.ljust(int(length), "0"))
     return df
 
 
-def imacec_values_cleaning(df, col, thresh_imacec=20):
+def imacec_values_cleaning(df, col, thresh_imacec=20, length=None):
     """
     Hace el tratamiento de limpieza de todas las columnas de imacec para dejar
     en un rango de 0-100
@@ -115,6 +284,8 @@ def imacec_values_cleaning(df, col, thresh_imacec=20):
         Nombre de la columna.
     thresh_imacec : float, optional
         Umbral de filtro en la columna. The default is 20.
+    length : int, optional
+        Largo máximo de la columna sin los puntos. The default is None.
 
     Returns
     -------
@@ -123,15 +294,14 @@ def imacec_values_cleaning(df, col, thresh_imacec=20):
 
     """
     # hacer el parsing de la columna como string
-    df = string_parser(df, col)
+    df = string_parser(df, col, length=length)
     # divido en factor 10**7 ---> imacec [90, 120]
-    df[col] = df[col].apply(float) / 10**7
-    df[col] = df[col].apply(
-        lambda x: x * 10 if x <= thresh_imacec else x)
+    values = df[col].astype(float).to_numpy() / 10**7
+    df[col] = np.where(values <= thresh_imacec, values * 10, values)
     return df
 
 
-def pib_values_cleaning(df, col):
+def pib_values_cleaning(df, col, length=None):
     """
     Trata las columans del PIB del dataset del banco central
 
@@ -141,6 +311,8 @@ def pib_values_cleaning(df, col):
         Dataset de banco.
     col : string
         Nombre de la columna.
+    length : int, optional
+        Largo máximo de la columna sin los puntos. The default is None.
 
     Returns
     -------
@@ -149,24 +321,19 @@ def pib_values_cleaning(df, col):
 
     """
     # hacer el parsing de la columna como string
-    df = string_parser(df, col)
+    df = string_parser(df, col, length=length)
     # divido en factor 10**5 para con la función estadarizar al [M]
-    df[col] = df[col].apply(float) / 10**5
+    values = df[col].astype(float).to_numpy() / 10**5
     # aplicar factor de amplificacion
-    df[col] = df[col].apply(lambda x: reduction_factor(x))
+    values = vectorized_reduction_factor(values)
     # correcciones particulares para cada columna para dejar en el rango
-    if col == "PIB_Pesca":
-        df[col] = df[col].apply(lambda x: 10 * x if x <= 150 else x)
-    if col == "PIB_Refinacion_de_petroleo":
-        df[col] = df[col].apply(lambda x: x / 10 if x >= 150 else x)
-    if col == "PIB_Minerales_no_metalicos_y_metalica_basica":
-        df[col] = df[col].apply(lambda x: 10 * x if x <= 150 else x)
-    if col == "PIB_Construccion":
-        df[col] = df[col].apply(lambda x: 10 * x if x <= 150 else x)
-    if col == "PIB_Servicios_de_vivienda":
-        df[col] = df[col].apply(lambda x: 10 * x if x <= 150 else x)
-    if col == "PIB_Servicios_personales":
-        df[col] = df[col].apply(lambda x: x / 10 if x >= 200 else x)
+    if col in PIB_RANGE_FIXES:
+        operation, thresh = PIB_RANGE_FIXES[col]
+        if operation == "multiply":
+            values = np.where(values <= thresh, 10 * values, values)
+        else:
+            values = np.where(values >= thresh, values / 10, values)
+    df[col] = values
     return df
 
 
@@ -193,6 +360,28 @@ def reduction_factor(x):
     return valor
 
 
+def vectorized_reduction_factor(values):
+    """
+    Versión vectorizada de reduction_factor, aplica el mismo ajuste de rango
+    sobre todo un arreglo de valores de una vez.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Valores del KPI.
+
+    Returns
+    -------
+    valores : numpy.array
+        Valores del KPI ajustados en el rango.
+
+    """
+    values = np.asarray(values, dtype=float)
+    condition = ((values / 1000) > 1) & (values < 8000)
+    valores = np.where(condition, values / 10, values / 100)
+    return valores
+
+
 def string_replacement(string, length):
     """
     Esta función fue creada para agregar ceros al final de cada string, con
@@ -336,3 +525,300 @@ def replace_empty_nans(df):
         print("Reemplazando 'a':", col, "...")
         df[col] = df[col].apply(lambda x: make_empty_identifiable(x))
     return df
+
+
+def valid_periods(periods, date_format="%Y-%m-%d"):
+    """
+    Identifica las filas con una fecha válida en la columna Periodo, por
+    ejemplo descarta el registro "2020-13-01 00:00:00 UTC".
+
+    Parameters
+    ----------
+    periods : pandas.series
+        Columna Periodo como string.
+    date_format : string, optional
+        Formato de los primeros 10 caracteres de la fecha.
+        The default is "%Y-%m-%d".
+
+    Returns
+    -------
+    dates : pandas.series
+        Fechas parseadas, NaT en las fechas inválidas.
+
+    """
+    dates = pd.to_datetime(periods.str[0:10], format=date_format,
+                           errors="coerce")
+    return dates
+
+
+def prepare_chunk(chunk, numeric_columns=None, date_format="%Y-%m-%d"):
+    """
+    Hace sobre un chunk leido como string lo mismo que drop_spaces_data,
+    replace_empty_nans y el parseo de fechas, botando las fechas inválidas.
+    Las columnas numéricas se dejan como float antes de identificar los
+    vacios "a", igual que cuando pandas las infiere leyendo el archivo
+    completo.
+
+    Parameters
+    ----------
+    chunk : pandas.dataframe
+        Chunk del banco central leido con dtype=str.
+    numeric_columns : list, optional
+        Columnas que se deben dejar como float. The default is None.
+    date_format : string, optional
+        Formato de las fechas. The default is "%Y-%m-%d".
+
+    Returns
+    -------
+    chunk : pandas.dataframe
+        Chunk listo para la limpieza de valores.
+
+    """
+    if numeric_columns is None:
+        numeric_columns = []
+    # sacar espacios y hacer identificables los vacios
+    chunk = chunk.apply(lambda x: x.str.strip())
+    for col in numeric_columns:
+        chunk[col] = chunk[col].astype(float)
+    chunk = chunk.mask(chunk == "a")
+    # fechas
+    dates = valid_periods(chunk["Periodo"], date_format=date_format)
+    chunk = chunk[dates.notna()].copy()
+    chunk["Periodo"] = dates[dates.notna()]
+    return chunk
+
+
+def scan_column_stats(path_csv, chunksize=100000, date_format="%Y-%m-%d"):
+    """
+    Primera pasada barata sobre el .csv del banco central, leyendo por
+    chunks, para obtener lo que la limpieza necesita de la columna completa:
+    el largo máximo sin puntos que usa string_parser y si la columna es
+    numérica (pandas la leería como float). Igual que pandas, el tipo se
+    infiere sobre los strings sin tratar, por lo que una columna con algún
+    "a" no es numérica.
+
+    Parameters
+    ----------
+    path_csv : string
+        Path al .csv del banco central.
+    chunksize : int, optional
+        Cantidad de filas por chunk. The default is 100000.
+    date_format : string, optional
+        Formato de las fechas. The default is "%Y-%m-%d".
+
+    Returns
+    -------
+    stats : dict
+        Por columna un diccionario con las llaves "length" y "numeric".
+
+    """
+    partial = {}
+    for chunk in pd.read_csv(path_csv, dtype=str, chunksize=chunksize):
+        # el tipo se infiere antes de sacar los "a" y las fechas inválidas
+        raw = chunk.apply(lambda x: x.str.strip())
+        chunk = prepare_chunk(chunk, date_format=date_format)
+        for col in chunk.columns:
+            if col == "Periodo":
+                continue
+            values = chunk[col]
+            numbers = pd.to_numeric(raw[col], errors="coerce")
+            numeric = bool(numbers.notna().sum() == raw[col].notna().sum())
+            # largos como string y como float, al final se elige uno
+            length_str = column_strings(values).str.len().max()
+            length_float = 0
+            if numeric:
+                length_float = column_strings(
+                    values.astype(float)).str.len().max()
+            previous = partial.get(col, {"numeric": True, "length_str": 0,
+                                         "length_float": 0})
+            partial[col] = {
+                "numeric": previous["numeric"] and numeric,
+                "length_str": max(previous["length_str"],
+                                  np.nan_to_num(length_str)),
+                "length_float": max(previous["length_float"],
+                                    np.nan_to_num(length_float))}
+    stats = {}
+    for col, values in partial.items():
+        if values["numeric"]:
+            length = values["length_float"]
+        else:
+            length = values["length_str"]
+        stats[col] = {"length": int(length), "numeric": values["numeric"]}
+    return stats
+
+
+def stream_values_treatement(path_csv, path_output, chunksize=100000,
+                             stats=None, date_format="%Y-%m-%d"):
+    """
+    Limpieza del banco central en streaming: lee el .csv por chunks, los
+    limpia y los va escribiendo en path_output, de tal forma que la memoria
+    usada depende del chunksize y no del tamaño del archivo. Los largos por
+    columna vienen de una primera pasada (scan_column_stats) o se entregan ya
+    calculados, por lo que el resultado es el mismo que limpiar el archivo
+    completo. A diferencia de values_treatement se mantiene el orden de las
+    filas del archivo.
+
+    Parameters
+    ----------
+    path_csv : string
+        Path al .csv del banco central.
+    path_output : string
+        Path al .csv de salida con los datos limpios.
+    chunksize : int, optional
+        Cantidad de filas por chunk. The default is 100000.
+    stats : dict, optional
+        Estadísticas por columna de scan_column_stats. The default is None.
+    date_format : string, optional
+        Formato de las fechas. The default is "%Y-%m-%d".
+
+    Returns
+    -------
+    stats : dict
+        Estadísticas por columna usadas en la limpieza.
+
+    """
+    if stats is None:
+        stats = scan_column_stats(path_csv, chunksize=chunksize,
+                                  date_format=date_format)
+    numeric_columns = [col for col in stats if stats[col]["numeric"]]
+    lengths = {col: stats[col]["length"] for col in stats}
+    header = True
+    for chunk in pd.read_csv(path_csv, dtype=str, chunksize=chunksize):
+        chunk = prepare_chunk(chunk, numeric_columns=numeric_columns,
+                              date_format=date_format)
+        for col in chunk.columns:
+            if col != "Periodo":
+                chunk = clean_column(chunk, col, length=lengths.get(col))
+        chunk.to_csv(path_output, mode="w" if header else "a",
+                     header=header, index=False)
+        header = False
+    return stats
+
+
+def fit_cleaning_state(df):
+    """
+    Calcula el estado de normalización de cada columna del banco central
+    (largo máximo sin puntos y si es numérica) sobre la historia ya limpiada,
+    para después limpiar solo las filas nuevas contra ese estado sin que
+    cambie la escala de los valores históricos.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Data banco central sin limpiar, con la columna Periodo como fecha.
+
+    Returns
+    -------
+    state : dict
+        Estado con las llaves "columns" (stats por columna, igual que
+        scan_column_stats) y "last_period" (última fecha procesada).
+
+    """
+    columns = {}
+    for col in df.columns:
+        if col == "Periodo":
+            continue
+        length = column_strings(df[col]).str.len().max()
+        columns[col] = {
+            "length": int(np.nan_to_num(length)),
+            "numeric": bool(pd.api.types.is_float_dtype(df[col]))}
+    state = {"columns": columns,
+             "last_period": str(df["Periodo"].max())[0:10]}
+    return state
+
+
+def save_cleaning_state(state, path):
+    """
+    Guardar el estado de normalización en un .json
+
+    Parameters
+    ----------
+    state : dict
+        Estado de fit_cleaning_state.
+    path : string
+        Path al .json.
+
+    Returns
+    -------
+    None.
+
+    """
+    with open(path, "w") as file:
+        json.dump(state, file, indent=4)
+
+
+def load_cleaning_state(path):
+    """
+    Cargar el estado de normalización desde un .json
+
+    Parameters
+    ----------
+    path : string
+        Path al .json.
+
+    Returns
+    -------
+    state : dict
+        Estado de normalización.
+
+    """
+    with open(path, "r") as file:
+        state = json.load(file)
+    return state
+
+
+def incremental_values_treatement(df, state):
+    """
+    Limpia solo las filas posteriores a state["last_period"] usando el largo
+    guardado de cada columna, en vez de volver a limpiar toda la historia.
+    Las columnas que no estaban en el estado se agregan con el largo de las
+    filas nuevas. Si las filas nuevas tienen valores más largos que el largo
+    guardado se levanta un ValueError, porque limpiarlas con la escala
+    guardada daría valores equivocados.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Data banco central sin limpiar (puede ser la historia completa o solo
+        las filas nuevas), con la columna Periodo como fecha.
+    state : dict
+        Estado de normalización de fit_cleaning_state o load_cleaning_state.
+
+    Returns
+    -------
+    new : pandas.dataframe
+        Filas nuevas limpias, ordenadas por fecha descendente.
+    state : dict
+        Estado actualizado con la última fecha procesada.
+
+    """
+    state = {"columns": dict(state["columns"]),
+             "last_period": state.get("last_period")}
+    new = df
+    if state["last_period"] is not None:
+        new = df[df["Periodo"] > pd.Timestamp(state["last_period"])]
+    new = new.sort_values(by=["Periodo"], ascending=False)
+    new.reset_index(drop=True, inplace=True)
+    if len(new) == 0:
+        return new, state
+    for col in new.columns:
+        if col == "Periodo":
+            continue
+        if col not in state["columns"]:
+            length = column_strings(new[col]).str.len().max()
+            state["columns"][col] = {
+                "length": int(np.nan_to_num(length)),
+                "numeric": bool(pd.api.types.is_float_dtype(new[col]))}
+        stats = state["columns"][col]
+        if stats["numeric"]:
+            new[col] = new[col].astype(float)
+        length = column_strings(new[col]).str.len().max()
+        # con valores más largos la escala guardada ya no sirve, hay que
+        # volver a calcular el estado con fit_cleaning_state
+        if length > stats["length"]:
+            raise ValueError("Valores más largos que el estado guardado en "
+                             f"{col} ({length} > {stats['length']}), hay "
+                             "que volver a calcular el estado")
+        new = clean_column(new, col, length=stats["length"])
+    state["last_period"] = str(new["Periodo"].max())[0:10]
+    return new, state
@@ -1,7 +1,13 @@
+import warnings
+import hashlib
+from collections import OrderedDict
+from math import comb
 import numpy as np
+import pandas as pd
+from src.preprocessing.feature_frame import FeatureFrame
 
 
-def add_lagged_variables(df, columns, nr_of_lags=1):
+def add_lagged_variables(df, columns, nr_of_lags=1, memoize=False):
     """
     Agregar variables pasadas del dataframe con el que se esta trabajando
 
@@ -13,6 +19,9 @@ def add_lagged_variables(df, columns, nr_of_lags=1):
         Número de steps que quirees ir hacia atrás.
     columns : list
         Lista de columas a las cuales agregar variables lagged.
+    memoize : bool, optional
+        Reusar los lags guardados en el cache de features.
+        The default is False.
 
     Returns
     -------
@@ -20,23 +29,154 @@ def add_lagged_variables(df, columns, nr_of_lags=1):
         Dataframe con las variables lag agregadas.
 
     """
-    for i in range(1, nr_of_lags+1):
-        for col in columns:
-            lagged_column = col + f'_lagged_{i}'
-            df[lagged_column] = df[col].shift(i)
+    df = add_lags(df, columns, lags=range(1, nr_of_lags+1), memoize=memoize)
     return df
 
 
-def log_features(df, columns):
+def lag_matrix(values, lags):
     """
-    Agregar logaritmo de las variables
+    Arma en una sola asignación de memoria la matriz con todos los lags de
+    un arreglo, ordenada primero por lag y después por columna.
 
     Parameters
     ----------
+    values : numpy.array
+        Arreglo de (filas, columnas) ordenado en el tiempo.
+    lags : list
+        Lista de lags.
+
+    Returns
+    -------
+    block : numpy.array
+        Arreglo de (filas, columnas * len(lags)), con nan donde no hay
+        historia suficiente.
+
+    """
+    n_rows, n_cols = values.shape
+    block = np.full((n_rows, n_cols * len(lags)), np.nan, dtype=values.dtype)
+    for j, lag in enumerate(lags):
+        if lag < n_rows:
+            block[lag:, j * n_cols:(j + 1) * n_cols] = values[:n_rows - lag]
+    return block
+
+
+def add_lags(df, columns, lags, memoize=False):
+    """
+    Agregar las variables lagged de varias columnas y varios lags de una vez,
+    el bloque de lags se arma con lag_matrix y se une una sola vez al
+    dataframe en vez de insertar columna por columna.
+
+    Parameters
+    ----------
+    df : pandas.dataframe or FeatureFrame
+        Dataframe a operar, con un FeatureFrame los lags se escriben en su
+        buffer.
+    columns : list
+        Lista de columas a las cuales agregar variables lagged.
+    lags : list
+        Lista de lags, ej: [1, 4, 12, 24].
+    memoize : bool, optional
+        Reusar los lags guardados en el cache de features.
+        The default is False.
+
+    Returns
+    -------
     df : pandas.dataframe
+        Dataframe con las variables lag agregadas.
+
+    """
+    lags = list(lags)
+    # el bloque queda en la precisión de las columnas flotantes
+    if isinstance(df, FeatureFrame):
+        dtype = df.dtype
+        values = df.values(columns)
+    else:
+        floats = [df[col].dtype for col in columns
+                  if pd.api.types.is_float_dtype(df[col])]
+        dtype = np.result_type(*floats) if floats else np.dtype(np.float64)
+        values = df[columns].to_numpy(dtype=dtype)
+    if memoize:
+        results = memoized_columns(
+            values, columns, "lag", lags,
+            lambda block, missing: dict(zip(missing, np.split(
+                lag_matrix(block, missing), len(missing), axis=1))))
+        block = np.column_stack([results[(col, lag)]
+                                 for lag in lags for col in columns])
+    else:
+        block = lag_matrix(values, lags)
+    names = [col + f'_lagged_{lag}' for lag in lags for col in columns]
+    if isinstance(df, FeatureFrame):
+        df.add(names, block)
+        return df
+    block = pd.DataFrame(block, columns=names, index=df.index)
+    df = df.drop(columns=[name for name in names if name in df.columns])
+    df = pd.concat([df, block], axis=1)
+    return df
+
+
+def add_column_lags(df, lags):
+    """
+    Agregar lags distintos para cada columna, ej: los que encuentra
+    lag_discovery.discover_lags, agrupando las columnas por lag para armar
+    el bloque con lag_matrix y unirlo una sola vez al dataframe.
+
+    Parameters
+    ----------
+    df : pandas.dataframe or FeatureFrame
+        Dataframe a operar.
+    lags : dict
+        Lags de cada columna, ej: {"Coquimbo": [2, 7], "PIB": [1]}.
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Dataframe con las variables lag agregadas.
+
+    """
+    by_lag = {}
+    for col, col_lags in lags.items():
+        for lag in col_lags:
+            by_lag.setdefault(lag, []).append(col)
+    names = []
+    blocks = []
+    for lag in sorted(by_lag):
+        columns = by_lag[lag]
+        if isinstance(df, FeatureFrame):
+            values = df.values(columns)
+        else:
+            floats = [df[col].dtype for col in columns
+                      if pd.api.types.is_float_dtype(df[col])]
+            dtype = np.result_type(*floats) if floats else \
+                np.dtype(np.float64)
+            values = df[columns].to_numpy(dtype=dtype)
+        names += [col + f'_lagged_{lag}' for col in columns]
+        blocks.append(lag_matrix(values, [lag]))
+    if not blocks:
+        return df
+    if isinstance(df, FeatureFrame):
+        df.add(names, np.concatenate(blocks, axis=1))
+        return df
+    block = pd.concat([pd.DataFrame(block, index=df.index)
+                       for block in blocks], axis=1)
+    block.columns = names
+    df = df.drop(columns=[name for name in names if name in df.columns])
+    df = pd.concat([df, block], axis=1)
+    return df
+
+
+def log_features(df, columns, memoize=False):
+    """
+    Agregar logaritmo de las variables
+
+    Parameters
+    ----------
+    df : pandas.dataframe or FeatureFrame
         Dataframe a operar.
     columns : list
         lista de columas a las cuales agregar variables aplicar log.
+    memoize : bool, optional
+        Reusar los logaritmos guardados en el cache de features.
+        The default is False.
 
     Returns
     -------
@@ -44,25 +184,186 @@ def log_features(df, columns):
         Dataframe con las variables agregadas con logaritmo.
 
     """
-    for col in columns:
-        log_column = 'log_' + col
-        df[log_column] = df[col].apply(lambda x: np.log(x) + 1)
+    names = ['log_' + col for col in columns]
+    if isinstance(df, FeatureFrame):
+        values = df.values(columns)
+    else:
+        values = df[columns].to_numpy(dtype=np.float64)
+    if memoize:
+        results = memoized_columns(
+            values.astype(np.float64), columns, "log", [None],
+            lambda block, missing: {None: transform_block(block, "log")})
+        block = np.column_stack([results[(col, None)] for col in columns])
+    else:
+        block = transform_block(values, "log")
+    if isinstance(df, FeatureFrame):
+        df.add(names, block)
+        return df
+    for j, col in enumerate(columns):
+        df[names[j]] = block[:, j].astype(feature_dtype(df[col]))
     return df
 
 
-def cumulative_simple_stats(df, cols, window=3):
+# transformaciones elementwise, nombre: (prefijo o sufijo del feature,
+# periodo por defecto), las que tienen periodo comparan con periodo filas
+# atrás
+TRANSFORMS = {"log": ("log_{col}", None),
+              "log1p": ("log1p_{col}", None),
+              "safe_log": ("safelog_{col}", None),
+              "diff": ("{col}_diff_{period}", 1),
+              "seasonal_diff": ("{col}_sdiff_{period}", 12),
+              "pct_change": ("{col}_pct_{period}", 1),
+              "yoy": ("{col}_yoy_{period}", 12)}
+
+
+def transform_block(values, transform, period=None, epsilon=1e-8,
+                    invalid="keep"):
+    """
+    Aplica una transformación elementwise a un bloque de columnas de una
+    vez, con ufuncs de numpy:
+        - "log": np.log(x) + 1, igual que log_features.
+        - "log1p": np.log1p(x).
+        - "safe_log": np.log(x + epsilon), para series con ceros como las
+          precipitaciones.
+        - "diff": x(t) - x(t - period).
+        - "seasonal_diff": x(t) - x(t - 12).
+        - "pct_change": x(t) / x(t - period) - 1.
+        - "yoy": crecimiento anual en porcentaje,
+          100 * (x(t) / x(t - 12) - 1).
+    Los valores inválidos son los infinitos y nans que genera la
+    transformación a partir de valores que no eran nan (log de 0 o de
+    negativos, división por 0), invalid define que hacer con ellos.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Arreglo de (filas, columnas) ordenado en el tiempo.
+    transform : string
+        Nombre de la transformación, ver TRANSFORMS.
+    period : int, optional
+        Filas hacia atrás de diff, pct_change y yoy. The default is None,
+        el periodo por defecto de la transformación.
+    epsilon : float, optional
+        Constante de safe_log. The default is 1e-8.
+    invalid : string, optional
+        "keep" deja los infinitos y nans tal cual, "nan" los reemplaza por
+        nan y "raise" levanta un ValueError. The default is "keep".
+
+    Returns
+    -------
+    result : numpy.array
+        Arreglo de (filas, columnas) transformado.
+
+    """
+    if transform not in TRANSFORMS:
+        raise ValueError(f"Transformación no soportada: {transform}")
+    if invalid not in ("keep", "nan", "raise"):
+        raise ValueError(f"Política de inválidos no soportada: {invalid}")
+    values = np.asarray(values, dtype=np.float64)
+    if period is None:
+        period = TRANSFORMS[transform][1]
+    inputs_valid = ~np.isnan(values)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if transform == "log":
+            result = np.log(values) + 1
+        elif transform == "log1p":
+            result = np.log1p(values)
+        elif transform == "safe_log":
+            result = np.log(values + epsilon)
+        else:
+            previous = lag_matrix(values, [period])
+            if transform in ("diff", "seasonal_diff"):
+                result = values - previous
+            elif transform == "pct_change":
+                result = values / previous - 1
+            else:
+                result = 100 * (values / previous - 1)
+            inputs_valid &= ~np.isnan(previous)
+    if invalid != "keep":
+        bad = inputs_valid & ~np.isfinite(result)
+        if invalid == "raise" and bad.any():
+            cols = np.unique(np.nonzero(bad)[1]).tolist()
+            raise ValueError(f"La transformación {transform} genera valores "
+                             f"inválidos en las columnas en posición {cols}")
+        result[bad] = np.nan
+    return result
+
+
+def add_transforms(df, columns, transforms, epsilon=1e-8, invalid="nan"):
+    """
+    Agregar transformaciones elementwise de varias columnas, cada
+    transformación se calcula sobre el bloque completo de columnas con
+    transform_block y todo se une una sola vez al dataframe. El dataframe
+    tiene que estar ordenado por fecha.
+
+    Parameters
+    ----------
+    df : pandas.dataframe or FeatureFrame
+        Dataframe a operar.
+    columns : list
+        Lista de columas a transformar.
+    transforms : list
+        Transformaciones, por nombre o como tupla (nombre, periodo), ej:
+        ["safe_log", "seasonal_diff", ("pct_change", 3)].
+    epsilon : float, optional
+        Constante de safe_log. The default is 1e-8.
+    invalid : string, optional
+        "keep", "nan" o "raise", ver transform_block. The default is "nan".
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Dataframe con las transformaciones agregadas.
+
+    """
+    if isinstance(df, FeatureFrame):
+        dtype = df.dtype
+        values = df.values(columns)
+    else:
+        floats = [df[col].dtype for col in columns
+                  if pd.api.types.is_float_dtype(df[col])]
+        dtype = np.result_type(*floats) if floats else np.dtype(np.float64)
+        values = df[columns].to_numpy(dtype=np.float64)
+    names = []
+    blocks = []
+    for transform in transforms:
+        if isinstance(transform, str):
+            transform, period = transform, None
+        else:
+            transform, period = transform
+        if transform not in TRANSFORMS:
+            raise ValueError(f"Transformación no soportada: {transform}")
+        template, default = TRANSFORMS[transform]
+        period = default if period is None else period
+        names += [template.format(col=col, period=period) for col in columns]
+        blocks.append(transform_block(values, transform, period=period,
+                                      epsilon=epsilon, invalid=invalid))
+    block = np.concatenate(blocks, axis=1).astype(dtype)
+    if isinstance(df, FeatureFrame):
+        df.add(names, block)
+        return df
+    block = pd.DataFrame(block, columns=names, index=df.index)
+    df = df.drop(columns=[name for name in names if name in df.columns])
+    df = pd.concat([df, block], axis=1)
+    return df
+
+
+def cumulative_simple_stats(df, cols, window=3, memoize=False):
     """
     En una ventana temporal de tamaño window, se hace el cálculo de stats
     acumulativas como promedio y stad
 
     Parameters
     ----------
-    df : pandas.dataframe
-        Dataframe a tratar.
+    df : pandas.dataframe or FeatureFrame
+        Dataframe a tratar, un FeatureFrame ya esta ordenado por fecha.
     cols : list
         Lista de las columnas en las cuales aplicar stats.
     window : int, optional
         Tamaño de la ventana temporal. The default is 3.
+    memoize : bool, optional
+        Reusar las stats guardadas en el cache de features.
+        The default is False.
 
     Returns
     -------
@@ -70,33 +371,40 @@ def cumulative_simple_stats(df, cols, window=3):
         Dataframe con las stats calculadas.
 
     """
+    if memoize or isinstance(df, FeatureFrame):
+        return memoized_pandas_stats(df, cols, window, ("mean", "std"),
+                                     memoize=memoize)
     df.sort_values(by=['date'], inplace=True)
     # como se ven estacionalidades, nos centraremos en stats cercanas, al mes
     # que estamos analizando
     for columna in cols:
         # promedio 3 meses
         name1 = columna + f'_mean_{str(window)}'
-        df[name1] = df[columna].rolling(window=window).mean()
+        dtype = feature_dtype(df[columna])
+        df[name1] = df[columna].rolling(window=window).mean().astype(dtype)
         # desviacion standar ultimo año
         name2 = columna + f'_std_{str(window)}'
-        df[name2] = df[columna].rolling(window=window).std()
+        df[name2] = df[columna].rolling(window=window).std().astype(dtype)
     df.reset_index(drop=True, inplace=True)
     return df
 
 
-def cumulative_distribution_stats(df, cols, window=12):
+def cumulative_distribution_stats(df, cols, window=12, memoize=False):
     """
     En una ventana temporal de tamaño window, se hace el cálculo de stats
     acumulativas como la como promedio y stad
 
     Parameters
     ----------
-    df : pandas.dataframe
-        Dataframe a tratar.
+    df : pandas.dataframe or FeatureFrame
+        Dataframe a tratar, un FeatureFrame ya esta ordenado por fecha.
     cols : list
         Lista de las columnas en las cuales aplicar stats.
     window : int, optional
         Tamaño de la ventana temporal. The default is 3.
+    memoize : bool, optional
+        Reusar las stats guardadas en el cache de features.
+        The default is False.
 
     Returns
     -------
@@ -104,15 +412,1023 @@ def cumulative_distribution_stats(df, cols, window=12):
         Dataframe con las stats calculadas.
 
     """
+    if memoize or isinstance(df, FeatureFrame):
+        return memoized_pandas_stats(df, cols, window, ("kurt", "skew"),
+                                     memoize=memoize)
     df.sort_values(by=['date'], inplace=True)
     # como se ven estacionalidades, nos centraremos en stats cercanas, al mes
     # que estamos analizando
     for columna in cols:
         # promedio 3 meses
         name1 = columna + f'_kurt_{str(window)}'
-        df[name1] = df[columna].rolling(window=window).kurt()
+        dtype = feature_dtype(df[columna])
+        df[name1] = df[columna].rolling(window=window).kurt().astype(dtype)
         # desviacion standar ultimo año
         name2 = columna + f'_skew_{str(window)}'
-        df[name2] = df[columna].rolling(window=window).skew()
+        df[name2] = df[columna].rolling(window=window).skew().astype(dtype)
+    df.reset_index(drop=True, inplace=True)
+    return df
+
+
+def feature_dtype(series):
+    """
+    Tipo de los features derivados de una columna: se mantiene la precisión
+    de la columna si es flotante (ej: float32) y si no se usa float64.
+
+    Parameters
+    ----------
+    series : pandas.series
+        Columna de origen.
+
+    Returns
+    -------
+    dtype : numpy.dtype
+        Tipo de los features.
+
+    """
+    if pd.api.types.is_float_dtype(series):
+        return series.dtype
+    return np.dtype(np.float64)
+
+
+def compact_dtypes(df, float_dtype="float32",
+                   calendar_columns=("year", "month", "trimestre"),
+                   downcast_calendar=False):
+    """
+    Pasa un dataframe a tipos compactos: las columnas flotantes a
+    float_dtype y, con downcast_calendar, las columnas de calendario al
+    entero más chico que las contenga, así los features derivados quedan en
+    la misma precisión y el dataframe usa cerca de la mitad de memoria.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Dataframe a compactar.
+    float_dtype : string, optional
+        Tipo de las columnas flotantes. The default is "float32".
+    calendar_columns : tuple, optional
+        Columnas de calendario. The default is ("year", "month", "trimestre").
+    downcast_calendar : bool, optional
+        Pasar las columnas de calendario sin nans a enteros, si no quedan
+        como las demás columnas flotantes. The default is False.
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Dataframe con tipos compactos.
+
+    """
+    dtypes = {}
+    for col in df.columns:
+        if downcast_calendar and col in calendar_columns and \
+                df[col].notna().all():
+            dtypes[col] = pd.to_numeric(df[col], downcast="integer").dtype
+        elif pd.api.types.is_float_dtype(df[col]):
+            dtypes[col] = float_dtype
+    df = df.astype(dtypes)
+    return df
+
+
+# orden del momento que necesita cada estadística
+MOMENT_ORDER = {"mean": 1, "std": 2, "skew": 3, "kurt": 4}
+
+
+def compensated_prefix_sum(values, axis=0):
+    """
+    Sumas acumuladas con compensación del error de redondeo (TwoSum),
+    devuelve la suma y su error por separado para que las diferencias entre
+    dos filas no pierdan precisión.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Arreglo sin nans.
+    axis : int, optional
+        Eje de la suma acumulada. The default is 0.
+
+    Returns
+    -------
+    total : numpy.array
+        Sumas acumuladas, con un cero al inicio del eje.
+    error : numpy.array
+        Error acumulado de las sumas, del mismo tamaño.
+
+    """
+    values = np.moveaxis(values, axis, 0)
+    zeros = np.zeros((1,) + values.shape[1:])
+    total = np.concatenate([zeros, np.cumsum(values, axis=0)])
+    previous = total[:-1]
+    partial = total[1:] - previous
+    error = (previous - (total[1:] - partial)) + (values - partial)
+    error = np.concatenate([zeros, np.cumsum(error, axis=0)])
+    return np.moveaxis(total, 0, axis), np.moveaxis(error, 0, axis)
+
+
+def rolling_moments(values, specs):
+    """
+    Calcula de una vez los momentos móviles (mean, std, skew y kurt) de
+    todas las columnas y ventanas pedidas, a partir de sumas acumuladas
+    compensadas de las potencias de los valores, compartidas por todas las
+    ventanas. Para no perder precisión las filas se agrupan en bloques de
+    cuatro veces la ventana más grande, centrados en su propio promedio, y
+    las ventanas que cruzan dos bloques se re-centran con el binomio.
+    Igual que pandas con min_periods=window: las ventanas con algún nan
+    quedan en nan, std usa ddof=1 y skew/kurt usan las mismas fórmulas
+    insesgadas. En las ventanas de valores constantes std es 0 y skew/kurt
+    quedan en nan, como en pandas 1.3.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Arreglo de (filas, columnas) ordenado en el tiempo.
+    specs : list
+        Lista de tuplas (window, stats), ej: [(3, ("mean", "std"))].
+
+    Returns
+    -------
+    moments : dict
+        Por cada (stat, window) un arreglo de (filas, columnas).
+
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n_rows, n_cols = values.shape
+    order = max(MOMENT_ORDER[stat] for _, stats in specs for stat in stats)
+    block = 4 * max(window for window, _ in specs)
+    n_blocks = max(1, -(-n_rows // block))
+    padded = np.full((n_blocks * block, n_cols), np.nan)
+    padded[:n_rows] = values
+    valid = ~np.isnan(padded)
+    # centro de cada bloque, los bloques vacios usan el promedio global
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        centers = np.nanmean(padded.reshape(n_blocks, block, n_cols), axis=1)
+        overall = np.nan_to_num(np.nanmean(padded, axis=0))
+    centers = np.where(np.isnan(centers), overall, centers)
+    centered = np.where(valid, padded - np.repeat(centers, block, axis=0),
+                        0.0).reshape(n_blocks, block, n_cols)
+    power_sums = [compensated_prefix_sum(centered ** p, axis=1)
+                  for p in range(1, order + 1)]
+    count = np.concatenate([np.zeros((1, n_cols)),
+                            np.cumsum(valid[:n_rows], axis=0)])
+    # largo de la racha de valores iguales terminando en cada fila, para
+    # detectar ventanas constantes
+    equal = np.zeros(values.shape, dtype=bool)
+    equal[1:] = values[1:] == values[:-1]
+    counter = np.cumsum(equal, axis=0)
+    reset = np.maximum.accumulate(np.where(equal, 0, counter), axis=0)
+    same = counter - reset + 1
+    # posición de cada fila en su bloque
+    rows = np.arange(n_rows)
+    row_block = rows // block
+    position = rows % block
+    previous_block = np.maximum(row_block - 1, 0)
+    shift = centers[previous_block] - centers[row_block]
+    moments = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for window, stats in specs:
+            degree = max(MOMENT_ORDER[stat] for stat in stats)
+            start = np.maximum(rows - window + 1, 0)
+            nobs = count[rows + 1] - count[start]
+            complete = (nobs == window) & (rows >= window - 1)[:, None]
+            constant = same >= window
+            # parte de la ventana en el bloque de la fila
+            low = np.maximum(position + 1 - window, 0)
+            sums = [(total[row_block, position + 1] - total[row_block, low]) +
+                    (error[row_block, position + 1] - error[row_block, low])
+                    for total, error in power_sums[:degree]]
+            # filas cuya ventana parte en el bloque anterior, esa parte se
+            # re-centra al centro del bloque de la fila con el binomio
+            cross = np.nonzero((position < window - 1) & (row_block > 0))[0]
+            cross_block = previous_block[cross]
+            cross_low = block - (window - 1 - position[cross])
+            previous = [count[row_block[cross] * block] - count[start[cross]]]
+            previous += [(total[cross_block, block] -
+                          total[cross_block, cross_low]) +
+                         (error[cross_block, block] -
+                          error[cross_block, cross_low])
+                         for total, error in power_sums[:degree]]
+            cross_shift = shift[cross]
+            for p in range(1, degree + 1):
+                sums[p - 1][cross] += sum(
+                    comb(p, q) * previous[q] * cross_shift ** (p - q)
+                    for q in range(p + 1))
+            sums = [values_sum / nobs for values_sum in sums]
+            # momentos centrales de cada ventana
+            a = sums[0]
+            moment = [a + centers[row_block]]
+            if degree > 1:
+                moment.append(sums[1] - a * a)
+            if degree > 2:
+                moment.append(sums[2] - a ** 3 - 3 * a * moment[1])
+            if degree > 3:
+                moment.append(sums[3] - a ** 4 - 6 * moment[1] * a * a -
+                              4 * moment[2] * a)
+            if degree > 1:
+                # las ventanas mal condicionadas (promedio o bloque anterior
+                # muy lejos del centro del bloque comparado con la varianza)
+                # se recalculan directo con dos pasadas sobre la ventana
+                distance = a * a
+                distance[cross] = np.maximum(distance[cross],
+                                             cross_shift * cross_shift)
+                unstable = complete & ~constant & (distance > 1e3 * moment[1])
+                moment = window_central_moments(values, window, unstable,
+                                                moment)
+            for stat in stats:
+                result = window_statistic(stat, moment, nobs, constant)
+                result[~complete] = np.nan
+                moments[(stat, window)] = result
+    return moments
+
+
+def window_central_moments(values, window, mask, moment):
+    """
+    Recalcula directo, con dos pasadas sobre cada ventana, el promedio y los
+    momentos centrales de las ventanas marcadas en mask.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Arreglo de (filas, columnas) ordenado en el tiempo.
+    window : int
+        Tamaño de la ventana.
+    mask : numpy.array
+        Ventanas a recalcular, de (filas, columnas).
+    moment : list
+        Promedio y momentos centrales de orden 2, 3 y 4 de cada ventana.
+
+    Returns
+    -------
+    moment : list
+        Momentos con las ventanas marcadas recalculadas.
+
+    """
+    rows, cols = np.nonzero(mask)
+    if len(rows) == 0:
+        return moment
+    windows = values[rows[:, None] + np.arange(1 - window, 1), cols[:, None]]
+    mean = windows.mean(axis=1)
+    deviation = windows - mean[:, None]
+    moment = [m.copy() for m in moment]
+    moment[0][rows, cols] = mean
+    for p in range(2, len(moment) + 1):
+        moment[p - 1][rows, cols] = (deviation ** p).mean(axis=1)
+    return moment
+
+
+def window_statistic(stat, moment, nobs, constant):
+    """
+    Estadística de cada ventana a partir del promedio y los momentos
+    centrales, con las mismas fórmulas que usa pandas en rolling.
+
+    Parameters
+    ----------
+    stat : string
+        "mean", "std", "skew" o "kurt".
+    moment : list
+        Promedio y momentos centrales de orden 2, 3 y 4 de cada ventana.
+    nobs : numpy.array
+        Cantidad de valores en cada ventana.
+    constant : numpy.array
+        Ventanas con todos los valores iguales.
+
+    Returns
+    -------
+    result : numpy.array
+        Estadística de cada ventana.
+
+    """
+    if stat == "mean":
+        result = moment[0].copy()
+    elif stat == "std":
+        var = moment[1] * nobs / (nobs - 1)
+        var = np.where(constant | (var < 0), 0.0, var)
+        result = np.sqrt(var)
+    elif stat == "skew":
+        b, c = moment[1], moment[2]
+        result = np.sqrt(nobs * (nobs - 1)) * c / ((nobs - 2) * b ** 1.5)
+        result[(b <= 1e-14) | constant] = np.nan
+        result[nobs < 3] = np.nan
+    elif stat == "kurt":
+        b, d = moment[1], moment[3]
+        k = (nobs * nobs - 1) * d / (b * b) - 3 * ((nobs - 1) ** 2)
+        result = k / ((nobs - 2) * (nobs - 3))
+        result[(b <= 1e-14) | constant] = np.nan
+        result[nobs < 4] = np.nan
+    else:
+        raise ValueError(f"Estadística no soportada: {stat}")
+    return result
+
+
+def add_rolling_moments(df, cols, specs, memoize=False):
+    """
+    Agregar estadísticas móviles de varias ventanas en una sola pasada, es
+    el reemplazo de llamar cumulative_simple_stats y
+    cumulative_distribution_stats una vez por ventana: el dataframe se
+    ordena por fecha una vez y el bloque de features se une de una vez.
+
+    Parameters
+    ----------
+    df : pandas.dataframe or FeatureFrame
+        Dataframe a tratar, un FeatureFrame ya esta ordenado por fecha.
+    cols : list
+        Lista de las columnas en las cuales aplicar stats.
+    specs : list
+        Lista de tuplas (window, stats), ej:
+        [(3, ("mean", "std")), (12, ("kurt", "skew"))].
+    memoize : bool, optional
+        Reusar las stats guardadas en el cache de features.
+        The default is False.
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Dataframe con las stats calculadas.
+
+    """
+    if isinstance(df, FeatureFrame):
+        dtype = df.dtype
+        values = df.values(cols).astype(np.float64)
+    else:
+        df = df.sort_values(by=['date'], kind="mergesort")
+        df.reset_index(drop=True, inplace=True)
+        floats = [df[col].dtype for col in cols
+                  if pd.api.types.is_float_dtype(df[col])]
+        dtype = np.result_type(*floats) if floats else np.dtype(np.float64)
+        values = df[cols].to_numpy(dtype=np.float64)
+    if memoize:
+        params = [(stat, window) for window, stats in specs
+                  for stat in stats]
+        results = memoized_columns(
+            values, cols, "rolling", params,
+            lambda block, missing: rolling_moments(block, [
+                (window, tuple(stat for stat, w in missing if w == window))
+                for window in dict.fromkeys(w for _, w in missing)]))
+    else:
+        moments = rolling_moments(values, specs)
+        results = {(col, key): value[:, j] for key, value in moments.items()
+                   for j, col in enumerate(cols)}
+    names = []
+    blocks = []
+    for window, stats in specs:
+        for col in cols:
+            for stat in stats:
+                names.append(col + f'_{stat}_{str(window)}')
+                blocks.append(results[(col, (stat, window))])
+    if isinstance(df, FeatureFrame):
+        df.add(names, np.column_stack(blocks))
+        return df
+    block = pd.DataFrame(np.column_stack(blocks).astype(dtype),
+                         columns=names, index=df.index)
+    df = df.drop(columns=[name for name in names if name in df.columns])
+    df = pd.concat([df, block], axis=1)
+    return df
+
+
+# cache en memoria de los features derivados, por (hash de los datos de la
+# columna, transformación, parámetros), con eviction LRU cuando se pasa del
+# presupuesto de memoria
+FEATURE_CACHE = {"entries": OrderedDict(),
+                 "nbytes": 0,
+                 "max_bytes": 512 * 1024 ** 2,
+                 "hits": 0,
+                 "misses": 0}
+
+
+def configure_feature_cache(max_bytes):
+    """
+    Cambia el presupuesto de memoria del cache de features, si el cache ya
+    ocupa más se sacan los features usados hace más tiempo.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Memoria máxima del cache en bytes.
+
+    Returns
+    -------
+    None.
+
+    """
+    FEATURE_CACHE["max_bytes"] = int(max_bytes)
+    evict_features()
+
+
+def clear_feature_cache():
+    """
+    Vacía el cache de features y reinicia los contadores.
+
+    Returns
+    -------
+    None.
+
+    """
+    FEATURE_CACHE["entries"].clear()
+    FEATURE_CACHE["nbytes"] = 0
+    FEATURE_CACHE["hits"] = 0
+    FEATURE_CACHE["misses"] = 0
+
+
+def feature_cache_info():
+    """
+    Estado del cache de features.
+
+    Returns
+    -------
+    info : dict
+        Hits, misses, cantidad de features guardados, memoria usada y
+        presupuesto en bytes.
+
+    """
+    info = {"hits": FEATURE_CACHE["hits"],
+            "misses": FEATURE_CACHE["misses"],
+            "entries": len(FEATURE_CACHE["entries"]),
+            "nbytes": FEATURE_CACHE["nbytes"],
+            "max_bytes": FEATURE_CACHE["max_bytes"]}
+    return info
+
+
+def evict_features():
+    """
+    Saca del cache los features usados hace más tiempo hasta quedar dentro
+    del presupuesto de memoria.
+
+    Returns
+    -------
+    None.
+
+    """
+    entries = FEATURE_CACHE["entries"]
+    while entries and FEATURE_CACHE["nbytes"] > FEATURE_CACHE["max_bytes"]:
+        _, value = entries.popitem(last=False)
+        FEATURE_CACHE["nbytes"] -= value.nbytes
+
+
+def column_hash(values):
+    """
+    Hash de los datos de una columna, incluyendo su tipo y largo.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Valores de la columna.
+
+    Returns
+    -------
+    key : string
+        Hash hexadecimal.
+
+    """
+    values = np.ascontiguousarray(values)
+    digest = hashlib.sha256(f"{values.dtype.str}{values.shape}".encode())
+    digest.update(values.tobytes())
+    key = digest.hexdigest()[0:16]
+    return key
+
+
+def memoized_columns(values, columns, transform, params, builder):
+    """
+    Busca en el cache la transformación de cada columna con cada parámetro,
+    y calcula de una vez con builder solo las combinaciones que faltan.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Arreglo de (filas, columnas) con los datos de las columnas.
+    columns : list
+        Nombres de las columnas.
+    transform : string
+        Nombre de la transformación, ej: "lag".
+    params : list
+        Parámetros de la transformación, ej: los lags.
+    builder : function
+        Recibe el arreglo de las columnas que faltan y la lista de
+        parámetros que faltan, y retorna un dict con un arreglo de
+        (filas, columnas) por parámetro.
+
+    Returns
+    -------
+    results : dict
+        Por cada (columna, parámetro) el arreglo con la transformación.
+
+    """
+    entries = FEATURE_CACHE["entries"]
+    keys = [(column_hash(values[:, j]), transform)
+            for j in range(len(columns))]
+    results = {}
+    missing_cols = []
+    missing_params = []
+    for j, col in enumerate(columns):
+        for param in params:
+            key = keys[j] + (param,)
+            if key in entries:
+                entries.move_to_end(key)
+                FEATURE_CACHE["hits"] += 1
+                results[(col, param)] = entries[key]
+            else:
+                FEATURE_CACHE["misses"] += 1
+                if j not in missing_cols:
+                    missing_cols.append(j)
+                if param not in missing_params:
+                    missing_params.append(param)
+    if missing_cols:
+        computed = builder(values[:, missing_cols], missing_params)
+        for param in missing_params:
+            for k, j in enumerate(missing_cols):
+                value = np.ascontiguousarray(computed[param][:, k])
+                value.setflags(write=False)
+                results[(columns[j], param)] = value
+                key = keys[j] + (param,)
+                if key not in entries and value.nbytes <= \
+                        FEATURE_CACHE["max_bytes"]:
+                    entries[key] = value
+                    FEATURE_CACHE["nbytes"] += value.nbytes
+        evict_features()
+    return results
+
+
+def memoized_pandas_stats(df, cols, window, stats, memoize=True):
+    """
+    Versión por bloques de cumulative_simple_stats y
+    cumulative_distribution_stats, las stats se calculan con pandas sobre
+    todas las columnas de una vez y, con memoize, solo para las columnas que
+    no estan en el cache.
+
+    Parameters
+    ----------
+    df : pandas.dataframe or FeatureFrame
+        Dataframe a tratar.
+    cols : list
+        Lista de las columnas en las cuales aplicar stats.
+    window : int
+        Tamaño de la ventana temporal.
+    stats : tuple
+        Stats a calcular, ("mean", "std") o ("kurt", "skew").
+    memoize : bool, optional
+        Reusar las stats guardadas en el cache de features.
+        The default is True.
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Dataframe con las stats calculadas.
+
+    """
+    def builder(block, missing):
+        rolling = pd.DataFrame(block).rolling(window=window)
+        return {param: getattr(rolling, param[0])().to_numpy()
+                for param in missing}
+
+    params = [(stat, window) for stat in stats]
+    if isinstance(df, FeatureFrame):
+        values = df.values(cols).astype(np.float64)
+    else:
+        df.sort_values(by=['date'], inplace=True, kind="mergesort")
+        values = df[cols].to_numpy(dtype=np.float64)
+    if memoize:
+        results = memoized_columns(values, cols, "pandas_rolling", params,
+                                   builder)
+    else:
+        computed = builder(values, params)
+        results = {(col, param): computed[param][:, j]
+                   for param in params for j, col in enumerate(cols)}
+    if isinstance(df, FeatureFrame):
+        names = [columna + f'_{stat}_{str(window)}'
+                 for columna in cols for stat in stats]
+        df.add(names, np.column_stack([results[(columna, param)]
+                                       for columna in cols
+                                       for param in params]))
+        return df
+    for columna in cols:
+        dtype = feature_dtype(df[columna])
+        for stat in stats:
+            df[columna + f'_{stat}_{str(window)}'] = \
+                results[(columna, (stat, window))].astype(dtype)
     df.reset_index(drop=True, inplace=True)
     return df
+
+
+def group_positions(keys):
+    """
+    Posición de cada fila dentro de su grupo, en un arreglo ordenado por
+    grupo (segmentos contiguos), a partir de los offsets donde empieza cada
+    grupo, sin recorrer los grupos en python.
+
+    Parameters
+    ----------
+    keys : numpy.array
+        Llave del grupo de cada fila, ordenada por grupo.
+
+    Returns
+    -------
+    position : numpy.array
+        Posición de cada fila dentro de su grupo, partiendo en 0.
+
+    """
+    keys = np.asarray(keys)
+    n_rows = len(keys)
+    offsets = np.concatenate([[0], np.flatnonzero(keys[1:] != keys[:-1]) + 1])
+    sizes = np.diff(np.append(offsets, n_rows))
+    position = np.arange(n_rows) - np.repeat(offsets, sizes)
+    return position
+
+
+def panel_sort(df, entity_column, date_column="date"):
+    """
+    Ordena un panel en formato largo por (entidad, fecha), así cada serie
+    queda en un segmento contiguo ordenado en el tiempo.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Panel con una fila por (entidad, fecha).
+    entity_column : string
+        Columna de la entidad, ej: producto o región.
+    date_column : string, optional
+        Columna de fechas. The default is "date".
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Panel ordenado, con el índice reiniciado.
+    position : numpy.array
+        Posición de cada fila dentro de su serie.
+
+    """
+    df = df.sort_values(by=[entity_column, date_column], kind="mergesort")
+    df.reset_index(drop=True, inplace=True)
+    keys, _ = pd.factorize(df[entity_column])
+    position = group_positions(keys)
+    return df, position
+
+
+def add_panel_lags(df, columns, lags, entity_column, date_column="date"):
+    """
+    Versión de panel de add_lags: los lags se calculan sobre todas las
+    series concatenadas con lag_matrix y se dejan en nan las filas cuyo lag
+    caería en la serie anterior, sin cruzar entidades.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Panel con una fila por (entidad, fecha).
+    columns : list
+        Lista de columas a las cuales agregar variables lagged.
+    lags : list
+        Lista de lags, ej: [1, 4, 12, 24].
+    entity_column : string
+        Columna de la entidad.
+    date_column : string, optional
+        Columna de fechas. The default is "date".
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Panel ordenado por (entidad, fecha) con las variables lag agregadas.
+
+    """
+    lags = list(lags)
+    df, position = panel_sort(df, entity_column, date_column)
+    floats = [df[col].dtype for col in columns
+              if pd.api.types.is_float_dtype(df[col])]
+    dtype = np.result_type(*floats) if floats else np.dtype(np.float64)
+    block = lag_matrix(df[columns].to_numpy(dtype=dtype), lags)
+    n_cols = len(columns)
+    for j, lag in enumerate(lags):
+        block[position < lag, j * n_cols:(j + 1) * n_cols] = np.nan
+    names = [col + f'_lagged_{lag}' for lag in lags for col in columns]
+    block = pd.DataFrame(block, columns=names, index=df.index)
+    df = df.drop(columns=[name for name in names if name in df.columns])
+    df = pd.concat([df, block], axis=1)
+    return df
+
+
+def add_panel_rolling_moments(df, cols, specs, entity_column,
+                              date_column="date"):
+    """
+    Versión de panel de add_rolling_moments: los momentos móviles se
+    calculan de una vez sobre todas las series concatenadas con
+    rolling_moments y se dejan en nan las ventanas que empiezan en la serie
+    anterior, sin cruzar entidades.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Panel con una fila por (entidad, fecha).
+    cols : list
+        Lista de las columnas en las cuales aplicar stats.
+    specs : list
+        Lista de tuplas (window, stats), ej: [(3, ("mean", "std"))].
+    entity_column : string
+        Columna de la entidad.
+    date_column : string, optional
+        Columna de fechas. The default is "date".
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Panel ordenado por (entidad, fecha) con las stats calculadas.
+
+    """
+    df, position = panel_sort(df, entity_column, date_column)
+    floats = [df[col].dtype for col in cols
+              if pd.api.types.is_float_dtype(df[col])]
+    dtype = np.result_type(*floats) if floats else np.dtype(np.float64)
+    moments = rolling_moments(df[cols].to_numpy(dtype=np.float64), specs)
+    names = []
+    blocks = []
+    for window, stats in specs:
+        partial = position < window - 1
+        for stat in stats:
+            moments[(stat, window)][partial] = np.nan
+        for j, col in enumerate(cols):
+            for stat in stats:
+                names.append(col + f'_{stat}_{str(window)}')
+                blocks.append(moments[(stat, window)][:, j])
+    block = pd.DataFrame(np.column_stack(blocks).astype(dtype),
+                         columns=names, index=df.index)
+    df = df.drop(columns=[name for name in names if name in df.columns])
+    df = pd.concat([df, block], axis=1)
+    return df
+
+
+def add_panel_transforms(df, columns, transforms, entity_column,
+                         date_column="date", epsilon=1e-8, invalid="nan"):
+    """
+    Versión de panel de add_transforms (log, diff, pct_change, yoy, ...):
+    las transformaciones con periodo dejan en nan las filas que compararían
+    con la serie anterior, sin cruzar entidades.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Panel con una fila por (entidad, fecha).
+    columns : list
+        Lista de columas a transformar.
+    transforms : list
+        Transformaciones, por nombre o como tupla (nombre, periodo).
+    entity_column : string
+        Columna de la entidad.
+    date_column : string, optional
+        Columna de fechas. The default is "date".
+    epsilon : float, optional
+        Constante de safe_log. The default is 1e-8.
+    invalid : string, optional
+        "keep", "nan" o "raise", ver transform_block. The default is "nan".
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Panel ordenado por (entidad, fecha) con las transformaciones.
+
+    """
+    df, position = panel_sort(df, entity_column, date_column)
+    df = add_transforms(df, columns, transforms, epsilon=epsilon,
+                        invalid=invalid)
+    for transform in transforms:
+        if isinstance(transform, str):
+            transform, period = transform, None
+        else:
+            transform, period = transform
+        template, default = TRANSFORMS[transform]
+        period = default if period is None else period
+        if period is not None:
+            names = [template.format(col=col, period=period)
+                     for col in columns]
+            df.loc[position < period, names] = np.nan
+    return df
+
+
+def ewm_alpha(span=None, halflife=None):
+    """
+    Factor de suavizamiento de un promedio exponencial, igual que pandas.
+
+    Parameters
+    ----------
+    span : float, optional
+        Span, alpha = 2 / (span + 1). The default is None.
+    halflife : float, optional
+        Vida media, alpha = 1 - exp(-log(2) / halflife). The default is None.
+
+    Returns
+    -------
+    alpha : float
+        Factor de suavizamiento.
+
+    """
+    if (span is None) == (halflife is None):
+        raise ValueError("Hay que entregar span o halflife")
+    if span is not None:
+        return 2 / (span + 1)
+    return 1 - np.exp(-np.log(2) / halflife)
+
+
+def init_ewm_state(n_cols, alphas):
+    """
+    Estado de los promedios exponenciales de varias columnas y varios
+    alphas: promedio y varianza sesgada actuales, suma de pesos, suma de
+    pesos al cuadrado y peso acumulado, igual que el estado que usa pandas.
+
+    Parameters
+    ----------
+    n_cols : int
+        Cantidad de columnas.
+    alphas : list
+        Factores de suavizamiento.
+
+    Returns
+    -------
+    state : dict
+        Estado de los promedios exponenciales.
+
+    """
+    alphas = np.asarray(alphas, dtype=np.float64)[:, None]
+    shape = (len(alphas), n_cols)
+    state = {"decay": 1 - alphas,
+             "mean": np.full(shape, np.nan),
+             "cov": np.zeros(shape),
+             "weight": np.ones(shape),
+             "weight2": np.ones(shape),
+             "old_weight": np.ones(shape),
+             "nobs": np.zeros(n_cols)}
+    return state
+
+
+def update_ewm_state(state, values):
+    """
+    Agrega una fila al estado con la actualización recursiva de pandas
+    (adjust=True, ignore_na=False), vectorizada sobre (alphas, columnas):
+    los pesos anteriores decaen por (1 - alpha) también en las filas con nan
+    y la fila nueva entra con peso 1.
+
+    Parameters
+    ----------
+    state : dict
+        Estado de los promedios exponenciales, se actualiza en el lugar.
+    values : numpy.array
+        Valores de la fila, uno por columna.
+
+    Returns
+    -------
+    state : dict
+        Estado actualizado.
+
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    mean = state["mean"]
+    started = ~np.isnan(mean)
+    decay = np.where(started, state["decay"], 1.0)
+    state["weight"] = state["weight"] * decay
+    state["weight2"] = state["weight2"] * decay * decay
+    old = state["old_weight"] * decay
+    update = started & valid
+    with np.errstate(invalid="ignore"):
+        new_mean = np.where(mean != values,
+                            (old * mean + values) / (old + 1), mean)
+        cov = (old * (state["cov"] + (mean - new_mean) ** 2) +
+               (values - new_mean) ** 2) / (old + 1)
+    state["mean"] = np.where(update, new_mean,
+                             np.where(valid & ~started, values, mean))
+    state["cov"] = np.where(update, cov, state["cov"])
+    state["weight"] = state["weight"] + update
+    state["weight2"] = state["weight2"] + update
+    state["old_weight"] = old + update
+    state["nobs"] = state["nobs"] + valid
+    return state
+
+
+def ewm_statistics(state, stats):
+    """
+    Promedio, varianza y desviación exponencial a partir del estado, con las
+    fórmulas de pandas (bias=False).
+
+    Parameters
+    ----------
+    state : dict
+        Estado de los promedios exponenciales.
+    stats : tuple
+        Estadísticas, "mean", "var" o "std".
+
+    Returns
+    -------
+    result : dict
+        Por cada estadística un arreglo de (alphas, columnas).
+
+    """
+    observed = state["nobs"] >= 1
+    square = state["weight"] * state["weight"]
+    denominator = square - state["weight2"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        var = np.where(observed & (denominator > 0),
+                       square / denominator * state["cov"], np.nan)
+    result = {}
+    for stat in stats:
+        if stat == "mean":
+            result[stat] = np.where(observed, state["mean"], np.nan)
+        elif stat == "var":
+            result[stat] = var
+        elif stat == "std":
+            result[stat] = np.sqrt(var)
+        else:
+            raise ValueError(f"Estadística no soportada: {stat}")
+    return result
+
+
+def ewm_moments(values, alphas, stats=("mean", "std")):
+    """
+    Promedios y varianzas exponenciales de todas las columnas y todos los
+    alphas en una sola pasada recursiva sobre las filas, cada paso es una
+    operación vectorizada sobre (alphas, columnas). Igual que
+    pandas.ewm(alpha=alpha).mean() / .var() / .std(), a diferencia de las
+    ventanas móviles no necesita una ventana completa de historia.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Arreglo de (filas, columnas) ordenado en el tiempo.
+    alphas : list
+        Factores de suavizamiento, ver ewm_alpha.
+    stats : tuple, optional
+        Estadísticas, "mean", "var" o "std". The default is ("mean", "std").
+
+    Returns
+    -------
+    moments : dict
+        Por cada (stat, posición del alpha en alphas) un arreglo de
+        (filas, columnas), así un span y una vida media con el mismo alpha
+        no se pisan.
+    state : dict
+        Estado en la última fila, para seguir con update_ewm_state.
+
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n_rows, n_cols = values.shape
+    state = init_ewm_state(n_cols, alphas)
+    moments = {(stat, k): np.empty((n_rows, n_cols))
+               for stat in stats for k in range(len(alphas))}
+    for t in range(n_rows):
+        state = update_ewm_state(state, values[t])
+        result = ewm_statistics(state, stats)
+        for stat in stats:
+            for k in range(len(alphas)):
+                moments[(stat, k)][t] = result[stat][k]
+    return moments, state
+
+
+def add_ewm_features(df, cols, spans=(), halflives=(),
+                     stats=("mean", "std")):
+    """
+    Agregar promedios y desviaciones exponenciales de varias columnas, para
+    una lista de spans y/o vidas medias, todos en una sola pasada con
+    ewm_moments. Los nombres son "{col}_ewm_{stat}_{span}" y
+    "{col}_ewm_{stat}_hl{halflife}".
+
+    Parameters
+    ----------
+    df : pandas.dataframe or FeatureFrame
+        Dataframe a tratar.
+    cols : list
+        Lista de las columnas en las cuales aplicar stats.
+    spans : list, optional
+        Spans, ej: [3, 12, 24]. The default is ().
+    halflives : list, optional
+        Vidas medias. The default is ().
+    stats : tuple, optional
+        Estadísticas, "mean", "var" o "std". The default is ("mean", "std").
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Dataframe con las stats calculadas.
+
+    """
+    suffixes = [str(span) for span in spans] + \
+        [f"hl{halflife}" for halflife in halflives]
+    alphas = [ewm_alpha(span=span) for span in spans] + \
+        [ewm_alpha(halflife=halflife) for halflife in halflives]
+    if isinstance(df, FeatureFrame):
+        dtype = df.dtype
+        values = df.values(cols).astype(np.float64)
+    else:
+        df = df.sort_values(by=['date'], kind="mergesort")
+        df.reset_index(drop=True, inplace=True)
+        floats = [df[col].dtype for col in cols
+                  if pd.api.types.is_float_dtype(df[col])]
+        dtype = np.result_type(*floats) if floats else np.dtype(np.float64)
+        values = df[cols].to_numpy(dtype=np.float64)
+    moments, _ = ewm_moments(values, alphas, stats)
+    names = []
+    blocks = []
+    for k, suffix in enumerate(suffixes):
+        for j, col in enumerate(cols):
+            for stat in stats:
+                names.append(col + f'_ewm_{stat}_{suffix}')
+                blocks.append(moments[(stat, k)][:, j])
+    block = np.column_stack(blocks).astype(dtype)
+    if isinstance(df, FeatureFrame):
+        df.add(names, block)
+        return df
+    block = pd.DataFrame(block, columns=names, index=df.index)
+    df = df.drop(columns=[name for name in names if name in df.columns])
+    df = pd.concat([df, block], axis=1)
+    return df
@@ -0,0 +1,216 @@
+import numpy as np
+import pandas as pd
+
+
+class FeatureFrame:
+    """
+    Contenedor columnar de features: todas las columnas flotantes viven en un
+    solo buffer 2-D contiguo (orden Fortran, una columna contigua en memoria)
+    reservado de antemano, con un mapa de nombre a columna del buffer. Las
+    funciones de feature_engineering escriben sus bloques directo en el
+    buffer, en vez de insertar columna por columna en el dataframe, y al
+    final se convierte una sola vez a dataframe o arreglo sin copiar.
+    Las filas se ordenan por fecha una sola vez al construirlo, así las
+    funciones que necesitan el orden temporal no vuelven a ordenar.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Dataframe con las columnas base.
+    capacity : int, optional
+        Cantidad de columnas a reservar en el buffer, si se llena se duplica.
+        The default is None, el doble de las columnas flotantes de df.
+    date_column : string, optional
+        Columna de fechas. The default is "date".
+    dtype : string, optional
+        Tipo del buffer. The default is None, la precisión de las columnas
+        flotantes de df o float64.
+
+    """
+
+    def __init__(self, df, capacity=None, date_column="date", dtype=None):
+        df = df.sort_values(by=[date_column], kind="mergesort")
+        df.reset_index(drop=True, inplace=True)
+        floats = [col for col in df.columns
+                  if pd.api.types.is_float_dtype(df[col])]
+        if dtype is None:
+            dtype = np.result_type(*[df[col].dtype for col in floats]) \
+                if floats else np.dtype(np.float64)
+        if capacity is None:
+            capacity = 2 * len(floats)
+        self.date_column = date_column
+        self.dtype = np.dtype(dtype)
+        self.index = df.index
+        self.buffer = np.empty((len(df), max(capacity, len(floats), 1)),
+                               dtype=self.dtype, order="F")
+        self.names = []
+        self.position = {}
+        # columnas que no son flotantes (fechas, calendario), con su posición
+        # en el dataframe original
+        self.extra = {col: (i, df[col]) for i, col in enumerate(df.columns)
+                      if col not in floats}
+        self.add(floats, df[floats].to_numpy(dtype=self.dtype))
+
+    def __len__(self):
+        return self.buffer.shape[0]
+
+    @property
+    def columns(self):
+        columns = list(self.names)
+        for col, (i, _) in sorted(self.extra.items(), key=lambda x: x[1][0]):
+            columns.insert(i, col)
+        return columns
+
+    @property
+    def shape(self):
+        return (len(self), len(self.names) + len(self.extra))
+
+    def allocate(self, names):
+        """
+        Reserva columnas contiguas del buffer para los nombres dados, si un
+        nombre ya existe se reemplaza.
+
+        Parameters
+        ----------
+        names : list
+            Nombres de las columnas nuevas.
+
+        Returns
+        -------
+        block : numpy.array
+            Vista de (filas, len(names)) del buffer para escribir.
+
+        """
+        names = list(names)
+        existing = [self.position[name] for name in names
+                    if name in self.position]
+        if len(existing) == len(names) and len(names) > 0 and \
+                existing == list(range(existing[0],
+                                       existing[0] + len(names))):
+            return self.buffer[:, existing[0]:existing[0] + len(names)]
+        if existing:
+            self.drop(names)
+        start = len(self.names)
+        needed = start + len(names)
+        if needed > self.buffer.shape[1]:
+            capacity = max(needed, 2 * self.buffer.shape[1])
+            buffer = np.empty((len(self), capacity), dtype=self.dtype,
+                              order="F")
+            buffer[:, :start] = self.buffer[:, :start]
+            self.buffer = buffer
+        for j, name in enumerate(names):
+            self.position[name] = start + j
+        self.names = self.names + names
+        return self.buffer[:, start:needed]
+
+    def add(self, names, block):
+        """
+        Escribe un bloque de features en el buffer.
+
+        Parameters
+        ----------
+        names : list
+            Nombres de las columnas del bloque.
+        block : numpy.array
+            Arreglo de (filas, len(names)).
+
+        Returns
+        -------
+        None.
+
+        """
+        self.allocate(names)[:] = block
+
+    def drop(self, names):
+        """
+        Saca columnas del contenedor, compactando el buffer.
+
+        Parameters
+        ----------
+        names : list
+            Nombres de las columnas a sacar.
+
+        Returns
+        -------
+        None.
+
+        """
+        names = set(names)
+        for name in names:
+            self.extra.pop(name, None)
+        keep = [name for name in self.names if name not in names]
+        if len(keep) == len(self.names):
+            return
+        self.buffer[:, :len(keep)] = self.buffer[
+            :, [self.position[name] for name in keep]]
+        self.names = keep
+        self.position = {name: j for j, name in enumerate(keep)}
+
+    def values(self, names):
+        """
+        Valores de columnas del contenedor en el tipo del buffer, es una
+        vista si son columnas flotantes contiguas y en orden en el buffer.
+
+        Parameters
+        ----------
+        names : list
+            Nombres de las columnas.
+
+        Returns
+        -------
+        values : numpy.array
+            Arreglo de (filas, len(names)).
+
+        """
+        if not all(name in self.position for name in names):
+            return np.column_stack(
+                [self[name].to_numpy(dtype=self.dtype) for name in names])
+        positions = [self.position[name] for name in names]
+        if positions and positions == list(range(positions[0],
+                                                 positions[0] + len(names))):
+            return self.buffer[:, positions[0]:positions[0] + len(names)]
+        return self.buffer[:, positions]
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key in self.extra:
+                return self.extra[key][1]
+            return pd.Series(self.buffer[:, self.position[key]],
+                             index=self.index, name=key, copy=False)
+        key = list(key)
+        if all(name in self.position for name in key):
+            return pd.DataFrame(self.values(key), index=self.index,
+                                columns=key, copy=False)
+        return pd.DataFrame({name: self[name] for name in key},
+                            index=self.index)
+
+    def to_numpy(self):
+        """
+        Buffer con todas las columnas flotantes, sin copiar.
+
+        Returns
+        -------
+        values : numpy.array
+            Arreglo de (filas, columnas flotantes), en el orden de names.
+
+        """
+        return self.buffer[:, :len(self.names)]
+
+    def to_frame(self):
+        """
+        Convierte el contenedor a dataframe: las columnas flotantes quedan
+        como un solo bloque que comparte memoria con el buffer y las demás
+        columnas vuelven a su posición original.
+
+        Returns
+        -------
+        df : pandas.dataframe
+            Dataframe con todas las columnas.
+
+        """
+        df = pd.DataFrame(self.to_numpy(), index=self.index,
+                          columns=self.names, copy=False)
+        for col, (i, series) in sorted(self.extra.items(),
+                                       key=lambda x: x[1][0]):
+            df.insert(min(i, df.shape[1]), col, series)
+        return df
@@ -0,0 +1,258 @@
+import re
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from src.preprocessing.feature_engineering import lag_matrix, rolling_moments
+
+# nodo del grafo de features: transform es "column", "lag", "log" o una
+# estadística móvil ("mean", "std", "kurt", "skew"), source es el nodo del
+# que depende (None para las columnas base) y param el lag o la ventana
+Feature = namedtuple("Feature", ["name", "transform", "source", "param"])
+
+ROLLING_STATS = ("mean", "std", "kurt", "skew")
+
+
+def column(name):
+    """
+    Nodo de una columna base del dataframe.
+
+    Parameters
+    ----------
+    name : string
+        Nombre de la columna.
+
+    Returns
+    -------
+    feature : Feature
+        Nodo de la columna.
+
+    """
+    return Feature(name, "column", None, None)
+
+
+def _node(source):
+    # permite pasar nombres de columnas o nodos como fuente
+    if isinstance(source, Feature):
+        return source
+    return column(source)
+
+
+def lag(source, n):
+    """
+    Nodo del lag n de una columna o feature, con nombre "{source}_lagged_n".
+
+    Parameters
+    ----------
+    source : string or Feature
+        Columna o feature de origen.
+    n : int
+        Lag.
+
+    Returns
+    -------
+    feature : Feature
+        Nodo del lag.
+
+    """
+    source = _node(source)
+    return Feature(source.name + f"_lagged_{n}", "lag", source, n)
+
+
+def rolling(source, stat, window):
+    """
+    Nodo de una estadística móvil de una columna o feature, con nombre
+    "{source}_{stat}_{window}".
+
+    Parameters
+    ----------
+    source : string or Feature
+        Columna o feature de origen.
+    stat : string
+        "mean", "std", "kurt" o "skew".
+    window : int
+        Tamaño de la ventana.
+
+    Returns
+    -------
+    feature : Feature
+        Nodo de la estadística.
+
+    """
+    if stat not in ROLLING_STATS:
+        raise ValueError(f"Estadística no soportada: {stat}")
+    source = _node(source)
+    return Feature(source.name + f"_{stat}_{window}", stat, source, window)
+
+
+def rolling_mean(source, window):
+    return rolling(source, "mean", window)
+
+
+def rolling_std(source, window):
+    return rolling(source, "std", window)
+
+
+def rolling_kurt(source, window):
+    return rolling(source, "kurt", window)
+
+
+def rolling_skew(source, window):
+    return rolling(source, "skew", window)
+
+
+def log(source):
+    """
+    Nodo del logaritmo (np.log(x) + 1, igual que log_features) de una
+    columna o feature, con nombre "log_{source}".
+
+    Parameters
+    ----------
+    source : string or Feature
+        Columna o feature de origen.
+
+    Returns
+    -------
+    feature : Feature
+        Nodo del logaritmo.
+
+    """
+    source = _node(source)
+    return Feature("log_" + source.name, "log", source, None)
+
+
+def parse_feature(name, base_columns):
+    """
+    Convierte el nombre de un feature, con los nombres que usa el script de
+    feature engineering (ej: "La_Araucania_lagged_12", "Los_Rios_mean_3",
+    "log_PIB"), en su nodo del grafo.
+
+    Parameters
+    ----------
+    name : string
+        Nombre del feature.
+    base_columns : list
+        Columnas base del dataframe.
+
+    Returns
+    -------
+    feature : Feature
+        Nodo del feature.
+
+    """
+    if name in base_columns:
+        return column(name)
+    match = re.match(r"^(.+)_lagged_(\d+)$", name)
+    if match:
+        return lag(parse_feature(match.group(1), base_columns),
+                   int(match.group(2)))
+    match = re.match(r"^(.+)_(mean|std|kurt|skew)_(\d+)$", name)
+    if match:
+        return rolling(parse_feature(match.group(1), base_columns),
+                       match.group(2), int(match.group(3)))
+    match = re.match(r"^log_(.+)$", name)
+    if match:
+        return log(parse_feature(match.group(1), base_columns))
+    raise ValueError(f"No se reconoce el feature: {name}")
+
+
+def feature_dependencies(features):
+    """
+    Columnas base de las que dependen los features pedidos.
+
+    Parameters
+    ----------
+    features : list
+        Lista de nodos.
+
+    Returns
+    -------
+    columns : list
+        Columnas base, sin repetir.
+
+    """
+    columns = []
+    for feature in features:
+        while feature.source is not None:
+            feature = feature.source
+        if feature.name not in columns:
+            columns.append(feature.name)
+    return columns
+
+
+def evaluate_feature(df, feature, cache):
+    """
+    Evalua un nodo del grafo sobre el dataframe ordenado por fecha, primero
+    sus dependencias, guardando cada resultado en cache para no calcular dos
+    veces un nodo compartido.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Dataframe ordenado por fecha.
+    feature : Feature
+        Nodo a evaluar.
+    cache : dict
+        Resultados ya calculados, por nombre del nodo.
+
+    Returns
+    -------
+    values : numpy.array
+        Valores del feature.
+
+    """
+    if feature.name in cache:
+        return cache[feature.name]
+    if feature.transform == "column":
+        values = df[feature.name].to_numpy(dtype=np.float64)
+    else:
+        source = evaluate_feature(df, feature.source, cache)
+        if feature.transform == "lag":
+            values = lag_matrix(source[:, None], [feature.param])[:, 0]
+        elif feature.transform == "log":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                values = np.log(source) + 1
+        else:
+            specs = [(feature.param, (feature.transform,))]
+            moments = rolling_moments(source[:, None], specs)
+            values = moments[(feature.transform, feature.param)][:, 0]
+    cache[feature.name] = values
+    return values
+
+
+def build_features(df, features, date_column="date"):
+    """
+    Construye solo los features pedidos y sus dependencias, en vez de todos
+    los lags, estadísticas móviles y logaritmos de todas las columnas. Los
+    features se pueden pedir por nombre o como nodos
+    (ej: lag("La_Araucania", 12), rolling_std("La_Araucania", 12)).
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Dataframe con las columnas base.
+    features : list
+        Nombres o nodos de los features a construir.
+    date_column : string, optional
+        Columna de fechas. The default is "date".
+
+    Returns
+    -------
+    output : pandas.dataframe
+        Dataframe con la fecha y los features pedidos, ordenado por fecha.
+
+    """
+    base_columns = list(df.columns)
+    nodes = [feature if isinstance(feature, Feature)
+             else parse_feature(feature, base_columns)
+             for feature in features if feature != date_column]
+    df = df.sort_values(by=[date_column])
+    df.reset_index(drop=True, inplace=True)
+    cache = {}
+    output = {date_column: df[date_column]}
+    for node in nodes:
+        if node.transform == "column":
+            output[node.name] = df[node.name]
+        else:
+            output[node.name] = evaluate_feature(df, node, cache)
+    output = pd.DataFrame(output, index=df.index)
+    return output
@@ -0,0 +1,637 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.metrics.pairwise import nan_euclidean_distances
+from sklearn.neighbors import NearestNeighbors
+
+
+def season_labels(dates, n_rows, period=12):
+    """
+    Estación de cada fila, ordenadas en el tiempo: el mes (0 a 11) si hay
+    fechas y el periodo es 12, si no la posición de la fila módulo el
+    periodo.
+
+    Parameters
+    ----------
+    dates : pandas.series
+        Fechas ordenadas en el tiempo, o None.
+    n_rows : int
+        Cantidad de filas.
+    period : int, optional
+        Periodo estacional. The default is 12.
+
+    Returns
+    -------
+    season : numpy.array
+        Estación de cada fila, de 0 a period - 1.
+
+    """
+    if dates is not None and period == 12 and \
+            pd.api.types.is_datetime64_any_dtype(dates):
+        return dates.dt.month.to_numpy() - 1
+    season = np.arange(n_rows) % period
+    return season
+
+
+def seasonal_means(values, season, period=12):
+    """
+    Promedio de cada columna en cada estación sin contar los nans, si una
+    estación no tiene valores queda el promedio de la columna.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Arreglo de (filas, columnas).
+    season : numpy.array
+        Estación de cada fila.
+    period : int, optional
+        Cantidad de estaciones. The default is 12.
+
+    Returns
+    -------
+    means : numpy.array
+        Arreglo de (period, columnas), nan en las columnas sin valores.
+
+    """
+    valid = ~np.isnan(values)
+    # suma y conteo por estación de todas las columnas con un producto
+    onehot = np.zeros((period, len(values)))
+    onehot[season, np.arange(len(values))] = 1
+    sums = onehot @ np.where(valid, values, 0.0)
+    counts = onehot @ valid
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = sums / counts
+        overall = sums.sum(axis=0) / counts.sum(axis=0)
+    means = np.where(counts > 0, means, overall)
+    return means
+
+
+def interpolate_gaps(values, max_gap=None):
+    """
+    Interpolación lineal de los nans entre el valor anterior y el
+    siguiente de cada columna, todas las columnas a la vez en O(filas) por
+    columna. Los nans del principio y del final (sin vecino a un lado) y
+    los de rachas más largas que max_gap quedan en nan.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Arreglo de (filas, columnas) ordenado en el tiempo.
+    max_gap : int, optional
+        Largo máximo de una racha de nans para interpolarla.
+        The default is None, sin límite.
+
+    Returns
+    -------
+    result : numpy.array
+        Arreglo de (filas, columnas) interpolado.
+
+    """
+    n_rows = len(values)
+    valid = ~np.isnan(values)
+    rows = np.arange(n_rows)[:, None]
+    # posición del valor válido anterior y siguiente de cada fila
+    previous = np.maximum.accumulate(np.where(valid, rows, -1), axis=0)
+    following = np.minimum.accumulate(
+        np.where(valid, rows, n_rows)[::-1], axis=0)[::-1]
+    inside = ~valid & (previous >= 0) & (following < n_rows)
+    if max_gap is not None:
+        inside &= following - previous - 1 <= max_gap
+    start = np.take_along_axis(values, np.clip(previous, 0, n_rows - 1),
+                               axis=0)
+    end = np.take_along_axis(values, np.clip(following, 0, n_rows - 1),
+                             axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weight = (rows - previous) / (following - previous)
+    result = values.copy()
+    result[inside] = (start + (end - start) * weight)[inside]
+    return result
+
+
+def impute_block(values, season, method="seasonal", max_gap=6, period=12,
+                 fallback=True):
+    """
+    Imputa los nans de un bloque de series mensuales ordenadas en el
+    tiempo:
+        - "linear": interpolación lineal entre el valor anterior y el
+          siguiente.
+        - "seasonal": interpolación lineal de la serie sin su promedio
+          estacional, y después se le vuelve a sumar, así el tramo imputado
+          sigue la forma estacional de la serie.
+    Las rachas más largas que max_gap y los nans al principio o al final
+    se llenan con el promedio estacional de la columna si fallback es True.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Arreglo de (filas, columnas) ordenado en el tiempo.
+    season : numpy.array
+        Estación de cada fila, ver season_labels.
+    method : string, optional
+        "linear" o "seasonal". The default is "seasonal".
+    max_gap : int, optional
+        Largo máximo de una racha de nans para interpolarla.
+        The default is 6.
+    period : int, optional
+        Periodo estacional. The default is 12.
+    fallback : bool, optional
+        Llenar lo que no se interpola con el promedio estacional.
+        The default is True.
+
+    Returns
+    -------
+    result : numpy.array
+        Arreglo de (filas, columnas) imputado, solo quedan nans en las
+        columnas sin ningún valor (o sin fallback).
+
+    """
+    if method not in ("linear", "seasonal"):
+        raise ValueError(f"Método de imputación no soportado: {method}")
+    values = np.asarray(values, dtype=np.float64)
+    means = seasonal_means(values, season, period)
+    if method == "seasonal":
+        profile = means[season]
+        result = interpolate_gaps(values - profile, max_gap) + profile
+        # los valores observados quedan tal cual, sin el error de redondeo
+        # de restar y sumar el promedio
+        result[~np.isnan(values)] = values[~np.isnan(values)]
+    else:
+        result = interpolate_gaps(values, max_gap)
+    if fallback:
+        missing = np.isnan(result)
+        result[missing] = means[season][missing]
+    return result
+
+
+def impute_time_series(df, columns=None, method="seasonal", max_gap=6,
+                       period=12, fallback=True, date_column="date"):
+    """
+    Imputador temporal para series mensuales, reemplaza a KNNImputer: en vez
+    de distancias entre todas las filas, cada columna se interpola en el
+    tiempo con impute_block, en O(filas) por columna y todas las columnas
+    en un solo bloque. Las filas se ordenan por fecha para imputar y se
+    devuelven en el orden original.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Dataframe con una fila por mes.
+    columns : list, optional
+        Columnas a imputar. The default is None, todas las columnas
+        numéricas menos la fecha.
+    method : string, optional
+        "linear" o "seasonal", ver impute_block. The default is "seasonal".
+    max_gap : int, optional
+        Largo máximo de una racha de nans para interpolarla, las más largas
+        se llenan con el promedio estacional. The default is 6.
+    period : int, optional
+        Periodo estacional. The default is 12.
+    fallback : bool, optional
+        Llenar lo que no se interpola con el promedio estacional.
+        The default is True.
+    date_column : string, optional
+        Columna de fechas. The default is "date".
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Copia del dataframe con las columnas imputadas.
+
+    """
+    if columns is None:
+        columns = [col for col in df.columns if col != date_column and
+                   pd.api.types.is_numeric_dtype(df[col])]
+    columns = list(columns)
+    if date_column in df.columns:
+        order = np.argsort(df[date_column].to_numpy(), kind="stable")
+        dates = df[date_column].iloc[order]
+    else:
+        order = np.arange(len(df))
+        dates = None
+    values = df[columns].to_numpy(dtype=np.float64)[order]
+    season = season_labels(dates, len(df), period)
+    imputed = impute_block(values, season, method=method, max_gap=max_gap,
+                           period=period, fallback=fallback)
+    result = np.empty_like(imputed)
+    result[order] = imputed
+    df = df.copy()
+    df[columns] = result
+    return df
+
+
+# arreglos de knn_impute_block compartidos con los procesos, se cargan una
+# vez por proceso con knn_init en vez de enviarlos con cada bloque
+KNN_DATA = {}
+
+
+def knn_block_sizes(n_receivers, n_reference, max_memory):
+    """
+    Tamaño de los bloques de filas a imputar y de filas candidatas para que
+    las distancias de un bloque contra otro quepan en max_memory.
+
+    Parameters
+    ----------
+    n_receivers : int
+        Filas a imputar.
+    n_reference : int
+        Filas candidatas a vecino.
+    max_memory : int
+        Memoria máxima en bytes para las distancias de un par de bloques.
+
+    Returns
+    -------
+    row_block : int
+        Filas a imputar por bloque.
+    candidate_block : int
+        Filas candidatas por bloque.
+
+    """
+    # nan_euclidean_distances y la mezcla con los mejores vecinos usan
+    # cerca de 6 arreglos del tamaño del bloque de distancias
+    pairs = max(1, max_memory // 48)
+    side = max(1, int(np.sqrt(pairs)))
+    candidate_block = min(n_reference,
+                          max(side, pairs // max(1, min(n_receivers, side))))
+    row_block = min(n_receivers, max(1, pairs // candidate_block))
+    return row_block, candidate_block
+
+
+def merge_neighbors(best_dist, best_value, dist, value, n_neighbors):
+    """
+    Mezcla los mejores vecinos que se llevan con un bloque de candidatos
+    nuevos y deja los n_neighbors más cercanos de cada fila.
+
+    Parameters
+    ----------
+    best_dist : numpy.array
+        Distancias de los mejores vecinos, de (filas, n_neighbors).
+    best_value : numpy.array
+        Valores de los mejores vecinos, de (filas, n_neighbors).
+    dist : numpy.array
+        Distancias a los candidatos nuevos, de (filas, candidatos), inf
+        donde no hay distancia.
+    value : numpy.array
+        Valores de los candidatos nuevos, de (filas, candidatos).
+    n_neighbors : int
+        Cantidad de vecinos.
+
+    Returns
+    -------
+    best_dist : numpy.array
+        Distancias de los mejores vecinos actualizadas.
+    best_value : numpy.array
+        Valores de los mejores vecinos actualizados.
+
+    """
+    dist = np.concatenate([best_dist, dist], axis=1)
+    value = np.concatenate([best_value, value], axis=1)
+    nearest = np.argpartition(dist, n_neighbors - 1, axis=1)[:, :n_neighbors]
+    best_dist = np.take_along_axis(dist, nearest, axis=1)
+    best_value = np.take_along_axis(value, nearest, axis=1)
+    return best_dist, best_value
+
+
+def neighbor_average(best_dist, best_value, weights, fill):
+    """
+    Promedio de los valores de los vecinos igual que KNNImputer: los
+    vecinos sin distancia (inf) no cuentan, con pesos "distance" se pondera
+    por 1 / distancia y si hay vecinos a distancia 0 solo cuentan esos.
+
+    Parameters
+    ----------
+    best_dist : numpy.array
+        Distancias de los vecinos, de (filas, n_neighbors).
+    best_value : numpy.array
+        Valores de los vecinos, de (filas, n_neighbors).
+    weights : string
+        "uniform" o "distance".
+    fill : float
+        Valor de las filas sin ningún vecino con distancia, el promedio de
+        la columna.
+
+    Returns
+    -------
+    values : numpy.array
+        Valor imputado de cada fila.
+
+    """
+    if weights == "distance":
+        with np.errstate(divide="ignore"):
+            weight = 1 / best_dist
+        exact = np.isinf(weight)
+        exact_rows = exact.any(axis=1)
+        weight[exact_rows] = exact[exact_rows]
+    else:
+        weight = np.isfinite(best_dist).astype(np.float64)
+    total = weight.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = np.einsum("ij,ij->i", weight,
+                           np.where(weight > 0, best_value, 0.0)) / total
+    values[total == 0] = fill
+    return values
+
+
+def knn_impute_rows(x, reference, fill, n_neighbors, weights,
+                    candidate_block, index=None, complete=None):
+    """
+    Imputa un bloque de filas con sus vecinos más cercanos en reference,
+    recorriendo los candidatos por bloques y llevando los n_neighbors
+    mejores de cada fila y columna, así nunca se arma la matriz de
+    distancias completa. Con index los candidatos de cada fila son solo sus
+    vecinos en las columnas completas.
+
+    Parameters
+    ----------
+    x : numpy.array
+        Filas a imputar, de (filas, columnas).
+    reference : numpy.array
+        Filas candidatas a vecino, de (candidatos, columnas).
+    fill : numpy.array
+        Promedio de cada columna en reference.
+    n_neighbors : int
+        Cantidad de vecinos.
+    weights : string
+        "uniform" o "distance".
+    candidate_block : int
+        Filas candidatas por bloque.
+    index : sklearn.neighbors.NearestNeighbors, optional
+        Índice sobre las columnas completas. The default is None, búsqueda
+        exacta.
+    complete : numpy.array, optional
+        Máscara de las columnas completas del índice. The default is None.
+
+    Returns
+    -------
+    x : numpy.array
+        Filas imputadas.
+
+    """
+    missing = np.isnan(x)
+    cols = np.flatnonzero(missing.any(axis=0))
+    best_dist = np.full((len(cols), len(x), n_neighbors), np.inf)
+    best_value = np.zeros((len(cols), len(x), n_neighbors))
+    if index is None:
+        blocks = range(0, len(reference), candidate_block)
+    else:
+        # candidatos de cada fila según el índice y su distancia exacta
+        neighbors = index.kneighbors(x[:, complete], return_distance=False)
+        candidates = reference[neighbors]
+        present = ~np.isnan(x[:, None, :]) & ~np.isnan(candidates)
+        difference = np.where(present, x[:, None, :] - candidates, 0.0)
+        count = present.sum(axis=2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dist = np.sqrt(np.einsum("ijk,ijk->ij", difference, difference) *
+                           x.shape[1] / count)
+        dist[count == 0] = np.inf
+        blocks = [None]
+    for start in blocks:
+        if index is None:
+            candidates = reference[start:start + candidate_block]
+            dist = nan_euclidean_distances(x, candidates)
+            dist[np.isnan(dist)] = np.inf
+        for i, j in enumerate(cols):
+            rows = np.flatnonzero(missing[:, j])
+            if index is None:
+                donors = ~np.isnan(candidates[:, j])
+                block_dist = dist[np.ix_(rows, np.flatnonzero(donors))]
+                block_value = np.broadcast_to(candidates[donors, j],
+                                              block_dist.shape)
+            else:
+                value = candidates[rows, :, j]
+                block_dist = np.where(np.isnan(value), np.inf, dist[rows])
+                block_value = np.nan_to_num(value)
+            best_dist[i, rows], best_value[i, rows] = merge_neighbors(
+                best_dist[i, rows], best_value[i, rows], block_dist,
+                block_value, n_neighbors)
+    x = x.copy()
+    for i, j in enumerate(cols):
+        rows = np.flatnonzero(missing[:, j])
+        x[rows, j] = neighbor_average(best_dist[i, rows], best_value[i, rows],
+                                      weights, fill[j])
+    return x
+
+
+def knn_index(reference, complete, n_candidates):
+    """
+    Índice de vecinos sobre las columnas completas de reference, para
+    buscar candidatos sin calcular todas las distancias.
+
+    Parameters
+    ----------
+    reference : numpy.array
+        Filas candidatas a vecino, de (candidatos, columnas).
+    complete : numpy.array
+        Máscara de las columnas sin nans.
+    n_candidates : int
+        Candidatos por fila.
+
+    Returns
+    -------
+    index : sklearn.neighbors.NearestNeighbors
+        Índice ajustado.
+
+    """
+    index = NearestNeighbors(n_neighbors=min(n_candidates, len(reference)))
+    index.fit(reference[:, complete])
+    return index
+
+
+def knn_init(values, reference, fill, params, complete, n_candidates):
+    """
+    Carga los datos de knn_impute_block en un proceso y arma el índice.
+
+    Returns
+    -------
+    None.
+
+    """
+    KNN_DATA["values"] = values
+    KNN_DATA["reference"] = reference
+    KNN_DATA["fill"] = fill
+    KNN_DATA["params"] = params
+    KNN_DATA["complete"] = complete
+    KNN_DATA["index"] = knn_index(reference, complete, n_candidates) \
+        if complete is not None else None
+
+
+def knn_task(rows):
+    """
+    Imputa un bloque de filas con los datos cargados por knn_init.
+
+    Parameters
+    ----------
+    rows : numpy.array
+        Posiciones de las filas a imputar.
+
+    Returns
+    -------
+    x : numpy.array
+        Filas imputadas.
+
+    """
+    return knn_impute_rows(KNN_DATA["values"][rows], KNN_DATA["reference"],
+                           KNN_DATA["fill"], *KNN_DATA["params"],
+                           index=KNN_DATA["index"],
+                           complete=KNN_DATA["complete"])
+
+
+def knn_impute_block(values, reference=None, n_neighbors=5,
+                     weights="uniform", max_memory=2 ** 28,
+                     approximate=False, n_candidates=None, n_jobs=1):
+    """
+    Imputación KNN por bloques con memoria acotada, igual que KNNImputer
+    con metric="nan_euclidean" (salvo empates entre vecinos a la misma
+    distancia): las filas con nans se recorren por bloques y cada bloque se
+    compara con bloques de filas candidatas, llevando los n_neighbors más
+    cercanos de cada fila y columna. Así la memoria queda acotada por
+    max_memory en vez de crecer con filas * filas. A diferencia de
+    KNNImputer, las columnas sin ningún valor quedan en nan en vez de
+    sacarse.
+
+    Con approximate los candidatos de cada fila son solo sus n_candidates
+    vecinos más cercanos en las columnas sin nans (un árbol de
+    sklearn.neighbors), y entre ellos se eligen los n_neighbors con la
+    distancia nan_euclidean completa. Es mucho más rápido con muchas filas,
+    pero los vecinos pueden no ser exactamente los mismos.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Arreglo de (filas, columnas) con nans.
+    reference : numpy.array, optional
+        Filas candidatas a vecino, como el arreglo de fit de KNNImputer.
+        The default is None, las mismas filas de values.
+    n_neighbors : int, optional
+        Cantidad de vecinos. The default is 5.
+    weights : string, optional
+        "uniform" o "distance". The default is "uniform".
+    max_memory : int, optional
+        Memoria máxima en bytes de las distancias de un bloque, por proceso.
+        The default is 2 ** 28.
+    approximate : bool, optional
+        Buscar candidatos con el índice de las columnas completas.
+        The default is False.
+    n_candidates : int, optional
+        Candidatos por fila con approximate. The default is None,
+        10 * n_neighbors.
+    n_jobs : int, optional
+        Cantidad de procesos, cada uno imputa bloques de filas.
+        The default is 1.
+
+    Returns
+    -------
+    result : numpy.array
+        Arreglo de (filas, columnas) imputado.
+
+    """
+    if weights not in ("uniform", "distance"):
+        raise ValueError(f"Pesos no soportados: {weights}")
+    values = np.asarray(values, dtype=np.float64)
+    reference = values if reference is None else \
+        np.asarray(reference, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        fill = np.nanmean(reference, axis=0) if len(reference) else \
+            np.full(values.shape[1], np.nan)
+    receivers = np.flatnonzero(np.isnan(values[:, ~np.isnan(fill)])
+                               .any(axis=1))
+    result = values.copy()
+    if not len(receivers):
+        return result
+    complete = None
+    if approximate:
+        complete = ~np.isnan(reference).any(axis=0) & \
+            ~np.isnan(values).any(axis=0)
+        if not complete.any():
+            print("No hay columnas completas para el índice, se usa la "
+                  "búsqueda exacta")
+            complete = None
+    if n_candidates is None:
+        n_candidates = 10 * n_neighbors
+    row_block, candidate_block = knn_block_sizes(len(receivers),
+                                                 len(reference), max_memory)
+    if complete is not None:
+        row_block = min(len(receivers), max(
+            1, max_memory // (48 * n_candidates * values.shape[1])))
+    params = (n_neighbors, weights, candidate_block)
+    blocks = [receivers[i:i + row_block]
+              for i in range(0, len(receivers), row_block)]
+    if n_jobs == 1:
+        knn_init(values, reference, fill, params, complete, n_candidates)
+        try:
+            imputed = [knn_task(rows) for rows in blocks]
+        finally:
+            KNN_DATA.clear()
+    else:
+        initargs = (values, reference, fill, params, complete, n_candidates)
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=knn_init,
+                                 initargs=initargs) as executor:
+            imputed = list(executor.map(knn_task, blocks))
+    for rows, block in zip(blocks, imputed):
+        result[rows] = block
+    # las columnas sin ningún valor en reference quedan en nan
+    result[:, np.isnan(fill)] = values[:, np.isnan(fill)]
+    return result
+
+
+def impute_knn(df, columns=None, n_neighbors=5, weights="uniform",
+               scale=True, max_memory=2 ** 28, approximate=False,
+               n_candidates=None, n_jobs=1, date_column="date"):
+    """
+    Imputación KNN de columnas de un dataframe con knn_impute_block, como
+    MinMaxScaler + KNNImputer + inverse_transform pero con memoria acotada
+    y en paralelo.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Dataframe con nans.
+    columns : list, optional
+        Columnas a imputar, son también las que definen la distancia.
+        The default is None, todas las columnas numéricas menos la fecha.
+    n_neighbors : int, optional
+        Cantidad de vecinos. The default is 5.
+    weights : string, optional
+        "uniform" o "distance". The default is "uniform".
+    scale : bool, optional
+        Escalar cada columna a [0, 1] antes de calcular distancias.
+        The default is True.
+    max_memory : int, optional
+        Memoria máxima en bytes de las distancias de un bloque, por proceso.
+        The default is 2 ** 28.
+    approximate : bool, optional
+        Buscar candidatos con el índice de las columnas completas, ver
+        knn_impute_block. The default is False.
+    n_candidates : int, optional
+        Candidatos por fila con approximate. The default is None.
+    n_jobs : int, optional
+        Cantidad de procesos. The default is 1.
+    date_column : string, optional
+        Columna de fechas. The default is "date".
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Copia del dataframe con las columnas imputadas.
+
+    """
+    if columns is None:
+        columns = [col for col in df.columns if col != date_column and
+                   pd.api.types.is_numeric_dtype(df[col])]
+    columns = list(columns)
+    values = df[columns].to_numpy(dtype=np.float64)
+    if scale:
+        with np.errstate(invalid="ignore"):
+            low = np.nanmin(values, axis=0)
+            span = np.nanmax(values, axis=0) - low
+        # igual que MinMaxScaler, las columnas constantes no se escalan
+        span = np.where(span > 0, span, 1.0)
+        values = (values - low) / span
+    result = knn_impute_block(values, n_neighbors=n_neighbors,
+                              weights=weights, max_memory=max_memory,
+                              approximate=approximate,
+                              n_candidates=n_candidates, n_jobs=n_jobs)
+    if scale:
+        result = result * span + low
+    df = df.copy()
+    df[columns] = result
+    return df
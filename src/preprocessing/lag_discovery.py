@@ -0,0 +1,193 @@
+import warnings
+import numpy as np
+import pandas as pd
+
+
+def fft_cross_sums(a, b, max_lag, nfft):
+    """
+    Sumas cruzadas sum_t a(t) * b(t - lag) para lag = 0..max_lag, de todas
+    las columnas de una vez, a partir de las FFT de a y b.
+
+    Parameters
+    ----------
+    a : numpy.array
+        FFT (rfft) de largo nfft de un arreglo de (filas,).
+    b : numpy.array
+        FFT (rfft) de largo nfft de un arreglo de (filas, columnas).
+    max_lag : int
+        Lag máximo.
+    nfft : int
+        Largo de la FFT, al menos filas + max_lag para no mezclar extremos.
+
+    Returns
+    -------
+    sums : numpy.array
+        Arreglo de (max_lag + 1, columnas).
+
+    """
+    sums = np.fft.irfft(a[:, None] * np.conj(b), n=nfft, axis=0)
+    return sums[:max_lag + 1]
+
+
+def fast_length(n):
+    """
+    Largo >= n de la forma 2^a * 3^b * 5^c, donde la FFT es rápida.
+
+    Parameters
+    ----------
+    n : int
+        Largo mínimo.
+
+    Returns
+    -------
+    length : int
+        Largo de la FFT.
+
+    """
+    length = 1 << int(np.ceil(np.log2(max(n, 1))))
+    for p5 in (1, 5, 25, 125):
+        for p3 in (1, 3, 9, 27, 81):
+            base = p5 * p3
+            if base > length:
+                break
+            p2 = 1 << int(np.ceil(np.log2(max(n / base, 1))))
+            length = min(length, base * p2)
+    return length
+
+
+def cross_correlation(target, drivers, max_lag=24, min_periods=24):
+    """
+    Correlación de pearson entre el target y cada driver desplazado
+    lag = 0..max_lag filas hacia atrás, corr(target(t), driver(t - lag)),
+    para todas las columnas de una vez con FFT, O(n log n) por par. Los
+    nans se tratan como pandas: cada lag usa solo los pares con los dos
+    valores presentes.
+
+    Parameters
+    ----------
+    target : numpy.array
+        Target ordenado en el tiempo, de (filas,).
+    drivers : numpy.array
+        Drivers ordenados en el tiempo, de (filas, columnas).
+    max_lag : int, optional
+        Lag máximo. The default is 24.
+    min_periods : int, optional
+        Mínimo de pares para calcular la correlación de un lag.
+        The default is 24.
+
+    Returns
+    -------
+    correlations : numpy.array
+        Arreglo de (max_lag + 1, columnas), con nan donde no hay pares
+        suficientes o el driver es constante.
+    pairs : numpy.array
+        Cantidad de pares de cada lag, de (max_lag + 1, columnas).
+
+    """
+    target = np.asarray(target, dtype=np.float64)
+    drivers = np.asarray(drivers, dtype=np.float64)
+    n_rows = len(target)
+    nfft = fast_length(n_rows + max_lag + 1)
+    # centrar para no perder precisión, la correlación no cambia
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        y = target - np.nanmean(target)
+        x = drivers - np.nan_to_num(np.nanmean(drivers, axis=0))
+    y_valid = (~np.isnan(y)).astype(np.float64)
+    x_valid = (~np.isnan(x)).astype(np.float64)
+    y = np.nan_to_num(y)
+    x = np.nan_to_num(x)
+    # cada serie pasa una sola vez por la FFT
+    fft_y_valid, fft_y, fft_yy = [np.fft.rfft(values, n=nfft)
+                                  for values in (y_valid, y, y * y)]
+    fft_x_valid, fft_x, fft_xx = [np.fft.rfft(values, n=nfft, axis=0)
+                                  for values in (x_valid, x, x * x)]
+    pairs = fft_cross_sums(fft_y_valid, fft_x_valid, max_lag, nfft)
+    sum_x = fft_cross_sums(fft_y_valid, fft_x, max_lag, nfft)
+    sum_y = fft_cross_sums(fft_y, fft_x_valid, max_lag, nfft)
+    sum_xy = fft_cross_sums(fft_y, fft_x, max_lag, nfft)
+    sum_xx = fft_cross_sums(fft_y_valid, fft_xx, max_lag, nfft)
+    sum_yy = fft_cross_sums(fft_yy, fft_x_valid, max_lag, nfft)
+    pairs = np.round(pairs)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = pairs * sum_xy - sum_x * sum_y
+        var_x = pairs * sum_xx - sum_x * sum_x
+        var_y = pairs * sum_yy - sum_y * sum_y
+        correlations = covariance / np.sqrt(var_x * var_y)
+    scale = np.maximum(pairs * sum_xx, 1e-300)
+    constant = (var_x <= 1e-12 * scale) | \
+        (var_y <= 1e-12 * np.maximum(pairs * sum_yy, 1e-300))
+    correlations[(pairs < max(min_periods, 2)) | constant] = np.nan
+    correlations = np.clip(correlations, -1, 1)
+    return correlations, pairs.astype(np.int64)
+
+
+def discover_lags(df, target="precio_leche", columns=None, max_lag=24, k=3,
+                  min_lag=1, min_periods=24, date_column="date"):
+    """
+    Busca los lags más informativos de cada driver con respecto al target,
+    los k lags con mayor correlación absoluta entre min_lag y max_lag, para
+    construir solo esos lags en vez de 1, 4, 12 y 24 para todas las
+    columnas.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Dataframe con el target y los drivers.
+    target : string, optional
+        Columna target. The default is "precio_leche".
+    columns : list, optional
+        Drivers candidatos. The default is None, todas las columnas
+        numéricas menos el target.
+    max_lag : int, optional
+        Lag máximo. The default is 24.
+    k : int, optional
+        Cantidad de lags por driver. The default is 3.
+    min_lag : int, optional
+        Lag mínimo, con 1 solo se buscan lags que sirven para pronosticar.
+        The default is 1.
+    min_periods : int, optional
+        Mínimo de pares para calcular la correlación de un lag.
+        The default is 24.
+    date_column : string, optional
+        Columna de fechas. The default is "date".
+
+    Returns
+    -------
+    results : pandas.dataframe
+        Una fila por (columna, lag) seleccionado, con la correlación y la
+        cantidad de pares, ordenado por columna y correlación absoluta.
+    lags : dict
+        Lags seleccionados de cada columna, para add_column_lags.
+
+    """
+    df = df.sort_values(by=[date_column])
+    if columns is None:
+        columns = [col for col in df.columns if col not in
+                   (target, date_column) and
+                   pd.api.types.is_numeric_dtype(df[col])]
+    correlations, pairs = cross_correlation(
+        df[target].to_numpy(dtype=np.float64),
+        df[columns].to_numpy(dtype=np.float64),
+        max_lag=max_lag, min_periods=min_periods)
+    candidates = np.abs(correlations[min_lag:])
+    candidates = np.where(np.isnan(candidates), -1, candidates)
+    k = min(k, len(candidates))
+    # los k lags con mayor correlación absoluta de cada columna
+    order = np.argsort(-candidates, axis=0, kind="stable")[:k]
+    selected = order + min_lag
+    cols = np.broadcast_to(np.arange(len(columns)), selected.shape)
+    keep = np.take_along_axis(candidates, order, axis=0) >= 0
+    results = pd.DataFrame({
+        "columna": np.asarray(columns, dtype=object)[cols[keep]],
+        "lag": selected[keep],
+        "correlacion": correlations[selected[keep], cols[keep]],
+        "pares": pairs[selected[keep], cols[keep]]})
+    results["abs_correlacion"] = results["correlacion"].abs()
+    results.sort_values(by=["columna", "abs_correlacion"],
+                        ascending=[True, False], inplace=True)
+    results.drop(columns=["abs_correlacion"], inplace=True)
+    results.reset_index(drop=True, inplace=True)
+    lags = {col: sorted(group["lag"].tolist())
+            for col, group in results.groupby("columna", sort=False)}
+    return results, lags
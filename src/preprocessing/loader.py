@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+from src.preprocessing.cleaner import valid_periods
+
+
+def load_banco_central(path_csv, dtypes=None, na_values=("a",),
+                       date_column="Periodo", date_format="%Y-%m-%d",
+                       invalid_dates="drop"):
+    """
+    Carga el .csv del banco central dejándolo listo para values_treatement en
+    una sola lectura: cada columna se lee con su tipo, se sacan los
+    espacios de las columnas de texto, los vacios "a" quedan como NaN y las
+    fechas se parsean vectorizadas. Los vacios se identifican después de
+    inferir el tipo, igual que replace_empty_nans, para que una columna con
+    "a" siga siendo de texto. Reemplaza a drop_spaces_data,
+    replace_empty_nans y al parseo con datetime.strptime fila a fila.
+
+    Parameters
+    ----------
+    path_csv : string
+        Path al .csv del banco central.
+    dtypes : dict, optional
+        Tipo de cada columna, por ejemplo {col: str} o {col: float}. Las
+        columnas que no estén se dejan con el tipo que infiere pandas.
+        The default is None.
+    na_values : tuple, optional
+        Valores que se dejan como vacios en las columnas de texto.
+        The default is ("a",).
+    date_column : string, optional
+        Columna de fechas. The default is "Periodo".
+    date_format : string, optional
+        Formato de los primeros 10 caracteres de la fecha.
+        The default is "%Y-%m-%d".
+    invalid_dates : string, optional
+        Que hacer con las fechas inválidas (ej: "2020-13-01"): "drop" las
+        bota informando cuales fueron, "raise" levanta un ValueError y "keep"
+        las deja como NaT. The default is "drop".
+
+    Returns
+    -------
+    df : pandas.dataframe
+        Data banco central lista para la limpieza de valores.
+
+    """
+    if dtypes is None:
+        dtypes = {}
+    dtypes = dict(dtypes)
+    dtypes[date_column] = str
+    df = pd.read_csv(path_csv, dtype=dtypes, skipinitialspace=True)
+    # sacar espacios de las columnas de texto, los vacios que venian con
+    # espacios se identifican después del strip
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].str.strip()
+            df[col] = df[col].mask(df[col].isin(na_values))
+    # fechas
+    dates = valid_periods(df[date_column], date_format=date_format)
+    invalid = dates.isna() & df[date_column].notna()
+    if invalid.any():
+        values = list(df.loc[invalid, date_column])
+        if invalid_dates == "raise":
+            raise ValueError(f"Fechas inválidas en {date_column}: {values}")
+        if invalid_dates == "drop":
+            print("Botando fechas inválidas:", values)
+            df = df[~invalid]
+            dates = dates[~invalid]
+    df[date_column] = dates
+    df.reset_index(drop=True, inplace=True)
+    return df
+
+
+def dtypes_from_stats(stats):
+    """
+    Arma el diccionario de tipos para load_banco_central a partir de las
+    estadísticas por columna de scan_column_stats o del estado de
+    fit_cleaning_state, para no depender de la inferencia de pandas.
+
+    Parameters
+    ----------
+    stats : dict
+        Por columna un diccionario con la llave "numeric".
+
+    Returns
+    -------
+    dtypes : dict
+        Tipo de cada columna.
+
+    """
+    dtypes = {col: np.float64 if values["numeric"] else str
+              for col, values in stats.items()}
+    return dtypes
@@ -0,0 +1,221 @@
+import numpy as np
+import pandas as pd
+
+
+def missingness_index(df, columns=None):
+    """
+    Construye un índice de nans sobre las columnas de un dataframe: cantidad
+    de nans por columna, un bitmap compacto de valores válidos y el largo de
+    las rachas de nans. Se va actualizando con update_missingness_index a
+    medida que se agregan columnas, sin volver a recorrer las que ya estaban.
+    El índice supone que las filas no cambian de orden ni de cantidad y que
+    las columnas ya indexadas no se reemplazan.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Dataframe a indexar.
+    columns : list, optional
+        Columnas a indexar. The default is None, todas las columnas.
+
+    Returns
+    -------
+    index : dict
+        Índice de nans.
+
+    """
+    index = {"n_rows": len(df),
+             "columns": [],
+             "position": {},
+             "dtypes": {},
+             "missing": np.zeros(0, dtype=np.int64),
+             "leading": np.zeros(0, dtype=np.int64),
+             "max_run": np.zeros(0, dtype=np.int64),
+             "bitmap": np.zeros(((len(df) + 7) // 8, 0), dtype=np.uint8),
+             "all_valid": np.ones(len(df), dtype=bool)}
+    if columns is None:
+        columns = list(df.columns)
+    index = update_missingness_index(index, df, columns)
+    return index
+
+
+def update_missingness_index(index, df, columns):
+    """
+    Agrega al índice las columnas que todavía no estan indexadas, solo se
+    recorren los datos de esas columnas. De las columnas ya indexadas solo
+    se revisa el tipo y la cantidad de nans, si cambiaron la columna fue
+    reemplazada y se levanta un ValueError.
+
+    Parameters
+    ----------
+    index : dict
+        Índice de nans de missingness_index.
+    df : pandas.dataframe
+        Dataframe con las columnas nuevas.
+    columns : list
+        Columnas a agregar, las que ya estan indexadas solo se revisan.
+
+    Returns
+    -------
+    index : dict
+        Índice actualizado.
+
+    """
+    if len(df) != index["n_rows"]:
+        raise ValueError("El dataframe no tiene las mismas filas que el "
+                         "índice, hay que reconstruirlo")
+    indexed = [col for col in columns if col in index["position"]]
+    if len(indexed) > 0:
+        frame = df[indexed]
+        missing = frame.isna().sum().to_numpy()
+        positions = [index["position"][col] for col in indexed]
+        changed = [col for col, dtype, n, previous in
+                   zip(indexed, frame.dtypes, missing,
+                       index["missing"][positions])
+                   if dtype.str != index["dtypes"][col] or n != previous]
+        if len(changed) > 0:
+            raise ValueError("Columnas indexadas que cambiaron: "
+                             f"{changed}, hay que reconstruir el índice")
+    columns = [col for col in columns if col not in index["position"]]
+    if len(columns) == 0:
+        return index
+    frame = df[columns]
+    valid = frame.notna().to_numpy()
+    invalid = ~valid
+    # rachas de nans: largo de la racha actual en cada fila
+    counter = np.cumsum(invalid, axis=0)
+    reset = np.maximum.accumulate(np.where(valid, counter, 0), axis=0)
+    runs = counter - reset
+    if len(df) > 0:
+        max_run = runs.max(axis=0)
+        leading = np.where(valid.any(axis=0), valid.argmax(axis=0), len(df))
+    else:
+        max_run = np.zeros(len(columns), dtype=np.int64)
+        leading = np.zeros(len(columns), dtype=np.int64)
+    for i, (col, dtype) in enumerate(zip(columns, frame.dtypes)):
+        index["position"][col] = len(index["columns"]) + i
+        index["dtypes"][col] = dtype.str
+    index["columns"] = index["columns"] + columns
+    index["missing"] = np.concatenate([index["missing"],
+                                       invalid.sum(axis=0)])
+    index["leading"] = np.concatenate([index["leading"], leading])
+    index["max_run"] = np.concatenate([index["max_run"], max_run])
+    index["bitmap"] = np.concatenate(
+        [index["bitmap"], np.packbits(valid, axis=0)], axis=1)
+    index["all_valid"] &= valid.all(axis=1)
+    return index
+
+
+def columns_under_threshold(index, threshold=50, columns=None):
+    """
+    Columnas con porcentaje de nans <= threshold, lo mismo que
+    actual_nans_df pero sin recorrer los datos.
+
+    Parameters
+    ----------
+    index : dict
+        Índice de nans.
+    threshold : float, optional
+        Threshold de nans. The default is 50.
+    columns : list, optional
+        Columnas a consultar, en ese orden. The default is None, todas las
+        columnas del índice.
+
+    Returns
+    -------
+    cols : list
+        Columnas que cumplen con el threshold.
+
+    """
+    if columns is None:
+        columns = index["columns"]
+    positions = [index["position"][col] for col in columns]
+    percentage = index["missing"][positions] / max(index["n_rows"], 1) * 100
+    cols = [col for col, p in zip(columns, percentage) if p <= threshold]
+    return cols
+
+
+def nan_runs(index):
+    """
+    Resumen de nans por columna: cantidad, largo de la racha inicial (filas
+    antes del primer valor válido) y la racha de nans más larga.
+
+    Parameters
+    ----------
+    index : dict
+        Índice de nans.
+
+    Returns
+    -------
+    runs : pandas.dataframe
+        Resumen de nans por columna.
+
+    """
+    runs = pd.DataFrame({"columna": index["columns"],
+                         "missing": index["missing"],
+                         "racha_inicial": index["leading"],
+                         "racha_maxima": index["max_run"]})
+    return runs
+
+
+def column_validity(index, col):
+    """
+    Recupera desde el bitmap la máscara de valores válidos de una columna.
+
+    Parameters
+    ----------
+    index : dict
+        Índice de nans.
+    col : string
+        Nombre de la columna.
+
+    Returns
+    -------
+    valid : numpy.array
+        True en las filas con valor.
+
+    """
+    bits = index["bitmap"][:, index["position"][col]]
+    valid = np.unpackbits(bits, count=index["n_rows"]).astype(bool)
+    return valid
+
+
+def first_valid_row(index):
+    """
+    Primera fila en la que todas las columnas indexadas tienen valor.
+
+    Parameters
+    ----------
+    index : dict
+        Índice de nans.
+
+    Returns
+    -------
+    row : int
+        Posición de la fila, None si no hay ninguna fila completa.
+
+    """
+    if not index["all_valid"].any():
+        return None
+    row = int(index["all_valid"].argmax())
+    return row
+
+
+def valid_rows(index):
+    """
+    Máscara de las filas sin nans en ninguna de las columnas indexadas, es
+    lo que deja un dropna.
+
+    Parameters
+    ----------
+    index : dict
+        Índice de nans.
+
+    Returns
+    -------
+    mask : numpy.array
+        True en las filas completas.
+
+    """
+    mask = index["all_valid"].copy()
+    return mask
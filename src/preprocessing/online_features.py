@@ -0,0 +1,287 @@
+import json
+import numpy as np
+import pandas as pd
+from src.preprocessing.feature_engineering import (
+    MOMENT_ORDER, window_statistic, ewm_alpha, ewm_moments, init_ewm_state,
+    update_ewm_state, ewm_statistics)
+
+
+def init_online_state(df, columns, lags, specs, log_columns=None,
+                      date_column="date", ewm_spans=(), ewm_halflives=(),
+                      ewm_stats=("mean", "std")):
+    """
+    Arma el estado del modo online de features a partir de la historia: un
+    buffer circular por columna con las últimas filas, del tamaño del lag o
+    ventana más grande, para que cada mes nuevo se agregue con push_row sin
+    recalcular los features sobre toda la historia.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Historia con las columnas base.
+    columns : list
+        Columnas a las cuales calcular lags y estadísticas móviles.
+    lags : list
+        Lista de lags, ej: [1, 4, 12, 24].
+    specs : list
+        Lista de tuplas (window, stats), ej: [(3, ("mean", "std"))].
+    log_columns : list, optional
+        Columnas a las cuales calcular log. The default is None, ninguna.
+    date_column : string, optional
+        Columna de fechas. The default is "date".
+    ewm_spans : list, optional
+        Spans de los promedios exponenciales. The default is ().
+    ewm_halflives : list, optional
+        Vidas medias de los promedios exponenciales. The default is ().
+    ewm_stats : tuple, optional
+        Estadísticas exponenciales. The default is ("mean", "std").
+
+    Returns
+    -------
+    state : dict
+        Estado del modo online.
+
+    """
+    lags = [int(lag) for lag in lags]
+    specs = [(int(window), tuple(stats)) for window, stats in specs]
+    size = max([lag + 1 for lag in lags] +
+               [window for window, _ in specs] + [1])
+    state = {"columns": list(columns),
+             "lags": lags,
+             "specs": specs,
+             "log_columns": list(log_columns or []),
+             "date_column": date_column,
+             "size": size,
+             "buffer": np.full((size, len(columns)), np.nan),
+             "position": 0,
+             "count": 0,
+             "last_date": None}
+    # orden estable, las fechas repetidas quedan en el orden en que vienen
+    df = df.sort_values(by=[date_column], kind="mergesort")
+    history = df[columns].to_numpy(dtype=np.float64)[-size:]
+    state["buffer"][:len(history)] = history
+    state["position"] = len(history) % size
+    state["count"] = len(df)
+    if len(df) > 0:
+        state["last_date"] = pd.Timestamp(df[date_column].iloc[-1])
+    # promedios exponenciales, el estado no depende del largo de la historia
+    suffixes = [str(span) for span in ewm_spans] + \
+        [f"hl{halflife}" for halflife in ewm_halflives]
+    if suffixes:
+        alphas = [ewm_alpha(span=span) for span in ewm_spans] + \
+            [ewm_alpha(halflife=halflife) for halflife in ewm_halflives]
+        if len(df) > 0:
+            _, ewm = ewm_moments(df[columns].to_numpy(dtype=np.float64),
+                                 alphas, ())
+        else:
+            ewm = init_ewm_state(len(columns), alphas)
+        state["ewm"] = ewm
+        state["ewm_suffixes"] = suffixes
+        state["ewm_stats"] = list(ewm_stats)
+    return state
+
+
+def window_values(state, window):
+    """
+    Últimos window valores del buffer, del más antiguo al más reciente.
+
+    Parameters
+    ----------
+    state : dict
+        Estado del modo online.
+    window : int
+        Cantidad de filas.
+
+    Returns
+    -------
+    values : numpy.array
+        Arreglo de (window, columnas).
+
+    """
+    rows = (state["position"] - window + np.arange(window)) % state["size"]
+    return state["buffer"][rows]
+
+
+def push_row(state, row):
+    """
+    Agrega una fila nueva al buffer circular y calcula sus features: lags,
+    estadísticas móviles, promedios exponenciales y log, con los mismos
+    nombres y fórmulas que add_lags, add_rolling_moments, add_ewm_features y
+    log_features. El costo depende solo de la cantidad de features, no del
+    largo de la historia. La fecha no puede ser anterior a la última
+    agregada, las fechas repetidas quedan como filas distintas.
+
+    Parameters
+    ----------
+    state : dict
+        Estado del modo online, se actualiza en el lugar.
+    row : dict or pandas.Series
+        Valores de la fila nueva, con la fecha y las columnas del estado.
+
+    Returns
+    -------
+    features : dict
+        Fecha, columnas base y features de la fila nueva.
+
+    """
+    date_column = state["date_column"]
+    date = pd.Timestamp(row[date_column])
+    # las fechas repetidas se aceptan en el orden en que llegan, igual que
+    # el orden estable del modo batch
+    if state["last_date"] is not None and date < state["last_date"]:
+        raise ValueError(f"La fecha {date} es anterior a "
+                         f"{state['last_date']}")
+    columns = state["columns"]
+    values = np.array([row[col] for col in columns], dtype=np.float64)
+    size = state["size"]
+    state["buffer"][state["position"]] = values
+    state["position"] = (state["position"] + 1) % size
+    state["count"] += 1
+    state["last_date"] = date
+
+    features = {date_column: date}
+    for j, col in enumerate(columns):
+        features[col] = values[j]
+    for lag in state["lags"]:
+        if state["count"] > lag:
+            lagged = state["buffer"][(state["position"] - 1 - lag) % size]
+        else:
+            lagged = np.full(len(columns), np.nan)
+        for j, col in enumerate(columns):
+            features[col + f'_lagged_{lag}'] = lagged[j]
+    for window, stats in state["specs"]:
+        result = window_moments(window_values(state, window), stats,
+                                state["count"] >= window)
+        for j, col in enumerate(columns):
+            for stat in stats:
+                features[col + f'_{stat}_{str(window)}'] = result[stat][j]
+    if "ewm" in state:
+        state["ewm"] = update_ewm_state(state["ewm"], values)
+        result = ewm_statistics(state["ewm"], state["ewm_stats"])
+        for k, suffix in enumerate(state["ewm_suffixes"]):
+            for j, col in enumerate(columns):
+                for stat in state["ewm_stats"]:
+                    features[col + f'_ewm_{stat}_{suffix}'] = \
+                        result[stat][k, j]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for col in state["log_columns"]:
+            features['log_' + col] = np.log(np.float64(row[col])) + 1
+    return features
+
+
+def window_moments(window, stats, enough):
+    """
+    Estadísticas de la ventana más reciente de cada columna, con dos pasadas
+    sobre la ventana y las mismas fórmulas que rolling_moments.
+
+    Parameters
+    ----------
+    window : numpy.array
+        Arreglo de (window, columnas) del más antiguo al más reciente.
+    stats : tuple
+        Estadísticas a calcular.
+    enough : bool
+        Si ya hay filas suficientes para llenar la ventana.
+
+    Returns
+    -------
+    result : dict
+        Por cada estadística un arreglo de largo columnas.
+
+    """
+    size = len(window)
+    degree = max(MOMENT_ORDER[stat] for stat in stats)
+    mean = window.mean(axis=0)
+    deviation = window - mean
+    moment = [mean[None, :]]
+    for p in range(2, degree + 1):
+        moment.append((deviation ** p).mean(axis=0)[None, :])
+    nobs = np.full((1, window.shape[1]), float(size))
+    constant = (window == window[-1]).all(axis=0)[None, :]
+    complete = enough & ~np.isnan(window).any(axis=0)
+    result = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for stat in stats:
+            value = window_statistic(stat, moment, nobs, constant)[0]
+            value[~complete] = np.nan
+            result[stat] = value
+    return result
+
+
+def push_rows(state, df):
+    """
+    Agrega varias filas nuevas en orden de fecha con push_row, las fechas
+    repetidas en el orden en que vienen en df.
+
+    Parameters
+    ----------
+    state : dict
+        Estado del modo online, se actualiza en el lugar.
+    df : pandas.dataframe
+        Filas nuevas.
+
+    Returns
+    -------
+    features : pandas.dataframe
+        Features de las filas nuevas.
+
+    """
+    df = df.sort_values(by=[state["date_column"]], kind="mergesort")
+    features = [push_row(state, row) for _, row in df.iterrows()]
+    features = pd.DataFrame(features)
+    return features
+
+
+def save_online_state(state, path):
+    """
+    Guardar el estado del modo online en un .json
+
+    Parameters
+    ----------
+    state : dict
+        Estado del modo online.
+    path : string
+        Path al .json.
+
+    Returns
+    -------
+    None.
+
+    """
+    state = dict(state)
+    state["buffer"] = state["buffer"].tolist()
+    if "ewm" in state:
+        state["ewm"] = {key: value.tolist()
+                        for key, value in state["ewm"].items()}
+    if state["last_date"] is not None:
+        state["last_date"] = state["last_date"].strftime("%Y-%m-%d")
+    with open(path, "w") as file:
+        json.dump(state, file, indent=4)
+
+
+def load_online_state(path):
+    """
+    Cargar el estado del modo online desde un .json
+
+    Parameters
+    ----------
+    path : string
+        Path al .json.
+
+    Returns
+    -------
+    state : dict
+        Estado del modo online.
+
+    """
+    with open(path) as file:
+        state = json.load(file)
+    state["buffer"] = np.array(state["buffer"], dtype=np.float64)
+    if "ewm" in state:
+        state["ewm"] = {key: np.array(value, dtype=np.float64)
+                        for key, value in state["ewm"].items()}
+    state["specs"] = [(window, tuple(stats))
+                      for window, stats in state["specs"]]
+    if state["last_date"] is not None:
+        state["last_date"] = pd.Timestamp(state["last_date"])
+    return state
@@ -1,8 +1,26 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+import statsmodels
 from statsmodels.tsa.stattools import adfuller
+from statsmodels.tsa.adfvalues import mackinnonp, mackinnoncrit
+from src.preprocessing.cache import CACHE_DIR
+from src.preprocessing.feature_engineering import TRANSFORMS, transform_block
+from src.preprocessing.lag_discovery import fast_length
 
+STATIONARITY_CACHE_PATH = os.path.join(CACHE_DIR, "stationarity.sqlite")
 
-def stationary_adf_test(df, cols):
+# contadores del cache persistente de resultados, por proceso
+STATIONARITY_CACHE = {"hits": 0, "misses": 0}
+
+
+def stationary_adf_test(df, cols, n_jobs=1, verbose=True, chunksize=None,
+                        method="adfuller", cache_path=None):
     """
     Test de estacionaridad
     Augmented Dickey-Fuller puede ser una de las más utilizadas.
@@ -43,34 +61,1203 @@ def stationary_adf_test(df, cols):
         columnas.
     cols : list
         Lista de columnas.
+    n_jobs : int, optional
+        Cantidad de procesos para correr los tests en paralelo, con 1 se
+        corren uno tras otro. The default is 1.
+    verbose : bool, optional
+        Imprimir el resultado de cada columna, con False solo se retorna la
+        tabla de resultados. The default is True.
+    chunksize : int, optional
+        Columnas por tarea enviada a cada proceso. The default is None,
+        se reparten en cerca de 4 tareas por proceso.
+    method : string, optional
+        "adfuller" corre adfuller de statsmodels columna por columna,
+        "batched" corre batched_adf sobre todas las columnas numéricas a la
+        vez (n_jobs y chunksize no se usan). The default is "adfuller".
+    cache_path : string, optional
+        Base sqlite donde se guardan los resultados, con la llave
+        adf_cache_key de los valores de cada columna. Solo se corre el test
+        en las columnas nuevas o que cambiaron. The default is None, sin
+        cache.
 
     Returns
     -------
     output : pandas.dataframe
-        Resultados del test.
+        Resultados del test, una fila por columna. Las columnas en que el
+        test falla quedan con valor_p nan y el mensaje en "error".
+
+    """
+    if method not in ("adfuller", "batched"):
+        raise ValueError(f"Método no soportado: {method}")
+    cols = list(cols)
+    if cache_path is None:
+        output = run_adf(df, cols, n_jobs, chunksize, method)
+    else:
+        keys = [adf_cache_key(df[col], method) for col in cols]
+        cached = read_adf_cache(cache_path, keys)
+        pending = [col for col, key in zip(cols, keys) if key not in cached]
+        STATIONARITY_CACHE["hits"] += len(cols) - len(pending)
+        STATIONARITY_CACHE["misses"] += len(pending)
+        records = dict(zip(pending,
+                           run_adf(df, pending, n_jobs, chunksize, method)))
+        # los errores no se guardan, se vuelven a intentar en la próxima
+        write_adf_cache(cache_path, {
+            key: records[col] for col, key in zip(cols, keys)
+            if col in records and records[col][-1] is None})
+        output = [records[col] if col in records else
+                  [col] + cached[key][1:] for col, key in zip(cols, keys)]
+    if verbose:
+        for record in output:
+            print_adf_result(record)
+    output = pd.DataFrame(output, columns=["columna", "resultado",
+                                           "valor_p", "intervalos",
+                                           "estadistico", "lags", "nobs",
+                                           "error"])
+    return output
+
+
+def run_adf(df, cols, n_jobs, chunksize, method):
+    """
+    Corre el test ADF sobre las columnas, en serie, en paralelo o en lote.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Dataframe con las columnas.
+    cols : list
+        Lista de columnas.
+    n_jobs : int
+        Cantidad de procesos.
+    chunksize : int
+        Columnas por tarea, None para repartir en cerca de 4 tareas por
+        proceso.
+    method : string
+        "adfuller" o "batched".
+
+    Returns
+    -------
+    output : list
+        Resultado de cada columna, ver adf_column.
+
+    """
+    if not cols:
+        return []
+    if method == "batched":
+        return batched_adf_records(df, cols)
+    if n_jobs == 1:
+        return adf_chunk(df[cols])
+    # se manda a cada proceso un bloque de columnas de una vez
+    if chunksize is None:
+        chunksize = max(1, len(cols) // (4 * n_jobs))
+    starts = range(0, len(cols), chunksize)
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = [executor.submit(adf_chunk, df[cols[i:i + chunksize]])
+                   for i in starts]
+        output = [record for future in futures
+                  for record in future.result()]
+    return output
+
+
+def adf_cache_key(series, method):
+    """
+    Llave de cache del test ADF de una columna: hash de sus valores (con
+    tipo y largo), del método y de la versión de statsmodels, que define
+    las tablas de valores p. No depende del nombre de la columna.
+
+    Parameters
+    ----------
+    series : pandas.series
+        Columna.
+    method : string
+        "adfuller" o "batched".
+
+    Returns
+    -------
+    key : string
+        Hash hexadecimal.
+
+    """
+    params = {"test": "adf", "method": method, "regression": "c",
+              "autolag": "AIC", "statsmodels": statsmodels.__version__}
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode())
+    if pd.api.types.is_numeric_dtype(series) or \
+            pd.api.types.is_datetime64_any_dtype(series):
+        values = np.ascontiguousarray(series.to_numpy())
+        digest.update(f"{values.dtype.str}{values.shape}".encode())
+        digest.update(values.tobytes())
+    else:
+        digest.update(f"{series.dtype}{len(series)}".encode())
+        digest.update(
+            pd.util.hash_pandas_object(series, index=False).values.tobytes())
+    key = digest.hexdigest()[0:16]
+    return key
+
+
+def connect_adf_cache(cache_path):
+    """
+    Abre la base sqlite del cache de resultados, creando la tabla si no
+    existe.
+
+    Parameters
+    ----------
+    cache_path : string
+        Path de la base sqlite.
+
+    Returns
+    -------
+    connection : sqlite3.Connection
+        Conexión a la base.
 
     """
+    folder = os.path.dirname(cache_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    connection = sqlite3.connect(cache_path)
+    connection.execute("CREATE TABLE IF NOT EXISTS adf_results "
+                       "(key TEXT PRIMARY KEY, record TEXT, created REAL)")
+    return connection
+
+
+def read_adf_cache(cache_path, keys):
+    """
+    Busca en el cache los resultados guardados de las llaves dadas.
+
+    Parameters
+    ----------
+    cache_path : string
+        Path de la base sqlite.
+    keys : list
+        Llaves de adf_cache_key.
+
+    Returns
+    -------
+    cached : dict
+        Resultado guardado de cada llave encontrada, ver adf_column.
+
+    """
+    cached = {}
+    unique = list(set(keys))
+    connection = connect_adf_cache(cache_path)
+    try:
+        # sqlite limita la cantidad de parámetros por consulta
+        for i in range(0, len(unique), 500):
+            block = unique[i:i + 500]
+            rows = connection.execute(
+                "SELECT key, record FROM adf_results WHERE key IN "
+                f"({','.join('?' * len(block))})", block)
+            for key, record in rows:
+                record = json.loads(record)
+                record[3] = [tuple(item) for item in record[3]]
+                cached[key] = record
+    finally:
+        connection.close()
+    return cached
+
+
+def write_adf_cache(cache_path, records):
+    """
+    Guarda resultados en el cache, reemplazando los de la misma llave.
+
+    Parameters
+    ----------
+    cache_path : string
+        Path de la base sqlite.
+    records : dict
+        Resultado de cada llave, ver adf_column.
+
+    Returns
+    -------
+    None.
+
+    """
+    if not records:
+        return
+    now = time.time()
+    rows = [(key, json.dumps([record[0], record[1], float(record[2]),
+                              [[name, float(value)]
+                               for name, value in record[3]],
+                              float(record[4]), int(record[5]),
+                              int(record[6]), record[7]]), now)
+            for key, record in records.items()]
+    connection = connect_adf_cache(cache_path)
+    try:
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO adf_results VALUES (?, ?, ?)", rows)
+    finally:
+        connection.close()
+
+
+def invalidate_stationarity_cache(cache_path=STATIONARITY_CACHE_PATH,
+                                  keys=None, older_than=None):
+    """
+    Borrar resultados del cache persistente.
+
+    Parameters
+    ----------
+    cache_path : string, optional
+        Path de la base sqlite. The default is STATIONARITY_CACHE_PATH.
+    keys : list, optional
+        Llaves a borrar, ver adf_cache_key. The default is None, todas.
+    older_than : float, optional
+        Borrar solo los resultados guardados hace más de older_than
+        segundos. The default is None.
+
+    Returns
+    -------
+    removed : int
+        Cantidad de resultados borrados.
+
+    """
+    if not os.path.exists(cache_path):
+        return 0
+    query = "DELETE FROM adf_results WHERE 1 = 1"
+    params = []
+    if older_than is not None:
+        query += " AND created < ?"
+        params.append(time.time() - older_than)
+    connection = connect_adf_cache(cache_path)
+    try:
+        with connection:
+            if keys is None:
+                removed = connection.execute(query, params).rowcount
+            else:
+                keys = list(keys)
+                removed = 0
+                for i in range(0, len(keys), 500):
+                    block = keys[i:i + 500]
+                    removed += connection.execute(
+                        query + f" AND key IN ({','.join('?' * len(block))})",
+                        params + block).rowcount
+    finally:
+        connection.close()
+    return removed
+
+
+def stationarity_cache_info(cache_path=STATIONARITY_CACHE_PATH):
+    """
+    Estado del cache persistente de resultados.
+
+    Parameters
+    ----------
+    cache_path : string, optional
+        Path de la base sqlite. The default is STATIONARITY_CACHE_PATH.
+
+    Returns
+    -------
+    info : dict
+        Hits y misses de este proceso, tasa de hits, cantidad de resultados
+        guardados y tamaño de la base en bytes.
+
+    """
+    hits = STATIONARITY_CACHE["hits"]
+    misses = STATIONARITY_CACHE["misses"]
+    entries = 0
+    if os.path.exists(cache_path):
+        connection = connect_adf_cache(cache_path)
+        try:
+            entries = connection.execute(
+                "SELECT COUNT(*) FROM adf_results").fetchone()[0]
+        finally:
+            connection.close()
+    info = {"hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else np.nan,
+            "entries": entries,
+            "nbytes": os.path.getsize(cache_path)
+            if os.path.exists(cache_path) else 0}
+    return info
+
+
+def reset_stationarity_cache_info():
+    """
+    Reinicia los contadores de hits y misses del cache persistente.
+
+    Returns
+    -------
+    None.
+
+    """
+    STATIONARITY_CACHE["hits"] = 0
+    STATIONARITY_CACHE["misses"] = 0
+
+
+def adf_chunk(df):
+    """
+    Corre el test ADF sobre un bloque de columnas, sin imprimir nada.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Dataframe con las columnas del bloque.
+
+    Returns
+    -------
+    output : list
+        Resultado de cada columna, ver adf_column.
+
+    """
+    output = [adf_column(col, df[col].to_numpy()) for col in df.columns]
+    return output
+
+
+def batched_adf_records(df, cols):
+    """
+    Corre batched_adf sobre las columnas numéricas y arma el resultado de
+    cada columna igual que adf_column.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Dataframe con las columnas.
+    cols : list
+        Lista de columnas.
+
+    Returns
+    -------
+    output : list
+        Resultado de cada columna, ver adf_column.
+
+    """
+    numeric = [col for col in cols if pd.api.types.is_numeric_dtype(df[col])]
+    result = batched_adf(df[numeric].to_numpy(dtype=np.float64))
     output = []
-    for col in cols:
+    for j, col in enumerate(numeric):
+        error = result["error"][j]
+        if error is not None:
+            output.append([col, "No hubo convergencia", np.nan, [], np.nan,
+                           np.nan, np.nan, error])
+            continue
+        p = result["valor_p"][j]
+        output.append([col, comentary_stationarity(p), p,
+                       result["intervalos"][j], result["estadistico"][j],
+                       result["lags"][j], result["nobs"][j], None])
+    records = dict(zip(numeric, output))
+    output = [records[col] if col in records else
+              [col, "No hubo convergencia", np.nan, [], np.nan, np.nan,
+               np.nan, "TypeError: la columna no es numérica"]
+              for col in cols]
+    return output
+
+
+def adf_column(col, values):
+    """
+    Corre el test ADF sobre una columna y guarda el error si falla.
+
+    Parameters
+    ----------
+    col : string
+        Nombre de la columna.
+    values : numpy.array
+        Valores de la columna.
+
+    Returns
+    -------
+    record : list
+        columna, resultado, valor_p, intervalos, estadistico, lags, nobs y
+        error (None si el test corrió).
+
+    """
+    try:
+        result = adfuller(values)
+    except Exception as error:
+        return [col, "No hubo convergencia", np.nan, [], np.nan, np.nan,
+                np.nan, f"{type(error).__name__}: {error}"]
+    p = result[1]
+    record = [col, comentary_stationarity(p), p, list(result[4].items()),
+              result[0], result[2], result[3], None]
+    return record
+
+
+def print_adf_result(record):
+    """
+    Imprime el resultado del test ADF de una columna.
+
+    Parameters
+    ----------
+    record : list
+        Resultado de adf_column.
+
+    Returns
+    -------
+    None.
+
+    """
+    col, comment, p, intervals, statistic, _, _, error = record
+    if error is not None:
+        print("No hubo convergencia")
+        return
+    print("Para la columna: ", col)
+    print(comment)
+    print('ADF estadisticas: %f' % statistic)
+    print('Valor de p: %f' % p)
+    print('Valores criticos:')
+    for key, value in intervals:
+        print('\t%s: %.3f' % (key, value))
+
+
+# regularización de las matrices de Gram escaladas (diagonal 1) del ADF en
+# lote
+RIDGE = 1e-12
+
+
+def adf_design(x, lag, nobs):
+    """
+    Regresión ADF de muchas series a la vez para un lag: la diferencia de
+    cada serie contra su nivel anterior y sus lag diferencias anteriores,
+    sobre las últimas nobs observaciones.
+
+    Parameters
+    ----------
+    x : numpy.array
+        Series ordenadas en el tiempo, de (filas, columnas).
+    lag : int
+        Cantidad de diferencias anteriores.
+    nobs : int
+        Observaciones de la regresión.
+
+    Returns
+    -------
+    design : numpy.array
+        Regresores de (columnas, nobs, lag + 1), el nivel primero.
+    target : numpy.array
+        Diferencias de (columnas, nobs).
+
+    """
+    xdiff = np.diff(x, axis=0)
+    n_diff = len(xdiff)
+    design = np.empty((x.shape[1], nobs, lag + 1))
+    design[:, :, 0] = x[-nobs - 1:-1].T
+    for j in range(1, lag + 1):
+        design[:, :, j] = xdiff[n_diff - nobs - j:n_diff - j].T
+    target = xdiff[-nobs:].T
+    return design, target
+
+
+def partial_out(design, target, nobs, regression):
+    """
+    Saca de los regresores y del target los términos determinísticos
+    (constante y tendencia) proyectando sobre ellos (Frisch-Waugh-Lovell),
+    así el coeficiente del nivel y su t-stat quedan iguales, y escala cada
+    regresor a norma 1 para que el sistema quede bien condicionado.
+
+    Parameters
+    ----------
+    design : numpy.array
+        Regresores de (columnas, nobs, k).
+    target : numpy.array
+        Target de (columnas, nobs).
+    nobs : int
+        Observaciones de la regresión.
+    regression : string
+        "c" constante, "ct" constante y tendencia, "n" ninguno.
+
+    Returns
+    -------
+    design : numpy.array
+        Regresores sin los términos determinísticos y escalados.
+    target : numpy.array
+        Target sin los términos determinísticos.
+
+    """
+    if regression != "n":
+        terms = [np.ones(nobs)]
+        if regression == "ct":
+            terms.append(np.arange(1, nobs + 1, dtype=np.float64))
+        terms = np.column_stack(terms)
+        projection = np.linalg.pinv(terms)
+        design = design - terms @ (projection @ design)
+        target = target - (projection @ target.T).T @ terms.T
+    norms = np.sqrt(np.einsum("mnk,mnk->mk", design, design))
+    design = design / np.where(norms > 0, norms, 1.0)[:, None, :]
+    return design, target
+
+
+def batched_adf(values, maxlag=None, regression="c", autolag="AIC"):
+    """
+    Test ADF de muchas series a la vez con numpy, igual que adfuller de
+    statsmodels. Para un lag todas las regresiones tienen el mismo diseño,
+    así que se arman juntas y se resuelven con ecuaciones normales en lote
+    (matrices de (series, k, k)). Con autolag se busca el lag con menor AIC
+    o BIC sobre la misma muestra, reusando las sub-matrices de la matriz de
+    Gram del lag máximo, y después se vuelve a estimar cada serie con su
+    lag. Los valores p y críticos son los de MacKinnon.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Series ordenadas en el tiempo, de (filas, columnas), sin nans.
+    maxlag : int, optional
+        Lag máximo. The default is None, 12 * (filas / 100) ^ (1 / 4) como
+        adfuller.
+    regression : string, optional
+        "c" constante, "ct" constante y tendencia, "n" ninguno.
+        The default is "c".
+    autolag : string, optional
+        "AIC", "BIC" o None para usar maxlag. The default is "AIC".
+
+    Returns
+    -------
+    output : dict
+        Arreglos por columna: "estadistico", "valor_p", "lags", "nobs",
+        "intervalos" (valores críticos) y "error" (None si el test corrió).
+
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n_rows, n_cols = values.shape
+    ntrend = len(regression) if regression != "n" else 0
+    if maxlag is None:
+        maxlag = int(np.ceil(12.0 * np.power(n_rows / 100.0, 1 / 4.0)))
+        maxlag = min(n_rows // 2 - ntrend - 1, maxlag)
+    if maxlag < 0 or maxlag > n_rows // 2 - ntrend - 1:
+        raise ValueError("maxlag debe ser menor a filas / 2 - 1 - ntrend")
+    statistic = np.full(n_cols, np.nan)
+    used = np.full(n_cols, maxlag)
+    error = series_errors(values)
+    valid = np.flatnonzero(error == None)  # noqa: E711
+    # bloques de columnas para acotar la memoria del diseño
+    chunk = max(1, int(2e7 // (n_rows * (maxlag + 1))))
+    for start in range(0, len(valid), chunk):
+        cols = valid[start:start + chunk]
+        x = values[:, cols]
+        if autolag:
+            used[cols] = adf_lag_search(x, maxlag, regression, autolag)
+        for lag in np.unique(used[cols]):
+            group = used[cols] == lag
+            statistic[cols[group]] = adf_statistic(x[:, group], lag,
+                                                   regression)
+    nobs = n_rows - 1 - used
+    pvalue = np.array([mackinnonp(stat, regression=regression, N=1)
+                       if np.isfinite(stat) else np.nan
+                       for stat in statistic])
+    critical = {}
+    intervals = []
+    for j in range(n_cols):
+        if error[j] is not None:
+            intervals.append([])
+            continue
+        if nobs[j] not in critical:
+            crit = mackinnoncrit(N=1, regression=regression, nobs=nobs[j])
+            critical[nobs[j]] = [("1%", crit[0]), ("5%", crit[1]),
+                                 ("10%", crit[2])]
+        intervals.append(critical[nobs[j]])
+    output = {"estadistico": statistic, "valor_p": pvalue, "lags": used,
+              "nobs": nobs, "intervalos": intervals, "error": error}
+    return output
+
+
+def adf_lag_search(x, maxlag, regression, autolag):
+    """
+    Lag con menor criterio de información de cada serie, todas las
+    regresiones sobre la misma muestra del lag máximo como adfuller.
+
+    Parameters
+    ----------
+    x : numpy.array
+        Series de (filas, columnas).
+    maxlag : int
+        Lag máximo.
+    regression : string
+        Términos determinísticos.
+    autolag : string
+        "AIC" o "BIC".
+
+    Returns
+    -------
+    lags : numpy.array
+        Lag elegido de cada serie.
+
+    """
+    nobs = len(x) - 1 - maxlag
+    ntrend = len(regression) if regression != "n" else 0
+    design, target = adf_design(x, maxlag, nobs)
+    design, target = partial_out(design, target, nobs, regression)
+    gram = design.transpose(0, 2, 1) @ design
+    cross = (design.transpose(0, 2, 1) @ target[:, :, None])[:, :, 0]
+    total = np.einsum("mn,mn->m", target, target)
+    # los modelos estan anidados: con la factorización de cholesky de la
+    # matriz de Gram completa, G = L L', la suma de residuos del modelo con
+    # los primeros k regresores es total - sum(z[:k] ** 2), con L z = X'y.
+    # La pequeña regularización evita fallar en diseños singulares.
+    lower = np.linalg.cholesky(gram + RIDGE * np.eye(maxlag + 1))
+    z = np.linalg.solve(lower, cross[:, :, None])[:, :, 0]
+    ssr = np.maximum(total[:, None] - np.cumsum(z * z, axis=1), 1e-300)
+    params = np.arange(1, maxlag + 2) + ntrend
+    llf = -nobs / 2 * (np.log(2 * np.pi) + np.log(ssr / nobs) + 1)
+    penalty = 2 * params if autolag.upper() == "AIC" else \
+        np.log(nobs) * params
+    criteria = -2 * llf + penalty
+    # en un empate gana el lag más chico, igual que adfuller
+    lags = np.argmin(criteria, axis=1)
+    return lags
+
+
+def adf_statistic(x, lag, regression):
+    """
+    Estadístico ADF (t-stat del nivel) de muchas series con el mismo lag,
+    sobre todas las observaciones disponibles para ese lag.
+
+    Parameters
+    ----------
+    x : numpy.array
+        Series de (filas, columnas).
+    lag : int
+        Lag de las diferencias.
+    regression : string
+        Términos determinísticos.
+
+    Returns
+    -------
+    statistic : numpy.array
+        Estadístico de cada serie.
+
+    """
+    nobs = len(x) - 1 - lag
+    ntrend = len(regression) if regression != "n" else 0
+    design, target = adf_design(x, lag, nobs)
+    design, target = partial_out(design, target, nobs, regression)
+    # pseudo-inversa del diseño con svd, igual que OLS de statsmodels
+    u, singular, vt = np.linalg.svd(design, full_matrices=False)
+    cutoff = 1e-15 * singular.max(axis=1, keepdims=True)
+    safe = np.where(singular > cutoff, singular, 1)
+    inverse = np.where(singular > cutoff, 1 / safe, 0.0)
+    projected = (u.transpose(0, 2, 1) @ target[:, :, None])[:, :, 0]
+    coef = (vt.transpose(0, 2, 1) @ (inverse * projected)[:, :, None])
+    residuals = target - (design @ coef)[:, :, 0]
+    coef = coef[:, :, 0]
+    ssr = np.einsum("mn,mn->m", residuals, residuals)
+    sigma2 = ssr / (nobs - lag - 1 - ntrend)
+    variance = np.einsum("mj,mj->m", vt[:, :, 0] ** 2, inverse ** 2)
+    statistic = coef[:, 0] / np.sqrt(sigma2 * variance)
+    return statistic
+
+
+# valores críticos del KPSS de Kwiatkowski et al. (1992) para 10%, 5%, 2.5%
+# y 1%, igual que kpss de statsmodels
+KPSS_CRITICAL = {"c": [0.347, 0.463, 0.574, 0.739],
+                 "ct": [0.119, 0.146, 0.176, 0.216]}
+KPSS_PVALUES = [0.10, 0.05, 0.025, 0.01]
+
+
+def series_errors(values):
+    """
+    Error de cada serie que no se puede testear: con nans o infinitos, o
+    constante.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Series de (filas, columnas).
+
+    Returns
+    -------
+    error : numpy.array
+        Mensaje de error de cada serie, None si se puede testear.
+
+    """
+    error = np.full(values.shape[1], None, dtype=object)
+    finite = np.isfinite(values).all(axis=0)
+    constant = finite & (values.max(axis=0, initial=-np.inf) ==
+                         values.min(axis=0, initial=np.inf))
+    error[~finite] = "ValueError: la serie tiene valores nan o infinitos"
+    error[constant] = "ValueError: la serie es constante"
+    return error
+
+
+def detrend(x, regression):
+    """
+    Residuos de la regresión de cada serie sobre los términos
+    determinísticos.
+
+    Parameters
+    ----------
+    x : numpy.array
+        Series de (filas, columnas).
+    regression : string
+        "c" constante, "ct" constante y tendencia, "n" ninguno.
+
+    Returns
+    -------
+    resids : numpy.array
+        Residuos de (filas, columnas).
+
+    """
+    if regression == "n":
+        return x
+    resids = x - x.mean(axis=0)
+    if regression == "ct":
+        trend = np.arange(1, len(x) + 1, dtype=np.float64)
+        trend -= trend.mean()
+        resids = resids - np.outer(trend, trend @ resids / (trend @ trend))
+    return resids
+
+
+def autocovariance_sums(resids, max_lag):
+    """
+    Sumas sum_t r(t) * r(t - i) para i = 0..max_lag de todas las series, con
+    FFT.
+
+    Parameters
+    ----------
+    resids : numpy.array
+        Series de (filas, columnas).
+    max_lag : int
+        Lag máximo, menor a filas.
+
+    Returns
+    -------
+    sums : numpy.array
+        Arreglo de (max_lag + 1, columnas).
+
+    """
+    nfft = fast_length(len(resids) + max_lag + 1)
+    spectrum = np.fft.rfft(resids, n=nfft, axis=0)
+    sums = np.fft.irfft(spectrum * np.conj(spectrum), n=nfft, axis=0)
+    return sums[:max_lag + 1]
+
+
+def bartlett_sums(sums, lags):
+    """
+    Suma de las autocovarianzas con los pesos de Bartlett (Newey-West) de
+    cada serie, sums[0] + 2 * sum_i (1 - i / (lags + 1)) * sums[i].
+
+    Parameters
+    ----------
+    sums : numpy.array
+        Sumas de autocovarianzas de (max_lag + 1, columnas).
+    lags : numpy.array
+        Lags de cada serie, a lo más max_lag.
+
+    Returns
+    -------
+    total : numpy.array
+        Suma ponderada de cada serie.
+
+    """
+    i = np.arange(1, len(sums))[:, None]
+    weights = np.where(i <= lags, 1 - i / (lags + 1.0), 0.0)
+    total = sums[0] + 2 * np.einsum("ij,ij->j", weights, sums[1:])
+    return total
+
+
+def batched_kpss(values, regression="c", nlags="auto"):
+    """
+    Test KPSS de muchas series a la vez con numpy, igual que kpss de
+    statsmodels. La hipótesis nula es que la serie es estacionaria, así
+    que un valor p > 0.05 sugiere estacionaridad. Las autocovarianzas de
+    todas las series se calculan de una vez con FFT. Los valores p se
+    interpolan en la tabla de Kwiatkowski et al., quedan entre 0.01 y 0.1.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Series ordenadas en el tiempo, de (filas, columnas), sin nans.
+    regression : string, optional
+        "c" estacionaria en nivel, "ct" estacionaria en tendencia.
+        The default is "c".
+    nlags : string or int, optional
+        "auto" el lag de Hobijn et al. (1998), "legacy"
+        12 * (filas / 100) ^ (1 / 4), o un entero. The default is "auto".
+
+    Returns
+    -------
+    output : dict
+        Arreglos por columna: "estadistico", "valor_p", "lags", "nobs",
+        "intervalos" (valores críticos) y "error" (None si el test corrió).
+
+    """
+    if regression not in KPSS_CRITICAL:
+        raise ValueError(f"Regresión no soportada: {regression}")
+    values = np.asarray(values, dtype=np.float64)
+    n_rows, n_cols = values.shape
+    statistic = np.full(n_cols, np.nan)
+    used = np.zeros(n_cols, dtype=np.int64)
+    error = series_errors(values)
+    valid = np.flatnonzero(error == None)  # noqa: E711
+    if len(valid):
+        resids = detrend(values[:, valid], regression)
+        sums = autocovariance_sums(resids, n_rows - 1)
+        if nlags == "auto":
+            covlags = int(np.power(n_rows, 2.0 / 9.0))
+            products = sums[1:covlags + 1] / (n_rows / 2.0)
+            s0 = sums[0] / n_rows + products.sum(axis=0)
+            s1 = np.arange(1, covlags + 1) @ products
+            gamma = 1.1447 * np.power((s1 / s0) ** 2, 1.0 / 3.0)
+            lags = (gamma * np.power(n_rows, 1.0 / 3.0)).astype(np.int64)
+        elif nlags == "legacy":
+            lags = np.full(len(valid),
+                           int(np.ceil(12.0 * np.power(n_rows / 100.0,
+                                                       1 / 4.0))))
+        else:
+            if nlags >= n_rows:
+                raise ValueError("nlags debe ser menor a filas")
+            lags = np.full(len(valid), int(nlags))
+        lags = np.minimum(lags, n_rows - 1)
+        s_hat = bartlett_sums(sums[:lags.max() + 1], lags) / n_rows
+        eta = np.einsum("ij,ij->j", np.cumsum(resids, axis=0),
+                        np.cumsum(resids, axis=0)) / n_rows ** 2
+        statistic[valid] = eta / s_hat
+        used[valid] = lags
+    crit = KPSS_CRITICAL[regression]
+    pvalue = np.interp(statistic, crit, KPSS_PVALUES)
+    pvalue[error != None] = np.nan  # noqa: E711
+    intervals = [[] if error[j] is not None else
+                 list(zip(["10%", "5%", "2.5%", "1%"], crit))
+                 for j in range(n_cols)]
+    output = {"estadistico": statistic, "valor_p": pvalue, "lags": used,
+              "nobs": np.full(n_cols, n_rows), "intervalos": intervals,
+              "error": error}
+    return output
+
+
+def batched_pp(values, lags=None, regression="c"):
+    """
+    Test de Phillips-Perron (estadístico Z-tau) de muchas series a la vez
+    con numpy, con la misma definición de PhillipsPerron del paquete arch.
+    Como el ADF, la hipótesis nula es raíz unitaria, pero en vez de agregar
+    diferencias rezagadas corrige el t-stat de la regresión
+    y(t) = rho * y(t - 1) + términos con la varianza de largo plazo de
+    Newey-West de los residuos. Los valores p y críticos son los de
+    MacKinnon, los mismos del ADF.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Series ordenadas en el tiempo, de (filas, columnas), sin nans.
+    lags : int, optional
+        Lags de Newey-West. The default is None,
+        12 * (filas / 100) ^ (1 / 4).
+    regression : string, optional
+        "c" constante, "ct" constante y tendencia, "n" ninguno.
+        The default is "c".
+
+    Returns
+    -------
+    output : dict
+        Arreglos por columna: "estadistico", "valor_p", "lags", "nobs",
+        "intervalos" (valores críticos) y "error" (None si el test corrió).
+
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n_rows, n_cols = values.shape
+    ntrend = len(regression) if regression != "n" else 0
+    if lags is None:
+        lags = int(np.ceil(12 * np.power(n_rows / 100.0, 1 / 4.0)))
+    nobs = n_rows - 1
+    if nobs < ntrend + 6 or lags >= nobs:
+        raise ValueError("Muy pocas observaciones para el test de "
+                         "Phillips-Perron")
+    statistic = np.full(n_cols, np.nan)
+    error = series_errors(values)
+    valid = np.flatnonzero(error == None)  # noqa: E711
+    if len(valid):
+        # regresión de y(t) en y(t - 1) sacando los términos determinísticos
+        # de los dos lados (Frisch-Waugh-Lovell)
+        x = values[:, valid]
+        previous = detrend(x[:-1], regression)
+        current = detrend(x[1:], regression)
+        sxx = np.einsum("ij,ij->j", previous, previous)
+        rho = np.einsum("ij,ij->j", previous, current) / sxx
+        resids = current - rho * previous
+        k = 1 + ntrend
+        s2 = np.einsum("ij,ij->j", resids, resids) / (nobs - k)
+        sigma = np.sqrt(s2 / sxx)
+        gamma0 = s2 * (nobs - k) / nobs
+        sums = autocovariance_sums(resids, lags)
+        lam2 = bartlett_sums(sums, np.full(len(valid), lags)) / nobs
+        statistic[valid] = np.sqrt(gamma0 / lam2) * (rho - 1) / sigma - \
+            0.5 * ((lam2 - gamma0) / np.sqrt(lam2)) * \
+            (nobs * sigma / np.sqrt(s2))
+    pvalue = np.array([mackinnonp(stat, regression=regression, N=1)
+                       if np.isfinite(stat) else np.nan
+                       for stat in statistic])
+    crit = mackinnoncrit(N=1, regression=regression, nobs=nobs)
+    intervals = [[] if error[j] is not None else
+                 [("1%", crit[0]), ("5%", crit[1]), ("10%", crit[2])]
+                 for j in range(n_cols)]
+    output = {"estadistico": statistic, "valor_p": pvalue,
+              "lags": np.full(n_cols, lags), "nobs": np.full(n_cols, nobs),
+              "intervalos": intervals, "error": error}
+    return output
+
+
+# tests de estacionaridad en lote: función y si la hipótesis nula es
+# estacionaridad (KPSS) o raíz unitaria (ADF y PP)
+BATCHED_TESTS = {"adf": (batched_adf, False),
+                 "kpss": (batched_kpss, True),
+                 "pp": (batched_pp, False)}
+
+
+def difference_block(values, d, D, period=12):
+    """
+    Diferencia estacional D veces y regular d veces un bloque de series.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Series ordenadas en el tiempo, de (filas, columnas).
+    d : int
+        Diferencias regulares.
+    D : int
+        Diferencias estacionales.
+    period : int, optional
+        Periodo estacional. The default is 12.
+
+    Returns
+    -------
+    result : numpy.array
+        Arreglo de (filas, columnas), las primeras d + D * period filas
+        quedan en nan.
+
+    """
+    result = np.asarray(values, dtype=np.float64)
+    for _ in range(D):
+        result = transform_block(result, "seasonal_diff", period=period)
+    for _ in range(d):
+        result = transform_block(result, "diff", period=1)
+    return result
+
+
+def stationarity_votes(values, tests, alpha):
+    """
+    Corre los tests en lote y decide con cada uno si cada serie es
+    estacionaria.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Series de (filas, columnas).
+    tests : list
+        Tests de BATCHED_TESTS.
+    alpha : float
+        Nivel de significancia.
+
+    Returns
+    -------
+    votes : numpy.array
+        Arreglo booleano de (tests, columnas), True si el test sugiere
+        estacionaridad.
+    pvalues : numpy.array
+        Valores p de (tests, columnas).
+    error : numpy.array
+        Primer error de cada serie, None si todos los tests corrieron.
+
+    """
+    votes = np.zeros((len(tests), values.shape[1]), dtype=bool)
+    pvalues = np.full((len(tests), values.shape[1]), np.nan)
+    error = np.full(values.shape[1], None, dtype=object)
+    for i, test in enumerate(tests):
+        function, null_stationary = BATCHED_TESTS[test]
         try:
-            datai = df[[col]]
-            # datai = datai[datai[col] > 0]
-            result = adfuller(datai.values)
-            # descomprimir valores
-            p = result[1]
-            print("Para la columna: ", col)
-            print(comentary_stationarity(p))
-            print('ADF estadisticas: %f' % result[0])
-            print('Valor de p: %f' % result[1])
-            print('Valores criticos:')
-            for key, value in result[4].items():
-                print('\t%s: %.3f' % (key, value))
-            output.append([col, comentary_stationarity(p),
-                          p, list(result[4].items())])
-        except Exception:
-            print("No hubo convergencia")
-    output = pd.DataFrame(output, columns=["columna", "resultado",
-                                           "valor_p", "intervalos"])
+            result = function(values)
+        except ValueError as exception:
+            error[error == None] = f"ValueError: {exception}"  # noqa: E711
+            continue
+        pvalues[i] = result["valor_p"]
+        votes[i] = pvalues[i] > alpha if null_stationary else \
+            pvalues[i] <= alpha
+        missing = (error == None) & (result["error"] != None)  # noqa: E711
+        error[missing] = result["error"][missing]
+    return votes, pvalues, error
+
+
+def differencing_chunk(values, max_d, max_D, period, tests, rule, alpha):
+    """
+    Busca el orden de diferenciación de un bloque de series, ver
+    differencing_search.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Series de (filas, columnas).
+    max_d : int
+        Máximo de diferencias regulares.
+    max_D : int
+        Máximo de diferencias estacionales.
+    period : int
+        Periodo estacional.
+    tests : list
+        Tests de BATCHED_TESTS.
+    rule : string
+        "all", "majority" o "any".
+    alpha : float
+        Nivel de significancia.
+
+    Returns
+    -------
+    output : dict
+        Arreglos por columna: "d", "D", "estacionaria", los valores p de
+        cada test y "error".
+
+    """
+    n_cols = values.shape[1]
+    order = np.full((2, n_cols), -1, dtype=np.int64)
+    pvalues = np.full((len(tests), n_cols), np.nan)
+    error = np.full(n_cols, None, dtype=object)
+    pending = np.arange(n_cols)
+    needed = {"all": len(tests), "majority": len(tests) // 2 + 1,
+              "any": 1}[rule]
+    # primero menos diferencias en total, y a igual total las regulares
+    candidates = sorted(((d, D) for D in range(max_D + 1)
+                         for d in range(max_d + 1)),
+                        key=lambda c: (c[0] + c[1], c[1]))
+    for d, D in candidates:
+        if not len(pending):
+            break
+        start = d + D * period
+        block = difference_block(values[:, pending], d, D, period)[start:]
+        votes, block_pvalues, block_error = stationarity_votes(block, tests,
+                                                               alpha)
+        pvalues[:, pending] = block_pvalues
+        error[pending] = block_error
+        found = (votes.sum(axis=0) >= needed) & \
+            (block_error == None)  # noqa: E711
+        order[:, pending[found]] = [[d], [D]]
+        pending = pending[~found]
+    output = {"d": order[0], "D": order[1], "estacionaria": order[0] >= 0,
+              "error": error}
+    for i, test in enumerate(tests):
+        output[f"{test}_p"] = pvalues[i]
+    return output
+
+
+def differencing_search(df, cols, max_d=2, max_D=1, period=12,
+                        tests=("adf", "kpss", "pp"), rule="majority",
+                        alpha=0.05, n_jobs=1, chunksize=None):
+    """
+    Busca para cada columna el menor orden de diferenciación, regular d y
+    estacional D, con el que es estacionaria. Se prueban los órdenes de
+    menos a más diferencias en total (a igual total primero las regulares)
+    y en cada orden se corren ADF, KPSS y PP en lote sobre todas las
+    columnas que todavía no son estacionarias. El resultado es un plan de
+    transformaciones para apply_differencing_plan. El dataframe tiene que
+    estar ordenado por fecha.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Dataframe con las columnas.
+    cols : list
+        Columnas numéricas a revisar.
+    max_d : int, optional
+        Máximo de diferencias regulares. The default is 2.
+    max_D : int, optional
+        Máximo de diferencias estacionales. The default is 1.
+    period : int, optional
+        Periodo estacional, 12 para datos mensuales. The default is 12.
+    tests : list, optional
+        Tests a correr, de "adf", "kpss" y "pp".
+        The default is ("adf", "kpss", "pp").
+    rule : string, optional
+        Cuántos tests tienen que sugerir estacionaridad: "all", "majority"
+        o "any". The default is "majority".
+    alpha : float, optional
+        Nivel de significancia. The default is 0.05.
+    n_jobs : int, optional
+        Cantidad de procesos, cada uno busca sobre un bloque de columnas.
+        The default is 1.
+    chunksize : int, optional
+        Columnas por tarea enviada a cada proceso. The default is None,
+        se reparten en cerca de 4 tareas por proceso.
+
+    Returns
+    -------
+    plan : pandas.dataframe
+        Una fila por columna con d, D, periodo, si se encontró un orden
+        estacionario, el valor p de cada test con ese orden (o con el
+        último probado) y el error si los tests no corrieron. d y D quedan
+        nulos si ningún orden es estacionario.
+
+    """
+    if rule not in ("all", "majority", "any"):
+        raise ValueError(f"Regla no soportada: {rule}")
+    unknown = [test for test in tests if test not in BATCHED_TESTS]
+    if unknown:
+        raise ValueError(f"Tests no soportados: {unknown}")
+    cols = list(cols)
+    tests = list(tests)
+    values = df[cols].to_numpy(dtype=np.float64)
+    args = (max_d, max_D, period, tests, rule, alpha)
+    if n_jobs == 1:
+        outputs = [differencing_chunk(values, *args)]
+    else:
+        if chunksize is None:
+            chunksize = max(1, len(cols) // (4 * n_jobs))
+        starts = range(0, len(cols), chunksize)
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(differencing_chunk,
+                                       values[:, i:i + chunksize], *args)
+                       for i in starts]
+            outputs = [future.result() for future in futures]
+    output = {key: np.concatenate([chunk[key] for chunk in outputs])
+              for key in outputs[0]}
+    plan = pd.DataFrame({"columna": cols,
+                         "d": pd.array(np.where(output["estacionaria"],
+                                                output["d"], 0),
+                                       dtype="Int64"),
+                         "D": pd.array(np.where(output["estacionaria"],
+                                                output["D"], 0),
+                                       dtype="Int64"),
+                         "periodo": period,
+                         "estacionaria": output["estacionaria"]})
+    plan.loc[~plan["estacionaria"], ["d", "D"]] = pd.NA
+    for test in tests:
+        plan[f"{test}_p"] = output[f"{test}_p"]
+    plan["error"] = output["error"]
+    return plan
+
+
+def apply_differencing_plan(df, plan, drop_nonstationary=True,
+                            date_column="date"):
+    """
+    Aplica un plan de differencing_search de una vez: las columnas con el
+    mismo orden se diferencian juntas en bloque. Las columnas que no hay
+    que diferenciar quedan con su nombre, las demás se renombran como
+    add_transforms, por ejemplo col_sdiff_12_diff_1 para D = 1 y d = 1, y
+    quedan con nan en las primeras d + D * periodo filas. El dataframe
+    tiene que estar ordenado por fecha.
+
+    Parameters
+    ----------
+    df : pandas.dataframe
+        Dataframe con las columnas del plan.
+    plan : pandas.dataframe
+        Plan de differencing_search.
+    drop_nonstationary : bool, optional
+        Sacar las columnas sin orden estacionario, con False quedan sin
+        transformar. The default is True.
+    date_column : string, optional
+        Columna de fechas, se mantiene al principio. The default is "date".
+
+    Returns
+    -------
+    output : pandas.dataframe
+        Dataframe con la columna de fechas y las columnas transformadas.
+
+    """
+    blocks = []
+    if date_column in df.columns:
+        blocks.append(df[[date_column]])
+    stationary = plan[plan["estacionaria"]]
+    if not drop_nonstationary:
+        stationary = plan.fillna({"d": 0, "D": 0})
+    groups = stationary.groupby(["d", "D", "periodo"], sort=False)
+    for (d, D, period), group in groups:
+        d, D, period = int(d), int(D), int(period)
+        cols = list(group["columna"])
+        names = []
+        for col in cols:
+            name = col
+            for _ in range(D):
+                name = TRANSFORMS["seasonal_diff"][0].format(col=name,
+                                                             period=period)
+            for _ in range(d):
+                name = TRANSFORMS["diff"][0].format(col=name, period=1)
+            names.append(name)
+        values = difference_block(df[cols].to_numpy(dtype=np.float64),
+                                  d, D, period)
+        blocks.append(pd.DataFrame(values, index=df.index, columns=names))
+    output = pd.concat(blocks, axis=1)
     return output
 
 